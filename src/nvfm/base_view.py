@@ -1,10 +1,49 @@
 from .event import EventEmitter
 from .util import logger
 
+# Maximum number of unused buffers kept for reuse
+BUFFER_POOL_SIZE = 16
+
+
+class BufferPool:
+    """Scratch buffers that views borrow and give back.
+
+    Buffers are configured once when they're created, so reusing one only
+    costs clearing it. They're never named: renaming a buffer leaves a buffer
+    with the old name behind, so views keep their path in `b:nvfm_path`.
+    """
+
+    def __init__(self, vim, size=BUFFER_POOL_SIZE):
+        self._vim = vim
+        self._size = size
+        self._free = []
+
+    def acquire(self):
+        """Return an empty buffer."""
+        if self._free:
+            return self._free.pop()
+        buf = self._vim.request(
+            'nvim_create_buf',
+            True, # listed
+            False, # scratch
+        )
+        buf.request('nvim_buf_set_option', 'buftype', 'nowrite')
+        buf.request('nvim_buf_set_option', 'bufhidden', 'hide')
+        return buf
+
+    def release(self, buf):
+        """Take back `buf`, which mustn't be displayed anymore."""
+        if len(self._free) >= self._size:
+            self._vim.command('bwipeout! %d' % buf.number)
+            return
+        buf.request('nvim_buf_clear_namespace', -1, 0, -1)
+        buf.request('nvim_buf_set_lines', 0, -1, False, [])
+        buf.request('nvim_buf_set_option', 'filetype', '')
+        self._free.append(buf)
+
 
 class View(EventEmitter):
 
-    VIEW_PREFIX = 'nvfm_view:'
     cursor = None
 
     def __init__(self, session, vim, path):
@@ -12,40 +51,47 @@ class View(EventEmitter):
         self._s = session
         self._vim = vim
         self.path = path
-        self.buf = self._create_buf()
+        self.buf = self._s.buffers.acquire()
         self._buf_configured = False
         self.dirty = 2
+        # Result of `load()` if it was computed in the background
+        self.preloaded = None
         self._s.events.manage(self, register_handlers=False)
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__, self.path)
 
-    def _create_buf(self):
-        return self._vim.request(
-            'nvim_create_buf',
-            True, # listed
-            False, # scratch
-        )
-
     def protocol_init(self):
         if self.dirty >= 2:
             logger.debug('view:init:%s', self)
             self.init()
+            self.preloaded = None
             self.dirty = 1
 
+    @classmethod
+    def load(cls, session, path): # pylint:disable=unused-argument
+        """Do the blocking file system work needed to display `path`.
+
+        This may run on a worker thread, so it must not make nvim requests.
+        `init()` gets the result from `_get_loaded()`.
+        """
+        return None
+
+    def _get_loaded(self):
+        """Return the result of `load()`, unless it was preloaded."""
+        if self.preloaded is not None:
+            return self.preloaded
+        return self.load(self._s, self.path)
+
     def init(self):
         pass
 
     def configure_buf(self):
-        # XXX Still required?
         if self._buf_configured:
             return
-        buf = self.buf
-        # TODO Do bulk request
-        buf.request('nvim_buf_set_option', 'buftype', 'nowrite')
-        buf.request('nvim_buf_set_option', 'bufhidden', 'hide')
+        # The buffer options are set by the pool
         if self.path is not None:
-            buf.name = self.VIEW_PREFIX + str(self.path)
+            self.buf.request('nvim_buf_set_var', 'nvfm_path', str(self.path))
         self._buf_configured = True
 
     def configure_win(self, win):
@@ -60,6 +106,21 @@ class View(EventEmitter):
     def draw(self):
         pass
 
+    @property
+    def panel(self):
+        """Return the panel that displays this view or `None`."""
+        for panel in self._s.panels:
+            if panel.view is self:
+                return panel
+        return None
+
+    def redraw(self):
+        """Redraw the view right away if it's currently displayed."""
+        self.dirty = max(self.dirty, 1)
+        panel = self.panel
+        if panel is not None:
+            panel.reload_view()
+
     def unload(self):
         pass
 
@@ -72,4 +133,4 @@ class View(EventEmitter):
 
     def remove(self):
         """Called when the view is removed from the view list."""
-        self._vim.command('bwipeout! %d' % self.buf.number)
+        self._s.buffers.release(self.buf)
@@ -0,0 +1,222 @@
+import marshal
+import os
+from pathlib import Path
+import sqlite3
+from stat import S_ISDIR, S_ISLNK
+import threading
+import time
+
+import appdirs
+
+from . import fs
+from .util import logger
+
+# Bump when the row layout changes, so stale caches are dropped
+CACHE_VERSION = 1
+
+# Max number of entries (summed over all directories) kept in the cache
+CACHE_SIZE_LIMIT = 2 * 10**6
+
+# Row layout: name, the ten `os.stat_result` fields, number of children
+STAT_FIELDS = ('st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_uid', 'st_gid',
+               'st_size', 'st_atime', 'st_mtime', 'st_ctime')
+
+# Index of the access time in rows
+_ATIME_INDEX = 1 + STAT_FIELDS.index('st_atime')
+
+
+def default_cache_path():
+    return Path(appdirs.user_cache_dir('nvfm')) / 'dirs.sqlite'
+
+
+class CachedEntry:
+    """A directory entry restored from the cache.
+
+    Mimics the parts of `os.DirEntry` that nvfm uses.
+    """
+    __slots__ = ('name', 'path', 'num_children', '_stat')
+
+    def __init__(self, dir_path, row):
+        self.name = row[0]
+        self.path = os.path.join(dir_path, row[0])
+        self._stat = os.stat_result(row[1:11])
+        self.num_children = row[11]
+
+    def __repr__(self):
+        return '<CachedEntry %r>' % self.name
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks and S_ISLNK(self._stat.st_mode):
+            return os.stat(self.path)
+        return self._stat
+
+    def is_dir(self, follow_symlinks=True):
+        try:
+            return S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        return S_ISLNK(self._stat.st_mode)
+
+    def inode(self):
+        return self._stat.st_ino
+
+
+def make_row(entry, num_children=None):
+    """Return the cache row of `entry` (an `os.DirEntry` or `CachedEntry`)."""
+    stat_res = entry.stat(follow_symlinks=False)
+    return (entry.name, *(getattr(stat_res, f) for f in STAT_FIELDS),
+            num_children)
+
+
+def comparable_row(row):
+    """Return `row` without the access time, which changes whenever a file
+    is read, so rows can be compared to tell whether a listing changed."""
+    return row[:_ATIME_INDEX] + row[_ATIME_INDEX + 1:]
+
+
+def count_children(path_str):
+    """Return the number of entries in directory `path_str` or `None`."""
+    try:
+        return len(fs.listdir(path_str))
+    except OSError:
+        return None
+
+
+def scan_rows(path):
+    """Scan directory `path` and return its stat and rows.
+
+    This performs all syscalls of a directory listing up front, so it's meant
+    to run in a worker thread.
+    """
+    path_str = str(path)
+    dir_stat = os.stat(path_str)
+    rows = []
+    for entry in os.scandir(path_str):
+        try:
+            stat_res = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        num_children = None
+        if S_ISDIR(stat_res.st_mode):
+            num_children = count_children(entry.path)
+        rows.append(make_row(entry, num_children))
+    return dir_stat, rows
+
+
+class DirCache:
+    """Persistent cache of directory listings.
+
+    Listings are stored per directory path and are only valid as long as the
+    directory's `(st_dev, st_ino, st_mtime_ns)` key doesn't change. The
+    database is opened lazily on first use. Once the total number of cached
+    entries exceeds `size_limit`, the least recently used directories are
+    pruned. The cache is used from worker threads too, so the connection is
+    guarded by a lock.
+    """
+
+    def __init__(self, path=None, size_limit=CACHE_SIZE_LIMIT):
+        self._path = Path(path) if path is not None else default_cache_path()
+        self._size_limit = size_limit
+        self._db = None
+        self._lock = threading.RLock()
+
+    @property
+    def db(self):
+        with self._lock:
+            if self._db is None:
+                self._db = self._connect()
+            return self._db
+
+    def _connect(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(self._path), check_same_thread=False)
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        if version != CACHE_VERSION:
+            db.execute('DROP TABLE IF EXISTS dirs')
+            db.execute('PRAGMA user_version = %d' % CACHE_VERSION)
+        db.execute('''CREATE TABLE IF NOT EXISTS dirs (
+            path TEXT PRIMARY KEY,
+            dev INTEGER, ino INTEGER, mtime_ns INTEGER,
+            size INTEGER, used REAL, rows BLOB)''')
+        db.commit()
+        return db
+
+    @staticmethod
+    def key(dir_stat):
+        return (dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns)
+
+    def get(self, path, dir_stat=None):
+        """Return the cached entries of directory `path`.
+
+        Return `None` if there is no valid cached listing.
+        """
+        path_str = str(path)
+        if dir_stat is None:
+            try:
+                dir_stat = os.stat(path_str)
+            except OSError:
+                return None
+        rows = self.get_rows(path_str, dir_stat)
+        if rows is None:
+            return None
+        return [CachedEntry(path_str, row) for row in rows]
+
+    def get_rows(self, path, dir_stat):
+        with self._lock:
+            return self._get_rows(str(path), dir_stat)
+
+    def _get_rows(self, path_str, dir_stat):
+        res = self.db.execute(
+            'SELECT dev, ino, mtime_ns, rows FROM dirs WHERE path = ?',
+            (path_str,)).fetchone()
+        if res is None or tuple(res[:3]) != self.key(dir_stat):
+            return None
+        try:
+            rows = marshal.loads(res[3])
+        except (EOFError, ValueError, TypeError):
+            logger.error(('cache:corrupt', path_str))
+            return None
+        self.db.execute('UPDATE dirs SET used = ? WHERE path = ?',
+                        (time.time(), path_str))
+        self.db.commit()
+        return rows
+
+    def put(self, path, dir_stat, rows):
+        """Store `rows` as the listing of directory `path`."""
+        if len(rows) > self._size_limit:
+            return
+        dev, ino, mtime_ns = self.key(dir_stat)
+        with self._lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (str(path), dev, ino, mtime_ns, len(rows), time.time(),
+                 marshal.dumps(rows)))
+            self.prune()
+            self.db.commit()
+
+    def prune(self):
+        """Drop least recently used listings until the size limit is met."""
+        with self._lock:
+            self._prune()
+
+    def _prune(self):
+        total = self.db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM dirs').fetchone()[0]
+        if total <= self._size_limit:
+            return
+        excess = total - self._size_limit
+        for path, size in self.db.execute(
+                'SELECT path, size FROM dirs ORDER BY used').fetchall():
+            if excess <= 0:
+                break
+            self.db.execute('DELETE FROM dirs WHERE path = ?', (path,))
+            excess -= size
+        logger.debug(('cache:pruned', total - self._size_limit))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,110 @@
+import argparse
+import os
+import sys
+
+from .color import ColorManager
+from .config import sort_funcs
+from .engine import iter_listing
+from .git import find_git_dir, git_status
+from .option import Options
+
+# ANSI codes of the highlight groups that aren't file colors (see nvfm.vim)
+HL_GROUP_CODES = {
+    'FileMeta': '38;5;243',
+    'Error': '31',
+    'NvfmGitModified': '38;5;214',
+    'NvfmGitStaged': '38;5;114',
+    'NvfmGitUntracked': '38;5;110',
+    'NvfmGitIgnored': '38;5;240',
+    'NvfmOrphan': '01;31',
+}
+
+
+def colorize(line, hls, colors):
+    """Return `line` with ANSI escapes for highlight spans `hls`.
+
+    Later spans take precedence where spans overlap.
+    """
+    codes = [None] * len(line)
+    for hl_group, start, stop in hls:
+        code = colors.ansi_code(hl_group) or HL_GROUP_CODES.get(hl_group)
+        if code is None:
+            continue
+        stop = len(line) if stop < 0 else stop
+        codes[start:stop] = [code] * (stop - start)
+    parts = []
+    current = None
+    for char, code in zip(line, codes):
+        if code != current:
+            parts.append('\x1b[0m' if current is not None else '')
+            if code is not None:
+                parts.append('\x1b[%sm' % code)
+            current = code
+        parts.append(char)
+    if current is not None:
+        parts.append('\x1b[0m')
+    return ''.join(parts)
+
+
+def repo_root(path):
+    path = os.path.abspath(path)
+    while find_git_dir(path) is None:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    return path
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        prog='nvfm --list',
+        description='Print a directory listing like nvfm shows it.')
+    parser.add_argument('path', nargs='?', default='.')
+    parser.add_argument('--sort', choices=list(sort_funcs),
+                        default=next(iter(sort_funcs)))
+    parser.add_argument(
+        '--columns', default=None,
+        help='Comma-separated columns (mode, user, group, size, atime, '
+        'ctime, mtime, ino, nlink, git)')
+    parser.add_argument('--time-format', default='ago',
+                        help='"ago" or a strftime() format')
+    parser.add_argument('--color', choices=['auto', 'always', 'never'],
+                        default='auto')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(sys.argv[1:] if args is None else args)
+    options = Options()
+    options['sort'] = args.sort
+    if args.columns is not None:
+        try:
+            options['columns'] = [c for c in args.columns.split(',') if c]
+        except KeyError as e:
+            print('nvfm: unknown column %s' % e, file=sys.stderr)
+            return 2
+    options['time_format'] = args.time_format
+    color = args.color == 'always' or \
+        args.color == 'auto' and sys.stdout.isatty()
+    colors = ColorManager()
+    path = os.path.abspath(args.path)
+    repo_status = None
+    if 'git' in options['columns'].value:
+        root = repo_root(path)
+        if root is not None:
+            repo_status = git_status(root)
+    try:
+        for line, hls in iter_listing(path, options, colors, repo_status):
+            print(colorize(line, hls, colors) if color else line)
+    except BrokenPipeError:
+        # Output piped into e.g. head
+        return 0
+    except OSError as e:
+        print('nvfm: %s' % e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
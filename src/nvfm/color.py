@@ -1,8 +1,10 @@
 # -*- coding: future_fstrings -*-
 import os
+from pathlib import PurePath
 from stat import (S_ISBLK, S_ISCHR, S_ISDIR, S_ISFIFO, S_ISLNK, S_ISREG,
                   S_ISSOCK, S_IXUSR)
 
+from . import symlink
 from .util import logger, stat_path
 
 
@@ -79,11 +81,24 @@ def parse_colors():
 
 
 class ColorManager:
+    """Colors files like $LS_COLORS.
 
-    def __init__(self, vim):
+    Without `vim` (e.g. for listings on the command line), no highlight
+    groups are defined, but `ansi_code()` maps groups back to ANSI codes.
+    """
+
+    def __init__(self, vim=None):
         self._vim = vim
         self._colors, self._colors_special = parse_colors()
-        self._define_highlights()
+        if vim is not None:
+            self._define_highlights()
+
+    @staticmethod
+    def ansi_code(hl_group):
+        """Return the ANSI code of a file color highlight group or `None`."""
+        if hl_group is None or not hl_group.startswith('color'):
+            return None
+        return hl_group[len('color'):].replace('_', ';')
 
     def _define_highlights(self):
         """Define highlight groups for file coloring."""
@@ -103,24 +118,37 @@ class ColorManager:
                 logger.debug(cmd)
                 self._vim.command(cmd)
 
-    def file_hl_group(self, file, stat_res=None, stat_error=None):
-        """Return the highlight group that `file` should be colored in."""
+    def file_hl_group(self, file, stat_res=None, stat_error=None,
+                      resolve_links=True):
+        """Return the highlight group that `file` should be colored in.
+
+        Unless `resolve_links`, symlinks aren't followed and get the link
+        color.
+        """
         if stat_error is not None:
             return 'Error'
         if stat_res is None:
             return self.file_hl_group(file, *stat_path(file))
         mode = stat_res.st_mode
         if not S_ISREG(mode):  # Not a regular file
-            if S_ISLNK(mode):
-                if self._colors_special.get('ln') == 'target':
-                    # TODO
-                    # resolved = file.resolve()
-                    # if resolved == file:
-                    #     # Don't try to resolve another time
-                    #     # TODO
-                    #     raise Exception('recursion! %s' % resolved)
-                    return self.file_hl_group(file,
-                                              *stat_path(file, lstat=False))
+            if S_ISLNK(mode) and not resolve_links:
+                ansi_color = self._colors_special.get('ln')
+                if ansi_color == 'target':
+                    return None
+            elif S_ISLNK(mode):
+                # Entries of any kind have a path, paths are path-like
+                link = symlink.resolve(
+                    os.fspath(getattr(file, 'path', file)), stat_res)
+                if link.orphan:
+                    ansi_color = self._colors_special.get('or')
+                    if ansi_color is None:
+                        return 'NvfmOrphan'
+                elif self._colors_special.get('ln') == 'target':
+                    if link.stat is None:
+                        return 'Error'
+                    # The target's stat is never a link, so this won't recurse
+                    return self.file_hl_group(PurePath(link.target),
+                                              link.stat)
                 else:
                     ansi_color = self._colors_special.get('ln')
             elif S_ISCHR(mode):
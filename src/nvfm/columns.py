@@ -0,0 +1,251 @@
+"""Columns that are expensive to compute, e.g. because files must be read.
+
+Providers are registered with `@column_provider()` and take a path and its
+stat result. `ColumnCache` computes values in the background.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+from stat import S_ISREG
+import struct
+
+from . import fs
+from .util import is_binary, logger
+
+# Shown until the value of a column has been computed
+PLACEHOLDER = '…'
+
+# Number of cached values
+CACHE_SIZE = 20000
+
+# Number of values computed by one worker task
+BATCH_SIZE = 16
+
+# Bytes read to detect the MIME type or image dimensions
+HEAD_SIZE = 4096
+
+providers = OrderedDict()
+
+
+class ColumnProvider:
+
+    def __init__(self, name, func, template):
+        self.name = name
+        self.func = func
+        # Format of the column, like in ColumnsOption
+        self.template = template
+
+    def __call__(self, path, stat_res):
+        if not S_ISREG(stat_res.st_mode):
+            return ''
+        return self.func(path, stat_res)
+
+
+def column_provider(name, template):
+    def wrapper(f):
+        providers[name] = ColumnProvider(name, f, template)
+        return f
+    return wrapper
+
+
+def _read_head(path, size=HEAD_SIZE):
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+MAGIC = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'%PDF-', 'application/pdf'),
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\x1f\x8b', 'application/gzip'),
+    (b'BZh', 'application/x-bzip2'),
+    (b'\xfd7zXZ\x00', 'application/x-xz'),
+    (b'(\xb5/\xfd', 'application/zstd'),
+    (b"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+    (b'\x7fELF', 'application/x-executable'),
+    (b'MZ', 'application/x-dosexec'),
+    (b'SQLite format 3\x00', 'application/x-sqlite3'),
+    (b'OggS', 'audio/ogg'),
+    (b'fLaC', 'audio/flac'),
+    (b'ID3', 'audio/mpeg'),
+    (b'#!', 'text/x-script'),
+]
+
+
+def mime_type(data):
+    """Guess the MIME type from `data`, the head of a file."""
+    if not data:
+        return 'inode/x-empty'
+    for magic, mime in MAGIC:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp':
+        return 'video/mp4'
+    if is_binary(data):
+        return 'application/octet-stream'
+    return 'text/plain'
+
+
+def image_size(data):
+    """Return `(width, height)` from the header of an image or `None`."""
+    # Truncated headers have no size
+    if data.startswith(b'\x89PNG\r\n\x1a\n') and data[12:16] == b'IHDR' \
+            and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return struct.unpack('<HH', data[6:10])
+    if data.startswith(b'BM') and len(data) >= 26:
+        width, height = struct.unpack('<ii', data[18:26])
+        return width, abs(height)
+    if data.startswith(b'\xff\xd8'):
+        return _jpeg_size(data)
+    return None
+
+
+def _jpeg_size(data):
+    # Walk the segments up to a start of frame marker
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xff:
+            return None
+        marker = data[i + 1]
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height
+        length, = struct.unpack('>H', data[i + 2:i + 4])
+        i += 2 + length
+    return None
+
+
+@column_provider('mime', ' {mime:<24.24}')
+def mime_column(path, stat_res): # pylint:disable=unused-argument
+    return mime_type(_read_head(path))
+
+
+@column_provider('lines', '{lines:>7}')
+def lines_column(path, stat_res): # pylint:disable=unused-argument
+    count = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**16), b''):
+            count += block.count(b'\n')
+    return str(count)
+
+
+@column_provider('checksum', ' {checksum:8}')
+def checksum_column(path, stat_res): # pylint:disable=unused-argument
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:8]
+
+
+@column_provider('xattr', ' {xattr:2}')
+def xattr_column(path, stat_res): # pylint:disable=unused-argument
+    """Return "+" for ACLs and "@" for other extended attributes."""
+    try:
+        names = os.listxattr(path, follow_symlinks=False)
+    except (AttributeError, OSError):
+        # Not supported by the platform or file system
+        return ''
+    flags = ''
+    if any(n.startswith('system.posix_acl_') for n in names):
+        flags += '+'
+    if any(not n.startswith('system.posix_acl_') for n in names):
+        flags += '@'
+    return flags
+
+
+@column_provider('image', ' {image:>11}')
+def image_column(path, stat_res): # pylint:disable=unused-argument
+    size = image_size(_read_head(path, 2**16))
+    return '' if size is None else '%dx%d' % size
+
+
+def compute(name, path, stat_res):
+    """Compute column `name` of `path`. Errors are shown as "?"."""
+    try:
+        return fs.call(path, providers[name], path, stat_res)
+    except OSError:
+        return '?'
+
+
+def _compute_batch(batch):
+    results = []
+    for key, name, path, stat_res in batch:
+        # Every key must get a value, or it would stay pending forever
+        try:
+            value = compute(name, path, stat_res)
+        except Exception as e: # pylint:disable=broad-except
+            logger.error(('columns:error', name, path, e))
+            value = '?'
+        results.append((key, path, value))
+    return results
+
+
+class ColumnCache:
+    """Values of expensive columns, computed by the worker.
+
+    Values are cached by the file's device, inode, mtime and size, so they're
+    recomputed when the file changes. `on_update(dirs)` is called from the
+    nvim event loop when values for items in directories `dirs` arrived.
+    """
+
+    def __init__(self, worker, on_update, size=CACHE_SIZE):
+        self._worker = worker
+        self._on_update = on_update
+        self._size = size
+        self._values = OrderedDict()
+        self._pending = set()
+        self._queue = []
+
+    @staticmethod
+    def _key(name, stat_res):
+        # Entries from the persistent cache have no st_mtime_ns
+        return (name, stat_res.st_dev, stat_res.st_ino, stat_res.st_mtime,
+                stat_res.st_size)
+
+    def get(self, name, path, stat_res):
+        """Return the value of column `name` for `path` or `None`.
+
+        If the value isn't cached, it's queued to be computed by `submit()`.
+        """
+        if not S_ISREG(stat_res.st_mode):
+            return ''
+        key = self._key(name, stat_res)
+        try:
+            value = self._values[key]
+        except KeyError:
+            if key not in self._pending:
+                self._pending.add(key)
+                self._queue.append((key, name, path, stat_res))
+            return None
+        self._values.move_to_end(key)
+        return value
+
+    def submit(self):
+        """Start computing the queued values."""
+        queue, self._queue = self._queue, []
+        for i in range(0, len(queue), BATCH_SIZE):
+            batch = queue[i:i + BATCH_SIZE]
+            self._worker.submit(_compute_batch, batch,
+                                callback=self._received)
+
+    def _received(self, results):
+        dirs = set()
+        for key, path, value in results:
+            self._pending.discard(key)
+            self._values[key] = value
+            dirs.add(os.path.dirname(path))
+        while len(self._values) > self._size:
+            self._values.popitem(last=False)
+        logger.debug(('columns:received', len(results)))
+        self._on_update(dirs)
@@ -0,0 +1,245 @@
+"""Recursive comparison of two directories.
+
+Entries are compared by their stat first. Files of the same size can still
+differ, even if they were modified at the same time, so their contents are
+hashed in chunks on the process pool of `grep`. Their mtimes only tell
+identical from touched files.
+"""
+from collections import OrderedDict, deque
+import hashlib
+import os
+from stat import S_IFMT, S_ISDIR, S_ISLNK, S_ISREG
+import threading
+import time
+
+from .find import BATCH_INTERVAL
+from .grep import get_pool
+from .util import logger
+
+# Statuses of compared entries
+LEFT = 'left'  # Only in the left directory
+RIGHT = 'right'  # Only in the right directory
+DIFFERENT = 'different'
+TOUCHED = 'touched'  # Same contents, but different mtimes
+IDENTICAL = 'identical'
+ERROR = 'error'
+
+STATUS_CHARS = OrderedDict([
+    (LEFT, '<'),
+    (RIGHT, '>'),
+    (DIFFERENT, '!'),
+    (TOUCHED, '~'),
+    (IDENTICAL, '='),
+    (ERROR, '?'),
+])
+
+STATUS_HL_GROUPS = {
+    LEFT: 'NvfmCompareLeft',
+    RIGHT: 'NvfmCompareRight',
+    DIFFERENT: 'NvfmCompareDifferent',
+    TOUCHED: 'NvfmCompareTouched',
+    IDENTICAL: 'NvfmCompareIdentical',
+    ERROR: 'Error',
+}
+
+# Number of file pairs hashed per task
+HASH_PAIRS_PER_TASK = 8
+
+# Bytes hashed at once. Hashing stops at the first chunk that differs.
+HASH_CHUNK_SIZE = 2**20
+
+
+def compare_stat(left_stat, right_stat, left_path, right_path):
+    """Compare two entries by their lstat.
+
+    Returns a status, or `None` if the contents must be compared.
+    """
+    if S_IFMT(left_stat.st_mode) != S_IFMT(right_stat.st_mode):
+        return DIFFERENT
+    if S_ISLNK(left_stat.st_mode):
+        try:
+            same = os.readlink(left_path) == os.readlink(right_path)
+        except OSError:
+            return ERROR
+        return IDENTICAL if same else DIFFERENT
+    if not S_ISREG(left_stat.st_mode):
+        return IDENTICAL
+    if left_stat.st_size != right_stat.st_size:
+        return DIFFERENT
+    if (left_stat.st_dev, left_stat.st_ino) == \
+            (right_stat.st_dev, right_stat.st_ino):
+        # The same file
+        return IDENTICAL
+    return None
+
+
+def same_contents(left_path, right_path, chunk_size=HASH_CHUNK_SIZE):
+    """Compare the contents of two files of the same size by hashing chunks
+    of them."""
+    with open(left_path, 'rb') as left, open(right_path, 'rb') as right:
+        while True:
+            left_chunk = left.read(chunk_size)
+            right_chunk = right.read(chunk_size)
+            if hashlib.sha256(left_chunk).digest() != \
+                    hashlib.sha256(right_chunk).digest():
+                return False
+            if not left_chunk:
+                return True
+
+
+def hash_pairs(pairs):
+    """Compare the contents of `(rel, left_path, right_path, same_mtime)`
+    pairs.
+
+    This runs in a worker process. Returns a list of `(rel, status,
+    is_dir)`.
+    """
+    results = []
+    for rel, left_path, right_path, same_mtime in pairs:
+        try:
+            same = same_contents(left_path, right_path)
+        except OSError:
+            status = ERROR
+        else:
+            if not same:
+                status = DIFFERENT
+            else:
+                status = IDENTICAL if same_mtime else TOUCHED
+        results.append((rel, status, False))
+    return results
+
+
+def _scan(path):
+    """Return a dict of names and lstat results of the entries in `path`."""
+    stats = {}
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return stats
+    for entry in entries:
+        try:
+            stats[entry.name] = entry.stat(follow_symlinks=False)
+        except OSError:
+            pass
+    return stats
+
+
+class Comparison:
+    """Compare the trees below `left` and `right`.
+
+    Results are delivered as batches of `(rel, status, is_dir)` by calling
+    `on_results(batch)` from a background thread, followed by `on_done()`.
+    Directories on both sides are descended into instead of being reported.
+    Entries on one side only are reported without their contents.
+    """
+
+    def __init__(self, left, right, hidden=True):
+        self.left = str(left)
+        self.right = str(right)
+        self._hidden = hidden
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._walk_done = False
+        self._finished = False
+        self._cancelled = threading.Event()
+        self._on_results = None
+        self._on_done = None
+
+    def start(self, on_results, on_done=None):
+        self._on_results = on_results
+        self._on_done = on_done
+        threading.Thread(target=self._walk, daemon=True).start()
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def _walk(self):
+        try:
+            self._compare_trees()
+        except Exception as e: # pylint:disable=broad-except
+            logger.error(('compare:error', e))
+        with self._lock:
+            self._walk_done = True
+        self._check_done()
+
+    def _compare_trees(self):
+        dirs = deque([''])
+        batch, candidates = [], []
+        delivered = time.monotonic()
+        while dirs and not self._cancelled.is_set():
+            rel_dir = dirs.popleft()
+            left_dir = os.path.join(self.left, rel_dir)
+            right_dir = os.path.join(self.right, rel_dir)
+            left, right = _scan(left_dir), _scan(right_dir)
+            for name in sorted(left.keys() | right.keys()):
+                if not self._hidden and name.startswith('.'):
+                    continue
+                rel = os.path.join(rel_dir, name)
+                left_stat, right_stat = left.get(name), right.get(name)
+                if right_stat is None:
+                    batch.append((rel, LEFT, S_ISDIR(left_stat.st_mode)))
+                    continue
+                if left_stat is None:
+                    batch.append((rel, RIGHT, S_ISDIR(right_stat.st_mode)))
+                    continue
+                if S_ISDIR(left_stat.st_mode) and \
+                        S_ISDIR(right_stat.st_mode):
+                    dirs.append(rel)
+                    continue
+                left_path = os.path.join(left_dir, name)
+                right_path = os.path.join(right_dir, name)
+                status = compare_stat(left_stat, right_stat, left_path,
+                                      right_path)
+                if status is None:
+                    candidates.append((
+                        rel, left_path, right_path,
+                        left_stat.st_mtime_ns == right_stat.st_mtime_ns))
+                else:
+                    batch.append((rel, status, S_ISDIR(left_stat.st_mode)))
+            while len(candidates) >= HASH_PAIRS_PER_TASK:
+                self._submit(candidates[:HASH_PAIRS_PER_TASK])
+                del candidates[:HASH_PAIRS_PER_TASK]
+            if batch and (not dirs or
+                          time.monotonic() - delivered > BATCH_INTERVAL):
+                self._deliver(batch)
+                batch = []
+                delivered = time.monotonic()
+        if candidates:
+            self._submit(candidates)
+
+    def _deliver(self, batch):
+        if not self._cancelled.is_set():
+            self._on_results(batch)
+
+    def _submit(self, pairs):
+        if self._cancelled.is_set():
+            return
+        future = get_pool().submit(hash_pairs, pairs)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._hashed)
+
+    def _hashed(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        if not (self._cancelled.is_set() or future.cancelled()):
+            error = future.exception()
+            if error is not None:
+                logger.error(('compare:error', error))
+            else:
+                self._deliver(future.result())
+        self._check_done()
+
+    def _check_done(self):
+        with self._lock:
+            done = self._walk_done and not self._futures and \
+                not self._finished
+            if done:
+                self._finished = True
+        if done and not self._cancelled.is_set() and \
+                self._on_done is not None:
+            self._on_done()
@@ -1,17 +1,29 @@
 from collections import OrderedDict
 import locale
 
+from .entries import EntryTable
+
 
 sort_funcs = OrderedDict()
 
-def sort_func(name):
+def sort_func(name, stat=True):
+    """Register a sort function. `stat` tells whether it sorts by the stat
+    of entries, so they must be stat'ed before sorting."""
     def wrapper(f):
+        f.needs_stat = stat
         sort_funcs[name] = f
-        sort_funcs[name + '_reverse'] = lambda x: reversed(list(f(x)))
+        sort_funcs[name + '_reverse'] = lambda x: _reverse(f(x))
+        sort_funcs[name + '_reverse'].needs_stat = stat
         return f
     return wrapper
 
 
+def _reverse(items):
+    if isinstance(items, EntryTable):
+        return items.reversed()
+    return reversed(list(items))
+
+
 filter_funcs = OrderedDict()
 
 def filter_func(name):
@@ -21,23 +33,30 @@ def filter_func(name):
     return wrapper
 
 
-@sort_func('alpha')
+@sort_func('alpha', stat=False)
 def sort_alpha(items):
     locale_ = locale.getlocale()
     locale.setlocale(locale.LC_ALL, '')
-    items = sorted(items, key=lambda x: locale.strxfrm(x.name))
+    if isinstance(items, EntryTable):
+        items = items.sorted('name', key=locale.strxfrm)
+    else:
+        items = sorted(items, key=lambda x: locale.strxfrm(x.name))
     locale.setlocale(locale.LC_ALL, locale_)
     return items
 
 
 @sort_func('last_modified')
 def sort_last_modified(items):
+    if isinstance(items, EntryTable):
+        return items.sorted('st_mtime').reversed()
     return reversed(
         sorted(items, key=lambda x: x.stat(follow_symlinks=False).st_mtime))
 
 
 @sort_func('size')
 def sort_size(items):
+    if isinstance(items, EntryTable):
+        return items.sorted('st_size')
     return sorted(items, key=lambda x: x.stat(follow_symlinks=False).st_size)
 
 
@@ -0,0 +1,169 @@
+import errno
+import os
+import shutil
+import stat
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl to share the extents of a file (a reflink) on btrfs, xfs etc.
+FICLONE = 0x40049409
+
+# Bytes copied per syscall (the granularity of progress reports)
+COPY_CHUNK_SIZE = 64 * 2**20
+
+# Errors after which an in-kernel copy method is given up for a file
+_UNSUPPORTED = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+                errno.ENOTSUP, errno.EBADF, errno.ETXTBSY}
+
+
+def _reflink(src_fd, dst_fd):
+    """Clone the extents of `src_fd`. Return whether it worked."""
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError:
+        return False
+    return True
+
+
+def _copy_range(src_fd, dst_fd, offset, end, on_bytes):
+    """Copy bytes `offset` to `end` within the kernel.
+
+    Uses copy_file_range (which can use server-side copies and reflinks)
+    with a fallback to sendfile. Returns the offset up to which data was
+    copied, which is less than `end` if neither is supported.
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    while offset < end and copy_file_range is not None:
+        count = min(COPY_CHUNK_SIZE, end - offset)
+        try:
+            n = copy_file_range(src_fd, dst_fd, count, offset, offset)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            break
+        if not n:
+            # The file shrank
+            return end
+        offset += n
+        on_bytes(n)
+    while offset < end:
+        count = min(COPY_CHUNK_SIZE, end - offset)
+        os.lseek(dst_fd, offset, os.SEEK_SET)
+        try:
+            n = os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            break
+        if not n:
+            return end
+        offset += n
+        on_bytes(n)
+    return offset
+
+
+def _copy_userspace(src_fd, dst_fd, offset, end, on_bytes):
+    while offset < end:
+        data = os.pread(src_fd, min(COPY_CHUNK_SIZE, end - offset), offset)
+        if not data:
+            break
+        os.pwrite(dst_fd, data, offset)
+        offset += len(data)
+        on_bytes(len(data))
+
+
+def _data_ranges(fd, size):
+    """Yield the `(start, end)` ranges of `fd` that contain data.
+
+    Holes of sparse files are skipped. Without SEEK_DATA support, the whole
+    file is one range.
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        yield 0, size
+        return
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only a hole is left
+                return
+            if e.errno in _UNSUPPORTED:
+                yield offset, size
+                return
+            raise
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, min(end, size)
+        offset = end
+
+
+def copy_file(src, dst, on_bytes=None):
+    """Copy regular file `src` to the new file `dst` and return its size.
+
+    The fastest available method is used: a reflink, an in-kernel copy, and
+    only as a last resort read/write. Holes in sparse files are preserved.
+    `on_bytes(n)` is called as data is copied. It may raise to abort the
+    copy, in which case `dst` is removed. Metadata isn't copied.
+    """
+    if on_bytes is None:
+        on_bytes = lambda n: None
+    with open(src, 'rb') as fsrc:
+        src_fd = fsrc.fileno()
+        st = os.fstat(src_fd)
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+        try:
+            size = st.st_size
+            if size and _reflink(src_fd, dst_fd):
+                on_bytes(size)
+                return size
+            # Only look for holes if blocks are missing
+            sparse = st.st_blocks * 512 < size
+            ranges = _data_ranges(src_fd, size) if sparse else [(0, size)]
+            for start, end in ranges:
+                offset = _copy_range(src_fd, dst_fd, start, end, on_bytes)
+                _copy_userspace(src_fd, dst_fd, offset, end, on_bytes)
+            # Restore a trailing hole
+            os.ftruncate(dst_fd, size)
+        except BaseException:
+            os.close(dst_fd)
+            os.unlink(dst)
+            raise
+        os.close(dst_fd)
+    return size
+
+
+def copy_metadata(src, dst):
+    """Copy permissions, times, flags and extended attributes."""
+    shutil.copystat(src, dst, follow_symlinks=False)
+
+
+def plan_copy(src, dst):
+    """Walk `src` and return the directories, symlinks and files to copy.
+
+    Returns lists of `(src_path, dst_path)` for directories (parents first),
+    symlinks and regular files, and a list of other files that are skipped.
+    """
+    dirs, links, files, skipped = [], [], [], []
+    stack = [(src, dst)]
+    while stack:
+        src_path, dst_path = stack.pop()
+        mode = os.lstat(src_path).st_mode
+        if S_ISDIR(mode):
+            dirs.append((src_path, dst_path))
+            for entry in os.scandir(src_path):
+                stack.append((entry.path, os.path.join(dst_path, entry.name)))
+        elif S_ISLNK(mode):
+            links.append((src_path, dst_path))
+        elif S_ISREG(mode):
+            files.append((src_path, dst_path))
+        else:
+            skipped.append(src_path)
+    return dirs, links, files, skipped
@@ -0,0 +1,490 @@
+from collections import OrderedDict, defaultdict
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import select
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from stat import S_ISDIR
+
+from .cache import scan_rows
+from .util import logger
+
+# Max number of directory snapshots kept by the daemon
+SNAPSHOT_LIMIT = 1000
+
+# Max number of inotify watches used by the daemon
+WATCH_LIMIT = 8192
+
+# Seconds without clients after which the daemon exits
+IDLE_TIMEOUT = 3600
+
+# Seconds a client waits for a response
+CLIENT_TIMEOUT = 1
+
+# Seconds before a client tries to connect again after a failure
+RETRY_INTERVAL = 30
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_MASK_ADD = 0x20000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Changes of a listed directory
+DIR_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+# Changes of the number of children of a subdirectory
+SUBDIR_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def socket_path():
+    """Return the path of the daemon socket of the current user.
+
+    Without `$XDG_RUNTIME_DIR`, the socket is put in a directory in the temp
+    directory. Anyone may have created that first, so `None` is returned
+    (and the daemon isn't used) unless it's private to the current user.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(),
+                                   'nvfm-%d' % os.getuid())
+        try:
+            os.makedirs(runtime_dir, mode=0o700, exist_ok=True)
+            stat_res = os.lstat(runtime_dir)
+        except OSError as e:
+            logger.error(('daemon:runtime_dir', e))
+            return None
+        if not S_ISDIR(stat_res.st_mode) or \
+                stat_res.st_uid != os.getuid() or stat_res.st_mode & 0o077:
+            logger.error(('daemon:unsafe_runtime_dir', runtime_dir))
+            return None
+    return os.path.join(runtime_dir, 'nvfm-cache.sock')
+
+
+class Inotify:
+    """Minimal inotify binding (Linux only)."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = self._check(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    @staticmethod
+    def _check(res):
+        if res < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return res
+
+    def add_watch(self, path, mask):
+        """Watch `path`. Watching a path again extends its mask."""
+        mask |= IN_MASK_ADD
+        return self._check(self._add_watch(self.fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd):
+        # Fails if the watch is already gone, which is fine
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """Return a list of `(wd, mask, name)` (blocks until available)."""
+        select.select([self.fd], [], [])
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+
+class CacheServer:
+    """Serves directory snapshots to nvfm instances over a Unix socket.
+
+    A snapshot holds the cache rows of a directory (see `scan_rows()`). It's
+    kept until inotify reports a change to the directory or the number of
+    children of one of its subdirectories. Then it's dropped and all clients
+    are told to reload the directory.
+
+    Protocol: newline-delimited JSON. Clients send `{"id": n, "path": p}` and
+    get `{"id": n, "rows": [...], "watched": w}` or
+    `{"id": n, "error": [errno, msg]}`. `w` tells whether the snapshot is kept
+    (and invalidations for it will follow). Invalidations are pushed as
+    `{"path": p}`, and snapshots dropped to stay within the limits as
+    `{"path": p, "evicted": true}`.
+    """
+
+    def __init__(self, path=None, snapshot_limit=SNAPSHOT_LIMIT,
+                 watch_limit=WATCH_LIMIT):
+        self.path = path if path is not None else socket_path()
+        self._snapshot_limit = snapshot_limit
+        self._watch_limit = watch_limit
+        self._snapshots = OrderedDict()
+        # Watched paths by watch descriptor, and vice versa
+        self._wd_paths = {}
+        self._path_wds = {}
+        # Maps watched paths to the snapshots that depend on them
+        self._dependents = defaultdict(set)
+        self._clients = {}
+        self._last_client_time = time.monotonic()
+        self._lock = threading.Lock()
+        self._inotify = Inotify()
+        self._sock = None
+
+    def serve_forever(self, idle_timeout=IDLE_TIMEOUT):
+        self._sock = self.bind()
+        threading.Thread(target=self._watch_loop, daemon=True).start()
+        self._sock.settimeout(10)
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                with self._lock:
+                    idle = not self._clients and time.monotonic() - \
+                        self._last_client_time > idle_timeout
+                if idle:
+                    break
+                continue
+            with self._lock:
+                self._clients[conn] = threading.Lock()
+            threading.Thread(target=self._serve_client, args=(conn,),
+                             daemon=True).start()
+        self.close()
+
+    def bind(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        sock.listen(16)
+        return sock
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _serve_client(self, conn):
+        try:
+            for line in conn.makefile('rb'):
+                request = json.loads(line.decode('utf-8'))
+                path = request['path']
+                response = {'id': request['id']}
+                try:
+                    response['rows'] = self.get_rows(path)
+                except OSError as e:
+                    response['error'] = [e.errno, e.strerror]
+                self._send(conn, response, path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.debug(('daemon:client_error', e))
+        finally:
+            with self._lock:
+                self._clients.pop(conn, None)
+                self._last_client_time = time.monotonic()
+            conn.close()
+
+    def _send(self, conn, message, path=None):
+        with self._lock:
+            lock = self._clients.get(conn)
+        if lock is None:
+            return
+        with lock:
+            if path is not None:
+                # Checked while holding the connection, so an invalidation
+                # can't be sent between this and the response
+                with self._lock:
+                    message['watched'] = path in self._snapshots
+            conn.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+    def get_rows(self, path):
+        with self._lock:
+            rows = self._snapshots.get(path)
+            if rows is not None:
+                self._snapshots.move_to_end(path)
+                return rows
+        dir_stat, rows = scan_rows(path)
+        subdirs = [os.path.join(path, row[0]) for row in rows
+                   if S_ISDIR(row[1])]
+        evicted = []
+        with self._lock:
+            if path not in self._snapshots and \
+                    len(self._path_wds) + len(subdirs) < self._watch_limit:
+                evicted = self._add_snapshot(path, rows, subdirs)
+        for old_path in evicted:
+            self._notify({'path': old_path, 'evicted': True})
+        if os.stat(path).st_mtime_ns != dir_stat.st_mtime_ns:
+            # Changed while scanning (before the watch was added)
+            self._invalidate(path)
+        return rows
+
+    def _add_snapshot(self, path, rows, subdirs):
+        """Keep `rows` of `path`, and return the paths of dropped snapshots."""
+        try:
+            self._watch(path, path, DIR_MASK)
+        except OSError:
+            return []
+        for subdir in subdirs:
+            try:
+                self._watch(subdir, path, SUBDIR_MASK)
+            except OSError:
+                pass
+        self._snapshots[path] = rows
+        evicted = []
+        while len(self._snapshots) > self._snapshot_limit:
+            old_path, _ = self._snapshots.popitem(last=False)
+            self._release(old_path)
+            evicted.append(old_path)
+        return evicted
+
+    def _watch(self, watched, dependent, mask):
+        wd = self._inotify.add_watch(watched, mask)
+        self._wd_paths[wd] = watched
+        self._path_wds[watched] = wd
+        self._dependents[watched].add(dependent)
+
+    def _release(self, dependent):
+        """Remove the watches that only `dependent` needed."""
+        for watched in [p for p, deps in self._dependents.items()
+                        if dependent in deps]:
+            deps = self._dependents[watched]
+            deps.discard(dependent)
+            if not deps:
+                del self._dependents[watched]
+                wd = self._path_wds.pop(watched, None)
+                if wd is not None:
+                    self._wd_paths.pop(wd, None)
+                    self._inotify.rm_watch(wd)
+
+    def _invalidate(self, path):
+        with self._lock:
+            if self._snapshots.pop(path, None) is None:
+                return
+            self._release(path)
+        self._notify({'path': path})
+
+    def _notify(self, message):
+        with self._lock:
+            clients = list(self._clients)
+        logger.debug(('daemon:notify', message))
+        for conn in clients:
+            try:
+                self._send(conn, message)
+            except OSError:
+                pass
+
+    def _watch_loop(self):
+        while True:
+            for wd, mask, _ in self._inotify.read():
+                with self._lock:
+                    watched = self._wd_paths.get(wd)
+                    if watched is None:
+                        continue
+                    dependents = list(self._dependents.get(watched, ()))
+                    if mask & IN_IGNORED:
+                        # The watch is gone (e.g. the directory was deleted)
+                        del self._wd_paths[wd]
+                        self._path_wds.pop(watched, None)
+                for dependent in dependents:
+                    self._invalidate(dependent)
+
+
+class DaemonClient:
+    """Connection to the cache daemon.
+
+    `get_rows()` and `cached_rows()` return `None` whenever the daemon can't
+    answer (e.g. it's not running, or there's no safe socket path), so callers
+    can fall back to the file system. If `autostart` is set, a daemon is
+    spawned when none is running. `on_invalidate(path)` is called from a
+    background thread when a directory changed.
+    """
+
+    def __init__(self, on_invalidate, path=None, autostart=True,
+                 timeout=CLIENT_TIMEOUT):
+        self._on_invalidate = on_invalidate
+        self._path = path if path is not None else socket_path()
+        self._autostart = autostart
+        self._timeout = timeout
+        self._sock = None
+        self._failed_at = None
+        self._next_id = 0
+        # Maps request ids to [event, response, path]
+        self._pending = {}
+        # Rows received for directories the daemon watches, by path
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_rows(self, path):
+        """Return the rows of directory `path`, waiting for the daemon."""
+        with self._lock:
+            request_id, waiter = self._request(str(path))
+            if waiter is None:
+                return None
+        if not waiter[0].wait(self._timeout):
+            with self._lock:
+                self._pending.pop(request_id, None)
+            return None
+        response = waiter[1]
+        if response is None or 'error' in response:
+            return None
+        return response['rows']
+
+    def cached_rows(self, path):
+        """Return the rows of directory `path` without waiting.
+
+        These are the rows the daemon sent before, which it keeps up to date.
+        If there are none, they are requested in the background, to be there
+        next time.
+        """
+        path = str(path)
+        with self._lock:
+            rows = self._rows.get(path)
+            if rows is not None:
+                self._rows.move_to_end(path)
+                return rows
+            if not any(w[2] == path for w in self._pending.values()):
+                self._request(path)
+        return None
+
+    def _request(self, path):
+        """Send a request for `path` and return `(id, waiter)`."""
+        sock = self._connect()
+        if sock is None:
+            return None, None
+        self._next_id += 1
+        request_id = self._next_id
+        waiter = [threading.Event(), None, path]
+        self._pending[request_id] = waiter
+        data = json.dumps({'id': request_id, 'path': path})
+        try:
+            sock.sendall(data.encode('utf-8') + b'\n')
+        except OSError:
+            self._disconnect(sock)
+            return None, None
+        return request_id, waiter
+
+    def _connect(self):
+        if self._sock is not None:
+            return self._sock
+        if self._path is None:
+            return None
+        if self._failed_at is not None and \
+                time.monotonic() - self._failed_at < RETRY_INTERVAL:
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._path)
+        except OSError as e:
+            sock.close()
+            self._failed_at = time.monotonic()
+            if self._autostart and e.errno in (errno.ENOENT,
+                                               errno.ECONNREFUSED):
+                self._spawn()
+            return None
+        self._sock = sock
+        self._failed_at = None
+        threading.Thread(target=self._read_loop, args=(sock,),
+                         daemon=True).start()
+        return sock
+
+    def _spawn(self):
+        logger.debug(('daemon:spawn', self._path))
+        subprocess.Popen(
+            [sys.executable, '-m', 'nvfm.daemon', self._path],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL, start_new_session=True)
+        # Try again soon (once it's up)
+        self._failed_at = time.monotonic() - RETRY_INTERVAL + 1
+
+    def _disconnect(self, sock):
+        if self._sock is sock:
+            self._sock = None
+            self._failed_at = time.monotonic()
+        sock.close()
+        for waiter in self._pending.values():
+            waiter[0].set()
+        self._pending.clear()
+        # Invalidations for them can't arrive anymore
+        self._rows.clear()
+
+    def _read_loop(self, sock):
+        try:
+            for line in sock.makefile('rb'):
+                message = json.loads(line.decode('utf-8'))
+                if 'id' not in message:
+                    with self._lock:
+                        self._rows.pop(message['path'], None)
+                    if not message.get('evicted'):
+                        self._on_invalidate(message['path'])
+                    continue
+                with self._lock:
+                    waiter = self._pending.pop(message['id'], None)
+                    if waiter is not None and message.get('watched'):
+                        self._rows[waiter[2]] = message['rows']
+                        while len(self._rows) > SNAPSHOT_LIMIT:
+                            self._rows.popitem(last=False)
+                if waiter is not None:
+                    waiter[1] = message
+                    waiter[0].set()
+        except (OSError, ValueError) as e:
+            logger.debug(('daemon:connection_lost', e))
+        with self._lock:
+            self._disconnect(sock)
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._disconnect(self._sock)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else socket_path()
+    if path is None:
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        pass
+    else:
+        # Another daemon is already serving
+        probe.close()
+        return
+    CacheServer(path).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,21 @@
-import grp
+from collections import deque
 import itertools
-import math
-import os
 from pathlib import Path
-import pwd
-import stat
-from stat import S_ISDIR, S_ISLNK
+from stat import S_ISDIR
 
+from . import fs
 from .base_view import View
+from .cache import comparable_row, count_children, make_row, scan_rows
+from .columns import providers
+# format_line is re-exported for compatibility
+from .engine import ( # noqa: F401 pylint:disable=unused-import
+    format_entries, format_line, format_placeholder, meta_width)
+from .entries import EntryTable
+from .plan import ListingPlan
 from .util import logger
 
-USERS = {u.pw_uid: u.pw_name for u in pwd.getpwall()}
-GROUPS = {g.gr_gid: g.gr_name for g in grp.getgrall()}
+# Number of rows formatted at once when filling in a large listing
+UPGRADE_CHUNK = 500
 
 
 class DirectoryView(View):
@@ -21,10 +25,25 @@ class DirectoryView(View):
         # TODO Make focus private?
         # Line number of focused item (starts at 1)
         self.focus = None
-        # List of items in directory (of os.DirEntry, not pathlib.Path)
+        # Items in directory (an EntryTable, not of pathlib.Path)
         self.items = None
+        # All entries of the directory, including hidden and ignored ones
+        self._entries = None
+        # The (show_hidden, show_ignored) options `items` were selected with
+        self._projection = None
         self._folds = None
         self._error = None
+        # Stat of the directory when it was scanned (for the persistent cache)
+        self._scan_stat = None
+        # Number of items in subdirectories, counted by `load()`
+        self._num_children = {}
+        # (start, stop, window height) of the rows that expensive columns
+        # were requested for
+        self._columns_range = None
+        # (start, stop) ranges of placeholder rows still to be formatted
+        self._upgrades = deque()
+        # Cache rows of the upgraded items, if the listing is to be cached
+        self._upgraded_rows = None
 
     def configure_win(self, win):
         if self.items:
@@ -33,24 +52,206 @@ class DirectoryView(View):
     def unload(self):
         self.clear_filter()
 
+    def remove(self):
+        self._upgrades.clear()
+        super().remove()
+
     def init(self):
-        try:
-            # Only save and restore focus if it has been explicitly set
-            restore_focus = self.focus is not None
-            if restore_focus:
-                focused_item = self.focused_item
-            self.items = self._list_files(
-                self.path, self._s.options['sort'].value)
-            if restore_focus:
+        # Only save and restore focus if it has been explicitly set
+        restore_focus = self.focus is not None
+        if restore_focus:
+            focused_item = self.focused_item
+        (self._entries, self.items, self._error, self._scan_stat, cached,
+         self._num_children, self._projection) = self._get_loaded()
+        if self._scan_stat is not None and \
+                len(self.items) < len(self._entries):
+            # Filtered entries weren't stat'ed, so the listing can't be cached
+            self._scan_stat = None
+        if cached:
+            # Painted from the cache, but revalidate in the background
+            self._s.worker.submit(
+                scan_rows, self.path, callback=self._revalidate)
+        if restore_focus and self._error is None:
+            try:
                 self.focused_item = focused_item
+            except ValueError:
+                # The item is gone, stay on the same line
+                self.focus = min(self.focus, len(self.items)) or None
+
+    @property
+    def _cache(self):
+        if not self._s.options['persistent_cache'].value:
+            return None
+        return self._s.dir_cache
+
+    @classmethod
+    def load(cls, session, path):
+        """List and stat the items in `path`.
+
+        Returns `(entries, items, error, scan_stat, cached, num_children,
+        projection)`. `entries` are all entries of the directory, `items` the
+        sorted ones that are shown with the `projection` of options (hidden
+        and ignored entries are dropped before they're stat'ed). `cached`
+        tells whether the entries came from the persistent cache,
+        `num_children` maps the paths of subdirectories to their number of
+        items.
+        """
+        projection = cls._projection_key(session)
+        keep = cls._keep_func(session, path)
+        plan = ListingPlan.from_options(session.options)
+        threshold = session.options['progressive_threshold'].value
+        try:
+            entries, scan_stat, cached = cls._load_items(
+                session, path, keep, plan, threshold)
         except OSError as e:
-            self.items = []
-            self._error = e
+            return [], [], e, None, False, {}, projection
+        if not plan.stat:
+            # Storing rows would stat all entries
+            scan_stat = None
+        items = cls._project(session, entries, keep)
+        num_children = {}
+        if plan.count_children and len(items) <= threshold:
+            # Large directories get their children counted while rendering
+            num_children = cls._count_children(items)
+        return (entries, items, None, scan_stat, cached, num_children,
+                projection)
+
+    @staticmethod
+    def _projection_key(session):
+        options = session.options
+        return options['show_hidden'].value, options['show_ignored'].value
+
+    @staticmethod
+    def _keep_func(session, path):
+        show_hidden, show_ignored = DirectoryView._projection_key(session)
+        return session.ignore.keep_func(path, show_hidden, show_ignored)
+
+    @staticmethod
+    def _project(session, entries, keep):
+        """Return the sorted entries that `keep()` accepts."""
+        if keep is not None:
+            if isinstance(entries, EntryTable):
+                entries = entries.filter(keep)
+            else:
+                entries = filter(keep, entries)
+        items = session.options['sort'].value(entries)
+        return items if isinstance(items, EntryTable) else list(items)
+
+    @staticmethod
+    def _count_children(items):
+        num_children = {}
+        for item in items:
+            # Stat results of entries are cached, so drawing doesn't block
+            try:
+                stat_res = item.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if S_ISDIR(stat_res.st_mode) and \
+                    getattr(item, 'num_children', None) is None:
+                num_children[item.path] = count_children(item.path)
+        return num_children
+
+    @classmethod
+    def _load_items(cls, session, path, keep=None, plan=None,
+                    threshold=None):
+        """Return `(entries, scan_stat, cached)`, with unsorted entries.
+
+        Entries that `keep()` rejects aren't stat'ed, nor those that `plan`
+        doesn't need to (see `_list_files()`).
+        """
+        if session.options['cache_daemon'].value:
+            # Doesn't wait: until the daemon's rows arrive, the directory is
+            # read below
+            rows = session.daemon.cached_rows(path)
+            if rows is not None:
+                # The daemon keeps its snapshots up to date
+                return EntryTable.from_rows(str(path), rows), None, False
+        if not session.options['persistent_cache'].value:
+            return cls._list_files(path, keep, plan, threshold), None, False
+        dir_stat = fs.stat(path)
+        rows = session.dir_cache.get_rows(path, dir_stat)
+        if rows is None:
+            # Cache miss: the listing gets stored after it's drawn
+            return cls._list_files(path, keep, plan, threshold), dir_stat, \
+                False
+        return EntryTable.from_rows(str(path), rows), None, True
+
+    def _revalidate(self, scan):
+        """Replace cached items with a fresh scan if they differ."""
+        dir_stat, rows = scan
+        cache = self._s.dir_cache
+        # Reading a file changes its access time, but not the listing
+        if sorted(map(comparable_row, rows)) == sorted(
+                comparable_row(make_row(i, getattr(i, 'num_children', None)))
+                for i in self._entries):
+            return
+        logger.debug('view:revalidated:%s', self)
+        cache.put(self.path, dir_stat, rows)
+        focused_item = self.focused_item if self.focus is not None else None
+        self.clear_filter()
+        self._entries = EntryTable.from_rows(str(self.path), rows)
+        self.items = self._project(self._s, self._entries,
+                                   self._keep_func(self._s, self.path))
+        self._projection = self._projection_key(self._s)
+        self._error = None
+        if focused_item is not None:
+            try:
+                self.focused_item = focused_item
+            except ValueError:
+                self.focus = None
+        self.redraw()
+        for view in self._s.views.showing(self.path):
+            if view is not self:
+                # E.g. a tree that shows this listing
+                view.dirty = 2
+                view.redraw()
 
     def draw(self):
+        self._update_projection()
         self._draw()
 
+    def redraw_columns(self):
+        """Redraw the rows after values of expensive columns arrived."""
+        self.redraw()
+
+    def _update_projection(self):
+        if self._error is None and \
+                self._projection != self._projection_key(self._s):
+            self._reproject()
+
+    def current_items(self):
+        """Return the items, loading or selecting them anew if needed.
+
+        Returns `None` if the directory can't be listed.
+        """
+        self.protocol_init()
+        if self._error is not None:
+            return None
+        self._update_projection()
+        return self.items
+
+    def _reproject(self):
+        """Select the shown items anew after hidden/ignored were toggled.
+
+        This reuses the entries of the last scan instead of listing the
+        directory again.
+        """
+        focused_item = self.focused_item if self.focus is not None else None
+        self.clear_filter()
+        self.items = self._project(self._s, self._entries,
+                                   self._keep_func(self._s, self.path))
+        self._projection = self._projection_key(self._s)
+        self._num_children.update(self._count_children(
+            [i for i in self.items if i.path not in self._num_children]))
+        if focused_item is not None:
+            try:
+                self.focused_item = focused_item
+            except ValueError:
+                # The item is hidden now, stay on the same line
+                self.focus = min(self.focus, len(self.items)) or None
+
     def _draw(self):
+        self._upgrades.clear()
         if self._error:
             self.draw_message(str(self._error), 'Error')
         elif not self.items:
@@ -67,6 +268,15 @@ class DirectoryView(View):
         self._set_focus(pos[0])
         if pos != self.cursor:
             self.emit('cursor_adjusted', self)
+        if self._columns_range is not None:
+            start, stop, height = self._columns_range
+            row = (self.focus or 1) - 1
+            if row - height < start and start > 0 or \
+                    row + height >= stop and stop < len(self.items):
+                # Rows without column values may come into view
+                self._columns_range = None
+                self._s.deferred.schedule(('columns', id(self)),
+                                          self.redraw_columns)
 
     def _set_focus(self, linenum):
         """Set focus to `linenum` if it is a legal line number."""
@@ -120,32 +330,201 @@ class DirectoryView(View):
         self.focus = [c.name for c in self.items].index(item.name) + 1
 
     def _render_items(self):
-        """Render directory listing."""
-        lines = []
+        """Render directory listing.
+
+        Large listings are rendered with placeholder rows of names first,
+        which are formatted in chunks, starting with the visible ones.
+        """
+        plan = ListingPlan.from_options(self._s.options)
+        threshold = self._s.options['progressive_threshold'].value
+        if plan.stat and len(self.items) > threshold:
+            self._render_placeholders()
+            return
+        lines, hls, rows = self._format_rows(
+            0, len(self.items), plan, self._scan_stat is not None)
+        self.buf[:] = lines
+        self._apply_highlights(hls)
+        self.draw_marks()
+        if rows is not None:
+            self._cache.put(self.path, self._scan_stat, rows)
+            self._scan_stat = None
+
+    def _format_rows(self, start, stop, plan, make_rows=False):
+        """Format the items from `start` to `stop`.
+
+        Returns `(lines, highlights, rows)`, where `rows` are the cache rows
+        of the items if `make_rows`, else `None`.
+        """
         hls = []
-        for linenum, item in enumerate(self.items):
-            try:
-                stat_res = item.stat(follow_symlinks=False)
-            except OSError as stat_error:
-                line = str(stat_error)
-            else:
-                line, line_hls = format_line(
-                    item.path,
-                    stat_res,
-                    self._s.colors.file_hl_group(item, stat_res),
-                    self._s.options['columns'].template,
-                    self._s.options['time_format'].value,
-                )
+        rows = [] if make_rows else None
+        repo_status = None
+        columns = self._s.options['columns'].value
+        if 'git' in columns:
+            repo_status = self._s.git.get(self.path)
+        names = [c for c in columns if c in providers]
+        self._columns_range = None
+        items = self.items[start:stop]
+        formatted = format_entries(
+            items,
+            self._s.colors,
+            self._s.options['columns'].template,
+            self._s.options['time_format'].value,
+            num_children=self._num_children,
+            repo_status=repo_status,
+            get_fields=self._column_fields(names) if names else None,
+            prefixes=self._prefixes(items),
+            plan=plan,
+        )
+        lines = []
+        for linenum, (item, line, line_hls, num_files) in enumerate(formatted,
+                                                                    start):
+            if line_hls is not None:
                 for hl in line_hls:
                     hls.append((linenum, *hl))
+                if rows is not None:
+                    rows.append(make_row(item, num_files))
+            lines.append(line)
+        if names:
+            self._s.columns.submit()
+        return lines, hls, rows
+
+    def _render_placeholders(self):
+        """Fill the buffer with the names of items and start formatting the
+        rows."""
+        colors = self._s.colors
+        width = meta_width(self._s.options['columns'].template,
+                           self._s.options['time_format'].value)
+        prefixes = self._prefixes() or {}
+        lines, hls = [], []
+        for linenum, item in enumerate(self.items):
+            line, line_hls = format_placeholder(
+                item, colors, width, prefixes.get(item.path, ''))
             lines.append(line)
+            for hl in line_hls:
+                hls.append((linenum, *hl))
         self.buf[:] = lines
         self._apply_highlights(hls)
+        self.draw_marks()
+        num_items = len(self.items)
+        height = self.panel.win.height if self.panel is not None else 0
+        row = (self.focus or 1) - 1
+        start = max(0, row - 2 * height)
+        stop = min(num_items, row + 2 * height + 1)
+        self._upgrades.append((start, stop))
+        for bounds in ((stop, num_items), (0, start)):
+            for i in range(*bounds, UPGRADE_CHUNK):
+                self._upgrades.append((i, min(i + UPGRADE_CHUNK, bounds[1])))
+        self._upgraded_rows = {} if self._scan_stat is not None else None
+        self._upgrade_rows()
+
+    def _upgrade_rows(self):
+        """Format the next chunk of placeholder rows."""
+        if not self._upgrades:
+            return
+        start, stop = self._upgrades.popleft()
+        if isinstance(self.items, EntryTable):
+            try:
+                # Stat the chunk in one go instead of row by row
+                fs.call(self.path, self.items.fill_stats, range(start, stop))
+            except OSError:
+                pass
+        plan = ListingPlan.from_options(self._s.options)
+        upgraded_rows = self._upgraded_rows
+        lines, hls, rows = self._format_rows(start, stop, plan,
+                                             upgraded_rows is not None)
+        self.buf.request('nvim_buf_set_lines', start, stop, True, lines)
+        self._apply_highlights(hls)
+        self.draw_marks()
+        if upgraded_rows is not None:
+            upgraded_rows[start] = rows
+        if self._upgrades:
+            # Let nvim handle input between chunks
+            self._s.deferred.schedule(('upgrade', id(self)),
+                                      self._upgrade_rows)
+        elif upgraded_rows is not None:
+            self._upgraded_rows = None
+            self._cache.put(self.path, self._scan_stat,
+                            [r for _, chunk in sorted(upgraded_rows.items())
+                             for r in chunk])
+            self._scan_stat = None
+
+    def _prefixes(self, # pylint:disable=no-self-use
+                  items=None): # pylint:disable=unused-argument
+        """Return a mapping of paths of `items` (or all items) to text
+        before the item's name."""
+        return None
+
+    def _column_fields(self, names):
+        """Return a `get_fields()` for `format_entries()` with the values of
+        the expensive columns `names`.
+
+        Values are only requested for rows near the focus, the only ones that
+        can be visible. The others get a placeholder.
+        """
+        panel = self.panel
+        height = panel.win.height if panel is not None else 0
+        row = (self.focus or 1) - 1
+        start, stop = max(0, row - 2 * height), row + 2 * height + 1
+        self._columns_range = (start, stop, height)
+        visible = {item.path for item in self.items[start:stop]}
+        cache = self._s.columns
+
+        def get_fields(entry, stat_res):
+            if entry.path not in visible:
+                return None
+            values = {}
+            for name in names:
+                value = cache.get(name, entry.path, stat_res)
+                if value is not None:
+                    values[name] = value
+            return values
+        return get_fields
+
+    @property
+    def _marks_ns(self):
+        return self._vim.request('nvim_create_namespace', 'nvfm_marks')
+
+    def draw_marks(self):
+        """Highlight the lines of marked items."""
+        marks = self._s.marks
+        ns = self._marks_ns
+        self.buf.request('nvim_buf_clear_namespace', ns, 0, -1)
+        if not marks or not self.items:
+            return
+        for linenum, item in enumerate(self.items):
+            if item.path in marks:
+                self.buf.add_highlight('NvfmMarked', linenum, 0, -1,
+                                       src_id=ns)
+
+    def toggle_mark(self):
+        """Mark or unmark the focused item."""
+        if self.focused_item is None or self.focus is None:
+            return
+        marks = self._s.marks
+        path_str = self.items[self.focus - 1].path
+        linenum = self.focus - 1
+        ns = self._marks_ns
+        if path_str in marks:
+            marks.remove(path_str)
+            self.buf.request('nvim_buf_clear_namespace', ns, linenum,
+                             linenum + 1)
+        else:
+            marks.add(path_str)
+            self.buf.add_highlight('NvfmMarked', linenum, 0, -1, src_id=ns)
 
     @staticmethod
-    def _list_files(path, sort_func):
-        """List all files in path."""
-        return list(sort_func(os.scandir(str(path))))
+    def _list_files(path, keep=None, plan=None, threshold=None):
+        """List all files in path, only stat'ing those that `keep()`.
+
+        If `plan` doesn't need the stat of entries, they aren't stat'ed. If
+        only the columns need it, large directories (above `threshold`
+        entries) are stat'ed while they're rendered.
+        """
+        entries = fs.scandir(path, keep, stat=False)
+        stat = plan is None or plan.sort_stat or plan.column_stat and (
+            threshold is None or len(entries) <= threshold)
+        return fs.call(path, EntryTable.from_entries, str(path), entries,
+                       keep, stat)
 
     def _apply_highlights(self, highlights):
         # TODO Apply highlights lazily
@@ -162,11 +541,23 @@ class DirectoryView(View):
         """
         # TODO Handle changed sorting order and filtering
         self.clear_filter()
+        self._folds = []
+        first_result = self._fold_unmatched(func, query)
+        if first_result is not None:
+            # TODO Doesn't reliably focus the first result
+            self.focus = first_result
+
+    def _fold_unmatched(self, func, query, start=0):
+        """Fold the items from index `start` on that don't match `query`.
+
+        Returns the line number of the first match or `None`.
+        """
         folds = []
         # The line number in which the current fold started
         start_idx = None
         first_result = None
-        for idx, item in enumerate(itertools.chain(self.items, (None,))):
+        items = itertools.islice(self.items, start, None)
+        for idx, item in enumerate(itertools.chain(items, (None,)), start):
             if item is None or func(query, item):
                 if first_result is None:
                     first_result = idx + 1
@@ -176,106 +567,14 @@ class DirectoryView(View):
             else:
                 if start_idx is None:
                     start_idx = idx
-        for start, end in folds:
+        for fold_start, fold_end in folds:
             # TODO Bulk request
-            self._vim.command(':%d,%dfold' % (start, end))
-        if first_result is not None:
-            # TODO Doesn't reliably focus the first result
-            self.focus = first_result
-        self._folds = folds
+            self._vim.command(':%d,%dfold' % (fold_start, fold_end))
+        self._folds.extend(folds)
+        return first_result
 
     def clear_filter(self):
         if self._folds:
             # Eliminate all folds (zE)
             self._vim.command('normal! zE')
             self._folds = None
-
-
-def format_line(path_str, stat_res, hl_group, template, format_time):
-    # TODO Orphaned symlink
-    mode = stat_res.st_mode
-    hls = []
-    extra = None
-    name = Path(path_str).name
-    if S_ISDIR(mode):
-        name += '/'
-        try:
-            num_files = len(os.listdir(path_str))
-        except OSError:
-            size_str = '?'
-        else:
-            size_str = str(num_files)
-            if num_files == 1:
-                extra = format_dir_extra(mode, path_str)
-    else:
-        size_str = format_size(stat_res.st_size)
-        if S_ISLNK(mode):
-            extra = format_link_extra(path_str)
-    meta = format_meta(stat_res, template, format_time, size_str)
-    line = meta + ' '
-    if hl_group is not None:
-        hls.append((hl_group, len(line), len(line) + len(name)))
-    line += name
-    if extra:
-        hls.append(('FileMeta', len(line), len(line) + len(extra)))
-        line += extra
-    hls.append(('FileMeta', 0, len(meta)))
-    return line, hls
-
-def format_meta(stat_res, template, format_time, size_str):
-    return template.format(
-        mode=stat.filemode(stat_res.st_mode),
-        size=size_str,
-        atime=format_time(stat_res.st_atime),
-        ctime=format_time(stat_res.st_ctime),
-        mtime=format_time(stat_res.st_mtime),
-        ino=stat_res.st_ino,
-        nlink=stat_res.st_nlink,
-        uid=USERS.get(stat_res.st_uid, str(stat_res.st_uid)),
-        gid=GROUPS.get(stat_res.st_gid, str(stat_res.st_gid)),
-    )
-
-def format_dir_extra(mode, path_str):
-    extra = ''
-    for _ in range(4):
-        if not S_ISDIR(mode):
-            break
-        try:
-            items = os.scandir(path_str)
-        except OSError:
-            break
-        try:
-            first = next(items)
-        except StopIteration:
-            break
-        try:
-            next(items)
-        except StopIteration:
-            pass
-        else:
-            break
-        path_str = os.path.join(path_str, first.name)
-        try:
-            mode = first.stat().st_mode
-        except OSError:
-            break
-        extra += first.name + ('/' if S_ISDIR(mode) else '')
-    return extra
-
-def format_link_extra(path_str):
-    try:
-        target = os.readlink(path_str)
-    except OSError:
-        target = '?'
-    return ' -> ' + target
-
-def format_size(bytes):
-    if not bytes:
-        return '0'
-    units = ('', 'K', 'M', 'G', 'T', 'P')
-    i = int(math.floor(math.log(bytes, 1024)))
-    power = math.pow(1024, i)
-    num = round(bytes / power, 2)
-    if i == 0:
-        return '%iB' % round(num)
-    return '{n:.1f}{unit}'.format(n=num, unit=units[i])
@@ -0,0 +1,253 @@
+import grp
+import math
+import os
+from pathlib import Path
+import pwd
+import stat
+from stat import S_ISDIR, S_ISLNK
+
+from . import fs, symlink
+from .cache import count_children
+from .columns import PLACEHOLDER, compute, providers
+from .entries import EntryTable, type_stat
+from .git import STATUS_CHARS, STATUS_HL_GROUPS
+from .plan import FULL_PLAN, ListingPlan
+
+USERS = {u.pw_uid: u.pw_name for u in pwd.getpwall()}
+GROUPS = {g.gr_gid: g.gr_name for g in grp.getgrall()}
+
+
+def list_entries(path, sort_func, keep=None, stat=True):
+    """Return the sorted entries of directory `path`.
+
+    If given, only entries for which `keep(entry)` is true are returned.
+    Unless `stat`, entries aren't stat'ed up front.
+    """
+    entries = EntryTable.from_entries(
+        str(path), fs.scandir(path, keep, stat), keep, stat)
+    if keep is not None:
+        entries = entries.filter(keep)
+    return list(sort_func(entries))
+
+
+def format_entries(entries, colors, template, format_time, num_children=None,
+                   repo_status=None, get_fields=None, prefixes=None,
+                   plan=FULL_PLAN):
+    """Format directory entries as listing lines.
+
+    This is independent of nvim, so it also serves the command line listing.
+    `colors` is a `ColorManager`, `num_children` optionally maps paths to
+    precomputed numbers of children and `repo_status` is a `RepoStatus` for
+    the git column. `get_fields(entry, stat_res)` optionally returns values
+    of further columns (see `columns`). `prefixes` optionally maps paths to
+    text to put before the name (e.g. the indentation of a tree). `plan` is
+    the `ListingPlan` that tells which syscalls are made: without stat,
+    lines only have the names and types of entries.
+
+    Yields `(entry, line, highlights, num_files)` for each entry, where
+    highlights are `(hl_group, start, stop)` spans. If the entry can't be
+    stat'ed, the line is the error, and highlights and `num_files` are
+    `None`.
+    """
+    num_children = num_children or {}
+    for entry in entries:
+        if plan.stat:
+            try:
+                stat_res = entry.stat(follow_symlinks=False)
+            except OSError as stat_error:
+                yield entry, str(stat_error), None, None
+                continue
+        else:
+            stat_res = type_stat(entry)
+        num_files = getattr(entry, 'num_children', None)
+        if num_files is None and plan.count_children and \
+                S_ISDIR(stat_res.st_mode):
+            num_files = num_children.get(entry.path)
+            if num_files is None:
+                num_files = count_children(entry.path)
+        fields, field_hls = {}, None
+        if get_fields is not None:
+            fields.update(get_fields(entry, stat_res) or ())
+        if repo_status is not None:
+            status = repo_status.get(entry.path)
+            fields['git'] = STATUS_CHARS.get(status, '')
+            field_hls = {'git': STATUS_HL_GROUPS.get(status)}
+        line, hls = format_line(
+            entry.path,
+            stat_res,
+            colors.file_hl_group(entry, stat_res, resolve_links=plan.stat),
+            template,
+            format_time,
+            num_files=num_files,
+            fields=fields,
+            field_hls=field_hls,
+            prefix=prefixes.get(entry.path, '') if prefixes else '',
+            count=plan.count_children,
+            extras=plan.stat,
+        )
+        yield entry, line, hls, num_files
+
+
+def iter_listing(path, options, colors, repo_status=None):
+    """List directory `path` according to `options` (an `Options` instance).
+
+    Yields `(line, highlights)` as each entry is formatted.
+    """
+    plan = ListingPlan.from_options(options)
+    entries = list_entries(path, options['sort'].value, stat=plan.stat)
+    names = [c for c in options['columns'].value if c in providers]
+
+    def get_fields(entry, stat_res):
+        # There's no hurry, so compute expensive columns right away
+        return {name: compute(name, entry.path, stat_res) for name in names}
+
+    for _, line, hls, _ in format_entries(
+            entries, colors, options['columns'].template,
+            options['time_format'].value, repo_status=repo_status,
+            get_fields=get_fields if names else None, plan=plan):
+        yield line, hls or []
+
+
+def format_line(path_str, stat_res, hl_group, template, format_time,
+                num_files=None, fields=None, field_hls=None, prefix='',
+                count=True, extras=True):
+    """Format a directory listing line and return it with its highlights.
+
+    `fields` are additional values for `template`. `field_hls` maps field
+    names to the highlight group of the field. `prefix` goes before the name.
+    Unless `count`, the children of directories aren't counted, and unless
+    `extras`, link targets and single-child directories aren't shown.
+    """
+    mode = stat_res.st_mode
+    hls = []
+    extra = None
+    name = Path(path_str).name
+    if S_ISDIR(mode):
+        name += '/'
+        if num_files is None and count:
+            num_files = count_children(path_str)
+        if num_files is None:
+            size_str = '?' if count else ''
+        else:
+            size_str = str(num_files)
+            if num_files == 1 and extras:
+                extra = format_dir_extra(mode, path_str)
+    else:
+        size_str = format_size(stat_res.st_size)
+        if S_ISLNK(mode) and extras:
+            extra = format_link_extra(path_str, stat_res)
+    fields = fields or {}
+    meta = format_meta(stat_res, template, format_time, size_str, **fields)
+    line = meta + ' ' + prefix
+    if hl_group is not None:
+        hls.append((hl_group, len(line), len(line) + len(name)))
+    line += name
+    if extra:
+        hls.append(('FileMeta', len(line), len(line) + len(extra)))
+        line += extra
+    hls.append(('FileMeta', 0, len(meta)))
+    for field, field_hl in (field_hls or {}).items():
+        if field_hl is None:
+            continue
+        span = field_span(stat_res, template, format_time, size_str, field,
+                          **fields)
+        if span is not None:
+            hls.append((field_hl, *span))
+    return line, hls
+
+def format_placeholder(entry, colors, width, prefix=''):
+    """Format a line with just the name of `entry` after `width` blanks.
+
+    It stands in for the line of an entry that wasn't formatted yet, so it
+    doesn't make syscalls.
+    """
+    stat_res = type_stat(entry)
+    name = os.path.basename(entry.path)
+    if S_ISDIR(stat_res.st_mode):
+        name += '/'
+    line = ' ' * width + ' ' + prefix
+    hl_group = colors.file_hl_group(entry, stat_res, resolve_links=False)
+    hls = []
+    if hl_group is not None:
+        hls.append((hl_group, len(line), len(line) + len(name)))
+    return line + name, hls
+
+def meta_width(template, format_time):
+    """Return the usual width of the meta part of lines."""
+    return len(format_meta(os.stat_result((0,) * 10), template, format_time,
+                           ''))
+
+def field_span(stat_res, template, format_time, size_str, field, **fields):
+    """Return the (start, stop) offsets of `field` in the formatted meta."""
+    start = template.find('{' + field)
+    if start < 0:
+        return None
+    stop = template.index('}', start) + 1
+    offset = len(format_meta(
+        stat_res, template[:start], format_time, size_str, **fields))
+    width = len(format_meta(
+        stat_res, template[start:stop], format_time, size_str, **fields))
+    return offset, offset + width
+
+def format_meta(stat_res, template, format_time, size_str, **fields):
+    fields.setdefault('git', '')
+    for name in providers:
+        fields.setdefault(name, PLACEHOLDER)
+    return template.format(
+        mode=stat.filemode(stat_res.st_mode),
+        size=size_str,
+        atime=format_time(stat_res.st_atime),
+        ctime=format_time(stat_res.st_ctime),
+        mtime=format_time(stat_res.st_mtime),
+        ino=stat_res.st_ino,
+        nlink=stat_res.st_nlink,
+        uid=USERS.get(stat_res.st_uid, str(stat_res.st_uid)),
+        gid=GROUPS.get(stat_res.st_gid, str(stat_res.st_gid)),
+        **fields
+    )
+
+def format_dir_extra(mode, path_str):
+    extra = ''
+    for _ in range(4):
+        if not S_ISDIR(mode):
+            break
+        try:
+            items = iter(fs.scandir(path_str))
+        except OSError:
+            break
+        try:
+            first = next(items)
+        except StopIteration:
+            break
+        try:
+            next(items)
+        except StopIteration:
+            pass
+        else:
+            break
+        path_str = os.path.join(path_str, first.name)
+        try:
+            mode = first.stat().st_mode
+        except OSError:
+            break
+        extra += first.name + ('/' if S_ISDIR(mode) else '')
+    return extra
+
+def format_link_extra(path_str, stat_res):
+    link = symlink.resolve(path_str, stat_res)
+    if link.target is None:
+        return ' -> ?'
+    if link.loop:
+        return ' -> ' + link.target + ' (loop)'
+    return ' -> ' + link.target
+
+def format_size(bytes):
+    if not bytes:
+        return '0'
+    units = ('', 'K', 'M', 'G', 'T', 'P')
+    i = int(math.floor(math.log(bytes, 1024)))
+    power = math.pow(1024, i)
+    num = round(bytes / power, 2)
+    if i == 0:
+        return '%iB' % round(num)
+    return '{n:.1f}{unit}'.format(n=num, unit=units[i])
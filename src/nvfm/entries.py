@@ -0,0 +1,276 @@
+"""Compact storage of directory listings.
+
+An `EntryTable` keeps the names of a directory's entries in one packed string
+and their stat fields in typed arrays, one per field, instead of holding an
+`os.DirEntry` and an `os.stat_result` per entry. Indexing it returns `Entry`
+rows, which mimic the parts of `os.DirEntry` that nvfm uses and are created
+on access.
+"""
+from array import array
+import os
+from stat import S_IFDIR, S_IFLNK, S_IFREG, S_ISDIR, S_ISLNK
+
+from . import fs
+from .cache import STAT_FIELDS
+
+# Array type codes of the stat columns, in the order of `STAT_FIELDS`
+COLUMN_TYPES = ('Q', 'Q', 'Q', 'Q', 'Q', 'Q', 'q', 'd', 'd', 'd')
+
+# Stored instead of `None` in the column of numbers of children
+NO_CHILDREN = -1
+
+
+class Entry:
+    """A row of an `EntryTable`."""
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __repr__(self):
+        return '<Entry %r>' % self.name
+
+    def __fspath__(self):
+        return self.path
+
+    @property
+    def name(self):
+        return self._table.name(self._index)
+
+    @property
+    def path(self):
+        return os.path.join(self._table.dir_path, self.name)
+
+    @property
+    def num_children(self):
+        num = self._table.columns['num_children'][self._index]
+        return None if num == NO_CHILDREN else num
+
+    def stat(self, follow_symlinks=True):
+        stat_res = self._table.stat(self._index)
+        if follow_symlinks and S_ISLNK(stat_res.st_mode):
+            return fs.stat(self.path)
+        return stat_res
+
+    def is_dir(self, follow_symlinks=True):
+        mode = self._table.columns['st_mode'][self._index]
+        if not follow_symlinks or not S_ISLNK(mode):
+            # The file type is known even if the entry wasn't stat'ed
+            return S_ISDIR(mode)
+        try:
+            return S_ISDIR(self.stat().st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self):
+        return S_ISLNK(self._table.columns['st_mode'][self._index])
+
+    def inode(self):
+        return self._table.columns['st_ino'][self._index]
+
+
+def file_type(entry):
+    """Return the file type bits of `entry` without stat'ing it.
+
+    `os.DirEntry` knows the type from the directory listing on most file
+    systems.
+    """
+    try:
+        if entry.is_symlink():
+            return S_IFLNK
+        if entry.is_dir(follow_symlinks=False):
+            return S_IFDIR
+    except OSError:
+        pass
+    return S_IFREG
+
+
+def type_stat(entry):
+    """Return a stat result of `entry` with only its file type."""
+    return os.stat_result((file_type(entry),) + (0,) * 9)
+
+
+class EntryTable:
+    """The entries of directory `dir_path`, stored column-wise.
+
+    `columns` maps the names of `STAT_FIELDS` and "num_children" to arrays.
+    Entries whose stat failed raise their error from `Entry.stat()`. Entries
+    that were listed without being stat'ed only have their file type and
+    inode, and are stat'ed when needed.
+    """
+
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        # The names, concatenated, and the offsets of each name in them
+        self._names = ''
+        self._offsets = array('Q', [0])
+        self.columns = {field: array(code)
+                        for field, code in zip(STAT_FIELDS, COLUMN_TYPES)}
+        self.columns['num_children'] = array('q')
+        # Maps indexes of entries that couldn't be stat'ed to the error
+        self._errors = {}
+        # Indexes of entries that weren't stat'ed yet
+        self._unstated = set()
+
+    @classmethod
+    def from_rows(cls, dir_path, rows):
+        """Create a table from cache rows (see `cache.make_row()`)."""
+        table = cls(dir_path)
+        names = []
+        columns = [table.columns[field] for field in STAT_FIELDS]
+        num_children = table.columns['num_children']
+        for row in rows:
+            names.append(row[0])
+            for column, value in zip(columns, row[1:11]):
+                column.append(value)
+            num_children.append(NO_CHILDREN if row[11] is None else row[11])
+        table._set_names(names)
+        return table
+
+    @classmethod
+    def from_entries(cls, dir_path, entries, keep=None, stat=True):
+        """Create a table from `os.DirEntry`s (or entries mimicking them).
+
+        Entries that `keep()` rejects aren't stat'ed, like in
+        `fs.scandir()`, and none are if `stat` is false.
+        """
+        table = cls(dir_path)
+        names = []
+        columns = [table.columns[field] for field in STAT_FIELDS]
+        for index, entry in enumerate(entries):
+            names.append(entry.name)
+            values = None
+            if stat and (keep is None or keep(entry)):
+                try:
+                    stat_res = entry.stat(follow_symlinks=False)
+                except OSError as e:
+                    table._errors[index] = e
+                else:
+                    values = [getattr(stat_res, f) for f in STAT_FIELDS]
+            else:
+                table._unstated.add(index)
+            if values is None:
+                values = [0] * len(STAT_FIELDS)
+                values[0] = file_type(entry)
+                try:
+                    values[1] = entry.inode()
+                except OSError:
+                    pass
+            for column, value in zip(columns, values):
+                column.append(value)
+            num = getattr(entry, 'num_children', None)
+            table.columns['num_children'].append(
+                NO_CHILDREN if num is None else num)
+        table._set_names(names)
+        return table
+
+    def _set_names(self, names):
+        self._names = ''.join(names)
+        offsets = self._offsets = array('Q', [0])
+        for name in names:
+            offsets.append(offsets[-1] + len(name))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Entry(self, i) for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('entry index out of range')
+        return Entry(self, index)
+
+    def __iter__(self):
+        return (Entry(self, i) for i in range(len(self)))
+
+    def __repr__(self):
+        return '<EntryTable %r (%d entries)>' % (self.dir_path, len(self))
+
+    def name(self, index):
+        return self._names[self._offsets[index]:self._offsets[index + 1]]
+
+    def names(self):
+        """Return the list of names."""
+        names, offsets = self._names, self._offsets
+        return [names[offsets[i]:offsets[i + 1]] for i in range(len(self))]
+
+    def stat(self, index):
+        """Return the `os.stat_result` (without following symlinks) of the
+        entry at `index`."""
+        if index in self._errors:
+            raise self._errors[index]
+        if index in self._unstated:
+            self._fill(index, fs.stat(os.path.join(self.dir_path,
+                                                   self.name(index)),
+                                      follow_symlinks=False))
+        return os.stat_result([self.columns[f][index] for f in STAT_FIELDS])
+
+    def fill_stats(self, indexes):
+        """Stat the entries at `indexes` that weren't stat'ed yet.
+
+        This blocks on the file system, so run it with `fs.call()`.
+        """
+        for index in indexes:
+            if index not in self._unstated:
+                continue
+            try:
+                self._fill(index, os.lstat(os.path.join(self.dir_path,
+                                                        self.name(index))))
+            except OSError as e:
+                self._unstated.discard(index)
+                self._errors[index] = e
+
+    def _fill(self, index, stat_res):
+        for field in STAT_FIELDS:
+            self.columns[field][index] = getattr(stat_res, field)
+        self._unstated.discard(index)
+
+    def take(self, indexes):
+        """Return a new table with the entries at `indexes`, in that
+        order."""
+        indexes = list(indexes)
+        table = EntryTable(self.dir_path)
+        table._set_names([self.name(i) for i in indexes])
+        for field, column in self.columns.items():
+            table.columns[field] = array(column.typecode,
+                                         (column[i] for i in indexes))
+        for new, old in enumerate(indexes):
+            if old in self._errors:
+                table._errors[new] = self._errors[old]
+            if old in self._unstated:
+                table._unstated.add(new)
+        return table
+
+    def filter(self, func):
+        """Return a new table with the entries for which `func(entry)` is
+        true."""
+        return self.take(i for i in range(len(self)) if func(Entry(self, i)))
+
+    def sorted(self, field, key=None):
+        """Return a new table sorted by `field`, a column or "name".
+
+        `key` is applied to the values. Entries that couldn't be stat'ed
+        are sorted first when sorting by stat fields. Sorting is stable.
+        """
+        if field == 'name':
+            values = self.names()
+        else:
+            for index in list(self._unstated):
+                try:
+                    self.stat(index)
+                except OSError as e:
+                    self._unstated.discard(index)
+                    self._errors[index] = e
+            values = self.columns[field]
+        if key is not None:
+            values = [key(v) for v in values]
+        if field != 'name' and self._errors:
+            values = [(i not in self._errors, v)
+                      for i, v in enumerate(values)]
+        return self.take(sorted(range(len(self)), key=values.__getitem__))
+
+    def reversed(self):
+        return self.take(range(len(self) - 1, -1, -1))
@@ -0,0 +1,253 @@
+import os
+import queue
+import re
+import threading
+
+from .cache import count_children
+from .ignore import IGNORE_FILES, IgnoreRules, is_ignored, parent_rules
+from .util import logger
+
+# Number of threads scanning directories
+WALKER_THREADS = 8
+
+# Seconds between delivering batches of results
+BATCH_INTERVAL = .05
+
+FILE_TYPES = {
+    'f': 'file',
+    'file': 'file',
+    'd': 'directory',
+    'directory': 'directory',
+}
+
+
+class Walker:
+    """Recursive, parallel directory walker.
+
+    Directories are scanned by a pool of threads. Found paths (relative to
+    `root`) are delivered in batches of `(rel_path, is_dir)` tuples by calling
+    `on_batch(batch)` from a background thread, followed by `on_done()`.
+
+    Options mirror those of fd: `hidden` includes dotfiles, `ignore` honors
+    .gitignore/.ignore/.fdignore rules, `type` restricts results to "file"
+    (regular files, not FIFOs, sockets or devices) or "directory", and
+    symlinks are followed unless `follow` is false. With `entries`, results
+    are `(rel_path, is_dir, entry, num_children)` tuples, with the
+    `os.DirEntry` already stat'ed (without following symlinks).
+    `num_children` is the number of entries of a directory (`None` for other
+    files), which is taken from the walk itself, so directories are reported
+    once they're scanned.
+    """
+
+    def __init__(self, root, hidden=False, ignore=True, type=None,
+                 follow=True, max_depth=None, threads=WALKER_THREADS,
+                 entries=False):
+        self.root = str(root)
+        self._hidden = hidden
+        self._ignore = ignore
+        self._type = FILE_TYPES[type] if type is not None else None
+        self._follow = follow
+        self._max_depth = max_depth
+        self._threads = threads
+        self._entries = entries
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch = []
+        self._visited = set()
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def start(self, on_batch, on_done=None):
+        """Start walking in the background."""
+        rules = parent_rules(self.root) if self._ignore else ()
+        self._queue.put((self.root, '', 1, rules))
+        for _ in range(self._threads):
+            threading.Thread(target=self._scan_loop, daemon=True).start()
+        threading.Thread(
+            target=self._deliver_loop, args=(on_batch, on_done),
+            daemon=True).start()
+
+    def _scan_loop(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            try:
+                if not self.cancelled:
+                    self._scan(*task)
+            except Exception as e: # pylint:disable=broad-except
+                logger.error(('walker:error', task[0], e))
+            finally:
+                self._queue.task_done()
+
+    def _deliver_loop(self, on_batch, on_done):
+        threading.Thread(target=self._wait, daemon=True).start()
+        while not self.cancelled:
+            finished = self._finished.wait(BATCH_INTERVAL)
+            with self._lock:
+                batch, self._batch = self._batch, []
+            if batch and not self.cancelled:
+                on_batch(batch)
+            if finished:
+                break
+        if on_done is not None and not self.cancelled:
+            on_done()
+
+    def _wait(self):
+        self._queue.join()
+        self._finished.set()
+        # Let the scanning threads exit
+        for _ in range(self._threads):
+            self._queue.put(None)
+
+    def _scan(self, path, rel, depth, rules, pending=None):
+        # `pending` is the result of this directory, to complete with its
+        # number of children
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            if pending is not None:
+                self._add_results([pending + (None,)])
+            return
+        if self._ignore:
+            names = [e.name for e in entries if e.name in IGNORE_FILES]
+            if names:
+                new_rules = IgnoreRules.from_dir(path, names)
+                if new_rules is not None:
+                    rules = rules + (new_rules,)
+        results = [] if pending is None else [pending + (len(entries),)]
+        for entry in entries:
+            name = entry.name
+            if not self._hidden and name.startswith('.'):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=self._follow)
+            except OSError:
+                is_dir = False
+            if rules and is_ignored(rules, entry.path, is_dir):
+                continue
+            entry_rel = rel + name
+            descend = is_dir and (self._max_depth is None or
+                                  depth < self._max_depth) and \
+                self._visit(entry)
+            pending = None
+            if self._type is None or self._matches_type(entry, is_dir):
+                if not self._entries:
+                    results.append((entry_rel, is_dir))
+                else:
+                    try:
+                        # Stat in parallel, while we're off the UI thread
+                        entry.stat(follow_symlinks=False)
+                    except OSError:
+                        pass
+                    if descend:
+                        pending = (entry_rel, is_dir, entry)
+                    else:
+                        results.append((
+                            entry_rel, is_dir, entry,
+                            count_children(entry.path) if is_dir else None))
+            if descend:
+                self._queue.put(
+                    (entry.path, entry_rel + '/', depth + 1, rules, pending))
+        self._add_results(results)
+
+    def _matches_type(self, entry, is_dir):
+        if self._type == 'directory':
+            return is_dir
+        try:
+            return entry.is_file(follow_symlinks=self._follow)
+        except OSError:
+            return False
+
+    def _add_results(self, results):
+        if results:
+            with self._lock:
+                self._batch.extend(results)
+
+    def _visit(self, entry):
+        """Return whether directory `entry` hasn't been visited before."""
+        try:
+            st = entry.stat(follow_symlinks=self._follow)
+        except OSError:
+            return False
+        key = (st.st_dev, st.st_ino)
+        with self._lock:
+            if key in self._visited:
+                return False
+            self._visited.add(key)
+        return True
+
+
+def walk(root, **options):
+    """Walk `root` and return all results (blocks until done)."""
+    results = []
+    done = threading.Event()
+    Walker(root, **options).start(results.extend, done.set)
+    done.wait()
+    return results
+
+
+def make_pattern(query, fuzzy=True):
+    """Compile `query` to a fuzzy (or substring) regex.
+
+    The match is case-insensitive unless the query contains uppercase letters.
+    """
+    flags = 0 if query != query.lower() else re.IGNORECASE
+    if not fuzzy:
+        return re.compile(re.escape(query), flags)
+    return re.compile('.*?'.join(map(re.escape, query)), flags)
+
+
+class Matcher:
+    """Incremental fuzzy (or substring) matcher.
+
+    If a query extends the previous one, only the previous matches are
+    searched again.
+    """
+
+    def __init__(self, fuzzy=True):
+        self.query = ''
+        self._fuzzy = fuzzy
+        self._pattern = None
+        # Indices of matching candidates
+        self.matches = None
+
+    def update(self, query, candidates):
+        """Match all `candidates` against `query` and return the indices of
+        the matches, best first."""
+        if not query:
+            self.query, self._pattern, self.matches = '', None, None
+            return None
+        if self.matches is not None and query.startswith(self.query):
+            pool = self.matches
+        else:
+            pool = range(len(candidates))
+        self.query = query
+        self._pattern = make_pattern(query, self._fuzzy)
+        scored = []
+        search = self._pattern.search
+        for i in pool:
+            m = search(candidates[i])
+            if m is not None:
+                scored.append((m.end() - m.start(), len(candidates[i]), i))
+        scored.sort()
+        self.matches = [i for _, _, i in scored]
+        return self.matches
+
+    def extend(self, candidates, start):
+        """Match new candidates (from index `start` onwards) and return the
+        indices of the matches."""
+        if self._pattern is None:
+            return []
+        search = self._pattern.search
+        new = [i for i in range(start, len(candidates))
+               if search(candidates[i]) is not None]
+        self.matches.extend(new)
+        return new
@@ -0,0 +1,295 @@
+import os
+from pathlib import Path
+
+from .base_view import View
+from .compare import RIGHT, STATUS_CHARS, STATUS_HL_GROUPS, Comparison
+from .find import FILE_TYPES, Matcher, Walker
+from .grep import Grep
+
+# Max number of results shown in the buffer at once
+FIND_DISPLAY_LIMIT = 10000
+
+
+class ResultsView(View):
+    """A list of results that are streamed into the buffer.
+
+    The view can be narrowed down with `filter()`, which uses an incremental
+    fuzzy (or substring) matcher.
+    """
+
+    def __init__(self, *args, substring=False):
+        super().__init__(*args)
+        # Line number of focused item (starts at 1)
+        self.focus = None
+        # Candidate lines
+        self._lines = []
+        # Indices of the lines shown in the buffer
+        self.items = []
+        self._fuzzy = not substring
+        self._matcher = Matcher(self._fuzzy)
+        self._done = False
+        self._unloaded = False
+
+    def start(self):
+        raise NotImplementedError()
+
+    def cancel(self):
+        """Stop producing results."""
+
+    def configure_win(self, win):
+        win.request('nvim_win_set_option', 'cursorline', True)
+
+    def unload(self):
+        self._unloaded = True
+        self.cancel()
+        # Wipe the buffer once it's no longer displayed
+        self._vim.async_call(self.remove)
+
+    def draw(self):
+        if self.items:
+            self._set_lines([self._lines[i] for i in self.items])
+            self._highlight(0, self.items)
+        elif self._done:
+            self.draw_message('(no results)')
+        else:
+            self.draw_message('(searching...)')
+
+    @property
+    def cursor(self):
+        return [self.focus or 1, 0]
+
+    @cursor.setter
+    def cursor(self, pos):
+        self.focus = pos[0]
+
+    @property
+    def empty(self):
+        return not self.items
+
+    @property
+    def focused_index(self):
+        """Return the index of the focused line in `_lines` or `None`."""
+        try:
+            return self.items[(self.focus or 1) - 1]
+        except IndexError:
+            return None
+
+    def _add_lines(self, lines):
+        """Add new candidate lines and show them if they match."""
+        if self._unloaded:
+            return
+        start = len(self._lines)
+        self._lines.extend(lines)
+        if self._matcher.query:
+            new = self._matcher.extend(self._lines, start)
+        else:
+            new = range(start, len(self._lines))
+        new = list(new)[:FIND_DISPLAY_LIMIT - len(self.items)]
+        if not new:
+            return
+        lines = [self._lines[i] for i in new]
+        if self.items:
+            self.buf.append(lines)
+        else:
+            self._set_lines(lines)
+        self._highlight(len(self.items), new)
+        self.items.extend(new)
+        # Required because the screen isn't redrawn during user input
+        self._vim.command('redraw')
+
+    def _highlight(self, linenum, indices):
+        """Highlight the lines from `linenum` on, which show the candidate
+        lines at `indices`."""
+
+    def _set_lines(self, lines):
+        # Remove the highlight of a previous message
+        self.buf.request('nvim_buf_clear_namespace', -1, 0, -1)
+        self.buf[:] = lines
+
+    def _finish(self):
+        if self._unloaded:
+            return
+        self._done = True
+        if not self.items:
+            self.draw()
+            self._vim.command('redraw')
+
+    def filter(self, func, query): # pylint:disable=unused-argument
+        """Show only results that match `query`."""
+        self.focus = 1
+        matches = self._matcher.update(query, self._lines)
+        if matches is None:
+            matches = range(len(self._lines))
+        self.items = list(matches[:FIND_DISPLAY_LIMIT])
+        self.draw()
+
+    def clear_filter(self):
+        if self._matcher.query:
+            self.filter(None, '')
+
+
+class FindView(ResultsView):
+    """Recursive search for file names below `path`.
+
+    If `index` (a tuple of `FileIndex` and the path prefix in it) is given,
+    results come from the index instead of walking the tree.
+    """
+
+    def __init__(self, *args, index=None, substring=False, **options):
+        super().__init__(*args, substring=substring)
+        self._index = index
+        self._options = options
+        self._walker = Walker(self.path, **options) if index is None else None
+
+    def start(self):
+        if self._index is not None:
+            self._done = True
+            self._search_index('')
+            self.draw()
+            # Refresh the results once the index is up to date
+            self._s.indexes.update(
+                self._index[0].root, callback=self._index_updated)
+            return
+        vim = self._vim
+        self._walker.start(
+            lambda batch: vim.async_call(self._add_results, batch),
+            lambda: vim.async_call(self._finish))
+
+    def cancel(self):
+        if self._walker is not None:
+            self._walker.cancel()
+
+    def _add_results(self, batch):
+        self._add_lines(rel + '/' if is_dir else rel for rel, is_dir in batch)
+
+    def _search_index(self, query):
+        index, prefix = self._index
+        self._lines = index.search(
+            query,
+            prefix,
+            fuzzy=self._fuzzy,
+            dirs_only=FILE_TYPES.get(self._options.get('type')) == 'directory',
+            hidden=self._options.get('hidden', False),
+            limit=FIND_DISPLAY_LIMIT,
+        )
+        self.items = list(range(len(self._lines)))
+
+    def _index_updated(self, index): # pylint:disable=unused-argument
+        if self._unloaded:
+            return
+        self._search_index(self._matcher.query)
+        self.draw()
+        self._vim.command('redraw')
+
+    @property
+    def focused_item(self):
+        i = self.focused_index
+        if i is None:
+            return None
+        return self.path / Path(self._lines[i].rstrip('/'))
+
+    def filter(self, func, query):
+        if self._index is None:
+            super().filter(func, query)
+            return
+        self.focus = 1
+        self._matcher.query = query
+        self._search_index(query)
+        self.draw()
+
+
+class GrepView(ResultsView):
+    """Recursive search for file contents below `path`.
+
+    Each line shows a match as "path:line: text".
+    """
+
+    def __init__(self, *args, query, **options):
+        super().__init__(*args)
+        # (path, line number) of each result
+        self._results = []
+        self._grep = Grep(self.path, query, **options)
+
+    def start(self):
+        vim = self._vim
+        self._grep.start(
+            lambda batch: vim.async_call(self._add_results, batch),
+            lambda: vim.async_call(self._finish))
+
+    def cancel(self):
+        self._grep.cancel()
+        if not self._unloaded:
+            self._finish()
+
+    def _add_results(self, batch):
+        if self._unloaded:
+            return
+        root = str(self.path)
+        lines = []
+        for path, linenum, text in batch:
+            self._results.append((path, linenum))
+            lines.append('%s:%d: %s' % (os.path.relpath(path, root), linenum,
+                                        text))
+        self._add_lines(lines)
+
+    @property
+    def focused_item(self):
+        i = self.focused_index
+        return None if i is None else Path(self._results[i][0])
+
+    @property
+    def focused_line(self):
+        """Return the line number of the focused match."""
+        i = self.focused_index
+        return None if i is None else self._results[i][1]
+
+
+class CompareView(ResultsView):
+    """Comparison of the tree below `path` with the tree below `other`.
+
+    Each line shows the status of an entry (see `compare.STATUS_CHARS`) and
+    its path relative to both roots.
+    """
+
+    def __init__(self, *args, other, **options):
+        super().__init__(*args, substring=True)
+        self.other = Path(other)
+        # (rel, status) of each result
+        self._results = []
+        self._comparison = Comparison(self.path, self.other, **options)
+
+    def start(self):
+        vim = self._vim
+        self._comparison.start(
+            lambda batch: vim.async_call(self._add_results, batch),
+            lambda: vim.async_call(self._finish))
+
+    def cancel(self):
+        self._comparison.cancel()
+        if not self._unloaded:
+            self._finish()
+
+    def _add_results(self, batch):
+        if self._unloaded:
+            return
+        lines = []
+        for rel, status, is_dir in batch:
+            self._results.append((rel, status))
+            lines.append('%s %s%s' % (STATUS_CHARS[status], rel,
+                                      '/' if is_dir else ''))
+        self._add_lines(lines)
+
+    def _highlight(self, linenum, indices):
+        for i, index in enumerate(indices, linenum):
+            hl_group = STATUS_HL_GROUPS[self._results[index][1]]
+            self.buf.add_highlight(hl_group, i, 0, 1, src_id=-1)
+
+    @property
+    def focused_item(self):
+        i = self.focused_index
+        if i is None:
+            return None
+        rel, status = self._results[i]
+        if status == RIGHT:
+            return self.other / rel
+        return self.path / rel
@@ -0,0 +1,246 @@
+import heapq
+import itertools
+import os
+from pathlib import Path
+
+from .config import sort_funcs
+from .directory_view import DirectoryView
+from .engine import format_entries
+from .find import Walker
+from .plan import ListingPlan
+
+# Number of entries kept when sorting by modification time
+FLAT_TOP_K = 1000
+
+
+class FlatEntry:
+    """An entry found by walking, named by its path relative to the root.
+
+    Mimics the parts of `os.DirEntry` that nvfm uses. `num_children` is the
+    number of entries of a directory, as counted by the walk.
+    """
+    __slots__ = ('name', 'path', 'num_children', '_entry')
+
+    def __init__(self, rel_path, entry, num_children=None):
+        self.name = rel_path
+        self.path = entry.path
+        self.num_children = num_children
+        self._entry = entry
+
+    def __repr__(self):
+        return '<FlatEntry %r>' % self.name
+
+    def stat(self, follow_symlinks=True):
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self):
+        return self._entry.is_symlink()
+
+    def inode(self):
+        return self._entry.inode()
+
+
+def _mtime(entry):
+    try:
+        return entry.stat(follow_symlinks=False).st_mtime
+    except OSError:
+        return 0
+
+
+class FlatView(DirectoryView):
+    """All entries below `path` down to `depth` levels, as one flat list.
+
+    The tree is walked in parallel and entries are appended to the buffer as
+    they're found. When the walk is done, they're sorted. When sorting by
+    modification time, only the newest (or oldest) `FLAT_TOP_K` entries are
+    kept in a heap, which is redrawn as it changes.
+    """
+
+    def __init__(self, *args, depth=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.depth = depth
+        self._walker = None
+        self._done = False
+        self._unloaded = False
+        # Heap of (key, sequence number, entry) when keeping the top K
+        self._heap = None
+        # 1 to keep the newest entries, -1 for the oldest
+        self._heap_sign = 1
+        self._counter = itertools.count()
+        # (func, query) of the active filter, applied to appended lines too
+        self._filter = None
+
+    def init(self):
+        self.cancel()
+        self.clear_filter()
+        self._entries = []
+        self.items = []
+        self._error = None
+        self._num_children = {}
+        self._projection = self._projection_key(self._s)
+        self._done = False
+        sort = self._s.options['sort'].value
+        if sort is sort_funcs['last_modified']:
+            self._heap, self._heap_sign = [], 1
+        elif sort is sort_funcs['last_modified_reverse']:
+            self._heap, self._heap_sign = [], -1
+        else:
+            self._heap = None
+        show_hidden, show_ignored = self._projection
+        self._walker = Walker(self.path, hidden=show_hidden,
+                              ignore=not show_ignored, follow=False,
+                              max_depth=self.depth, entries=True)
+        walker, vim = self._walker, self._vim
+        self._walker.start(
+            lambda batch: vim.async_call(
+                self._add_batch, walker, self._prepare(batch)),
+            lambda: vim.async_call(self._finish, walker))
+
+    def cancel(self):
+        if self._walker is not None:
+            self._walker.cancel()
+
+    def unload(self):
+        super().unload()
+        self._unloaded = True
+        self.cancel()
+        # Wipe the buffer once it's no longer displayed
+        self._vim.async_call(self._s.views.remove_derived, self)
+
+    def shows(self, path):
+        """Return whether the entries of directory `path` are listed."""
+        path = Path(path)
+        if path == self.path:
+            return True
+        try:
+            rel_path = path.relative_to(self.path)
+        except ValueError:
+            return False
+        return self.depth is None or len(rel_path.parts) < self.depth
+
+    @property
+    def focused_item(self):
+        return DirectoryView.focused_item.fget(self)
+
+    @focused_item.setter
+    def focused_item(self, item):
+        if item is None:
+            return
+        # Names are relative paths
+        self.focus = [i.path for i in self.items].index(str(item)) + 1
+
+    def _update_projection(self):
+        if self._projection != self._projection_key(self._s):
+            # Walk again with the new options
+            self.dirty = 2
+            self.protocol_init()
+
+    @staticmethod
+    def _prepare(batch):
+        """Wrap entries (on the walker's thread).
+
+        The walk counted the children of directories, so they aren't listed
+        again.
+        """
+        return [FlatEntry(rel_path, entry, num_children)
+                for rel_path, _, entry, num_children in batch]
+
+    def _add_batch(self, walker, entries):
+        if walker is not self._walker or self._unloaded:
+            # From an earlier walk
+            return
+        if self._heap is not None:
+            self._push_top_k(entries)
+            return
+        start = len(self.items)
+        self._entries.extend(entries)
+        self.items.extend(entries)
+        if start == 0:
+            # Replace the "(searching...)" message
+            self.redraw()
+            return
+        self._append_lines(start)
+
+    def _push_top_k(self, entries):
+        heap = self._heap
+        changed = False
+        for entry in entries:
+            item = (self._heap_sign * _mtime(entry), next(self._counter),
+                    entry)
+            if len(heap) < FLAT_TOP_K:
+                heapq.heappush(heap, item)
+                changed = True
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+                changed = True
+        if changed:
+            self._entries = [entry for _, _, entry in heap]
+            self.items = list(self._s.options['sort'].value(self._entries))
+            self._s.deferred.schedule(('flat', id(self)), self.redraw)
+
+    def _append_lines(self, start):
+        """Format and append the items from index `start`."""
+        formatted = format_entries(
+            self.items[start:],
+            self._s.colors,
+            self._s.options['columns'].template,
+            self._s.options['time_format'].value,
+            num_children=self._num_children,
+            prefixes=self._prefixes(self.items[start:]),
+            plan=ListingPlan.from_options(self._s.options),
+        )
+        lines, hls = [], []
+        for linenum, (_, line, line_hls, _) in enumerate(formatted, start):
+            lines.append(line)
+            for hl in line_hls or ():
+                hls.append((linenum, *hl))
+        self.buf.append(lines)
+        self._apply_highlights(hls)
+        if self._filter is not None:
+            self._fold_unmatched(*self._filter, start=start)
+        # Required because the screen isn't redrawn during user input
+        self._vim.command('redraw')
+
+    def _finish(self, walker):
+        if walker is not self._walker or self._unloaded:
+            return
+        self._done = True
+        if self._heap is None:
+            focused_item = self.focused_item if self.focus else None
+            self.items = list(self._s.options['sort'].value(self._entries))
+            if focused_item is not None:
+                self.focused_item = focused_item
+        self.redraw()
+
+    def _prefixes(self, items=None):
+        """Return the directories of items relative to the root."""
+        prefixes = {}
+        for item in self.items if items is None else items:
+            rel_dir = os.path.dirname(item.name)
+            if rel_dir:
+                prefixes[item.path] = rel_dir + '/'
+        return prefixes
+
+    def _draw(self):
+        if not self.items and not self._done:
+            self.draw_message('(searching...)')
+            return
+        super()._draw()
+        if self._filter is not None and self.items:
+            # Replacing the lines dropped the folds
+            focus = self.focus
+            self.filter(*self._filter)
+            if focus is not None:
+                self._set_focus(focus)
+                self.emit('cursor_adjusted', self)
+
+    def filter(self, func, query):
+        super().filter(func, query)
+        self._filter = (func, query)
+
+    def clear_filter(self):
+        super().clear_filter()
+        self._filter = None
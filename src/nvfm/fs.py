@@ -0,0 +1,300 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import errno
+from functools import partial
+import os
+import re
+import threading
+import time
+
+from .util import logger
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+
+# Seconds after which the mount table is read again
+MOUNTS_TTL = 10
+
+# Maximum number of directories whose mount is remembered
+MOUNTS_CACHE_SIZE = 4096
+
+# File system types that may block for a long time
+REMOTE_FS_TYPES = {
+    '9p', 'afs', 'ceph', 'cifs', 'coda', 'davfs', 'fuse', 'fuseblk',
+    'glusterfs', 'gpfs', 'lustre', 'ncpfs', 'nfs', 'nfs4', 'smb3', 'smbfs',
+    'sshfs',
+}
+
+# Seconds a call on a remote file system may take
+FS_TIMEOUT = 3
+
+# Number of threads for calls on remote file systems
+FS_THREADS = 8
+
+# Seconds a mount is skipped after a failure (doubled up to the maximum on
+# each subsequent failure)
+BACKOFF_MIN = 5
+BACKOFF_MAX = 300
+
+# Errors that indicate the mount itself is broken
+MOUNT_ERRNOS = {
+    errno.EHOSTDOWN, errno.EHOSTUNREACH, errno.EIO, errno.ENOTCONN,
+    errno.ESTALE, errno.ETIMEDOUT,
+}
+
+Mount = namedtuple('Mount', ['point', 'fs_type', 'source'])
+
+
+class MountUnavailable(OSError):
+    """The mount containing a path doesn't respond."""
+
+    def __init__(self, mount_point):
+        super().__init__(errno.EHOSTDOWN, 'mount unavailable', mount_point)
+
+    def __str__(self):
+        return '(unavailable)'
+
+
+def _unescape(field):
+    """Decode the octal escapes (e.g. "\\040" for space) of mountinfo."""
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text):
+    """Return the list of `Mount`s in the contents of a mountinfo file."""
+    mounts = []
+    for line in text.splitlines():
+        fields = line.split(' ')
+        try:
+            sep = fields.index('-', 6)
+            mounts.append(Mount(_unescape(fields[4]), fields[sep + 1],
+                                _unescape(fields[sep + 2])))
+        except (ValueError, IndexError):
+            continue
+    return mounts
+
+
+def is_remote(mount):
+    fs_type = mount.fs_type
+    return fs_type in REMOTE_FS_TYPES or fs_type.startswith('fuse.')
+
+
+class Mounts:
+    """The mount table, read from /proc/self/mountinfo.
+
+    On systems without it, no mounts are known and all paths count as local.
+    """
+
+    def __init__(self, path=MOUNTINFO_PATH):
+        self._path = path
+        # Mount point -> mount, and directory -> mount containing it. Both are
+        # replaced rather than modified on refresh, so lookups need no lock.
+        self._points = {}
+        self._dirs = {}
+        self._read_time = None
+        self._lock = threading.Lock()
+
+    def set_mounts(self, mounts):
+        # Later mounts hide earlier ones on the same mount point
+        points = {m.point.rstrip('/') or '/': m for m in mounts}
+        with self._lock:
+            self._points = points
+            self._dirs = {}
+            self._read_time = time.monotonic()
+
+    def _refresh(self):
+        try:
+            with open(self._path) as f:
+                text = f.read()
+        except OSError:
+            text = ''
+        self.set_mounts(parse_mountinfo(text))
+
+    def find(self, path):
+        """Return the `Mount` containing `path` or `None`.
+
+        The path isn't resolved, because that would require syscalls on the
+        mount in question. This is called for every row that is shown, so the
+        mount of each directory is cached until the table is read again.
+        """
+        if self._read_time is None or \
+                time.monotonic() - self._read_time > MOUNTS_TTL:
+            self._refresh()
+        path = str(path)
+        if not path.startswith('/') or '/.' in path or '//' in path or \
+                path.endswith('/') and path != '/':
+            path = os.path.abspath(path)
+        points, dirs = self._points, self._dirs
+        mount = points.get(path)
+        if mount is not None or path == '/':
+            return mount
+        parent = os.path.dirname(path)
+        try:
+            return dirs[parent]
+        except KeyError:
+            pass
+        # Longest prefix first
+        prefix = parent
+        while True:
+            mount = points.get(prefix)
+            if mount is not None or prefix == '/':
+                break
+            prefix = os.path.dirname(prefix)
+        if len(dirs) >= MOUNTS_CACHE_SIZE:
+            dirs.clear()
+        dirs[parent] = mount
+        return mount
+
+
+class CircuitBreaker:
+    """Skips calls to a mount after failures, with exponential backoff.
+
+    Once the backoff has passed, a single call is let through to probe the
+    mount. Success closes the breaker again, failure doubles the backoff.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._retry_at = None
+        self._probing = False
+
+    @property
+    def open(self):
+        return self._retry_at is not None
+
+    def allow(self):
+        """Return whether a call may be made now."""
+        with self._lock:
+            if self._retry_at is None:
+                return True
+            if self._probing or time.monotonic() < self._retry_at:
+                return False
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._retry_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            backoff = min(BACKOFF_MIN * 2**self._failures, BACKOFF_MAX)
+            self._failures += 1
+            self._retry_at = time.monotonic() + backoff
+            self._probing = False
+
+
+class SafeFS:
+    """File system access that can't hang on unresponsive mounts.
+
+    Syscalls on remote and FUSE file systems run on a bounded thread pool with
+    a timeout. A mount that times out is considered unavailable for a while
+    (see `CircuitBreaker`), during which calls fail right away with
+    `MountUnavailable` instead of blocking.
+    """
+
+    def __init__(self, mounts=None, timeout=FS_TIMEOUT, threads=FS_THREADS):
+        self._mounts = mounts if mounts is not None else Mounts()
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(threads)
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, mount_point):
+        with self._lock:
+            return self._breakers.setdefault(mount_point, CircuitBreaker())
+
+    def call(self, path, func, *args):
+        """Return `func(*args)`, which accesses `path`.
+
+        Raises `MountUnavailable` if `path` is on a remote mount that doesn't
+        respond in time.
+        """
+        mount = self._mounts.find(path)
+        if mount is None or not is_remote(mount):
+            return func(*args)
+        breaker = self.breaker(mount.point)
+        if not breaker.allow():
+            raise MountUnavailable(mount.point)
+        future = self._executor.submit(func, *args)
+        try:
+            result = future.result(self._timeout)
+        except FutureTimeoutError:
+            # The thread stays blocked, but the breaker stops further calls
+            logger.error(('fs:timeout', mount, path))
+            breaker.failure()
+            raise MountUnavailable(mount.point)
+        except OSError as e:
+            if e.errno in MOUNT_ERRNOS:
+                logger.error(('fs:mount_error', mount, path, e))
+                breaker.failure()
+            else:
+                breaker.success()
+            raise
+        except Exception:
+            # The mount responded, the function itself failed
+            breaker.success()
+            raise
+        breaker.success()
+        return result
+
+
+_fs = None
+
+
+def get_fs():
+    """Return the shared `SafeFS` (created on first use)."""
+    global _fs # pylint:disable=global-statement
+    if _fs is None:
+        _fs = SafeFS()
+    return _fs
+
+
+def _scandir(path_str, keep=None, stat=True):
+    entries = list(os.scandir(path_str))
+    if not stat:
+        return entries
+    for entry in entries:
+        if keep is not None and not keep(entry):
+            # Filtered out, so don't pay for a stat
+            continue
+        # Fill the stat cache of the entries while we're off the UI thread
+        try:
+            entry.stat(follow_symlinks=False)
+        except OSError:
+            pass
+    return entries
+
+
+def stat(path, follow_symlinks=True):
+    path_str = str(path)
+    return get_fs().call(
+        path_str, partial(os.stat, follow_symlinks=follow_symlinks), path_str)
+
+
+def scandir(path, keep=None, stat=True):
+    """Return the list of `os.DirEntry`s in `path`.
+
+    Only the entries for which `keep(entry)` is true (or all entries if
+    `keep` is `None`) are stat'ed right away, and none if `stat` is false.
+    """
+    path_str = str(path)
+    return get_fs().call(path_str, _scandir, path_str, keep, stat)
+
+
+def listdir(path):
+    path_str = str(path)
+    return get_fs().call(path_str, os.listdir, path_str)
+
+
+def readlink(path):
+    path_str = str(path)
+    return get_fs().call(path_str, os.readlink, path_str)
+
+
+def call(path, func, *args):
+    """Run `func(*args)`, which accesses `path`, like the functions above."""
+    return get_fs().call(str(path), func, *args)
@@ -0,0 +1,204 @@
+import os
+from pathlib import Path
+import subprocess
+
+from .util import logger
+
+# Statuses in order of precedence when summarizing a directory
+STATUSES = ('modified', 'staged', 'untracked', 'ignored')
+
+STATUS_CHARS = {
+    'modified': '*',
+    'staged': '+',
+    'untracked': '?',
+    'ignored': '!',
+}
+
+STATUS_HL_GROUPS = {
+    'modified': 'NvfmGitModified',
+    'staged': 'NvfmGitStaged',
+    'untracked': 'NvfmGitUntracked',
+    'ignored': 'NvfmGitIgnored',
+}
+
+
+def find_git_dir(path):
+    """Return the git directory belonging to work tree `path` or `None`."""
+    dot_git = os.path.join(path, '.git')
+    if os.path.isdir(dot_git):
+        return dot_git
+    try:
+        with open(dot_git) as f:
+            line = f.readline().strip()
+    except OSError:
+        return None
+    # Work trees and submodules have a file pointing to the git directory
+    if not line.startswith('gitdir:'):
+        return None
+    return os.path.join(path, line[len('gitdir:'):].strip())
+
+
+def parse_status(root, output):
+    """Parse the output of `git status --porcelain -z --ignored`."""
+    files = {}
+    dirs = {}
+    parts = iter(output.decode('utf-8', 'surrogateescape').split('\0'))
+    for part in parts:
+        if len(part) < 4:
+            continue
+        code, path = part[:2], part[3:]
+        if code[0] in 'RC':
+            # Renames and copies are followed by the original path
+            next(parts, None)
+        if code == '??':
+            status = 'untracked'
+        elif code == '!!':
+            status = 'ignored'
+        elif code[1] in 'MDTU':
+            status = 'modified'
+        else:
+            status = 'staged'
+        if path.endswith('/'):
+            path = path[:-1]
+            dirs[path] = status
+        files[path] = status
+        if status == 'ignored':
+            continue
+        # Let the parent directories reflect the status of their contents
+        parent = os.path.dirname(path)
+        while parent:
+            old = files.get(parent)
+            if old is not None and \
+                    STATUSES.index(old) <= STATUSES.index(status):
+                break
+            files[parent] = status
+            parent = os.path.dirname(parent)
+    return RepoStatus(root, files, dirs)
+
+
+class RepoStatus:
+    """The status of all files in a repository."""
+
+    def __init__(self, root, files, dirs):
+        self.root = root
+        # Status of files, including summarized directories
+        self._files = files
+        # Untracked or ignored directories whose contents share the status
+        self._dirs = dirs
+
+    def get(self, path):
+        """Return the status of `path` or `None` if it's unmodified."""
+        rel = os.path.relpath(str(path), self.root)
+        status = self._files.get(rel)
+        if status is not None:
+            return status
+        parent = os.path.dirname(rel)
+        while parent:
+            status = self._dirs.get(parent)
+            if status is not None:
+                return status
+            parent = os.path.dirname(parent)
+        return None
+
+
+def git_status(root):
+    """Run `git status` in `root` and return a `RepoStatus`."""
+    res = subprocess.run(
+        ['git', '--no-optional-locks', '-C', root, 'status', '--porcelain',
+         '-z', '--ignored', '--untracked-files=normal'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if res.returncode:
+        logger.error(('git:status_failed', root, res.returncode))
+    return parse_status(root, res.stdout)
+
+
+class GitStatus:
+    """Cache of repository statuses.
+
+    Statuses are computed by the worker, once per repository, and stay valid
+    until the repository's index or HEAD changes. `on_update(root)` is called
+    from the nvim event loop when a new status has arrived.
+    """
+
+    def __init__(self, worker, on_update):
+        self._worker = worker
+        self._on_update = on_update
+        # Maps directories to the root of their repository (or `None`)
+        self._roots = {}
+        # Maps repository roots to their git directory
+        self._git_dirs = {}
+        # Maps repository roots to (key, RepoStatus), or (key, None) if
+        # computing the status failed
+        self._statuses = {}
+        self._pending = set()
+
+    def repo_root(self, path):
+        """Return the root of the repository containing `path` or `None`."""
+        path = str(path)
+        try:
+            return self._roots[path]
+        except KeyError:
+            pass
+        git_dir = find_git_dir(path)
+        if git_dir is not None:
+            root = path
+            self._git_dirs[root] = git_dir
+        else:
+            parent = os.path.dirname(path)
+            root = None if parent == path else self.repo_root(parent)
+        self._roots[path] = root
+        return root
+
+    def _key(self, root):
+        git_dir = self._git_dirs[root]
+        key = []
+        for name in ('index', 'HEAD'):
+            try:
+                key.append(os.stat(os.path.join(git_dir, name)).st_mtime_ns)
+            except OSError:
+                key.append(None)
+        return tuple(key)
+
+    def get(self, path):
+        """Return the `RepoStatus` for directory `path`.
+
+        Returns `None` if `path` isn't in a repository or its status hasn't
+        been computed yet. In the latter case, the computation is started. An
+        outdated status is returned while its replacement is computed.
+        """
+        root = self.repo_root(path)
+        if root is None:
+            return None
+        key = self._key(root)
+        cached = self._statuses.get(root)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        if root not in self._pending:
+            self._pending.add(root)
+            self._worker.submit(
+                git_status, root,
+                callback=lambda status: self._received(key, status),
+                errback=lambda error: self._failed(root, key))
+        return cached[1] if cached is not None else None
+
+    def _received(self, key, status):
+        self._pending.discard(status.root)
+        self._statuses[status.root] = (key, status)
+        self._on_update(status.root)
+
+    def _failed(self, root, key):
+        self._pending.discard(root)
+        # Don't try again until the repository changes
+        self._statuses[root] = (key, None)
+
+    def invalidate(self):
+        self._statuses.clear()
+        self._roots.clear()
+
+    @staticmethod
+    def contains(root, path):
+        """Return whether `path` is inside repository `root`."""
+        path, root = Path(str(path)), Path(root)
+        return path == root or root in path.parents
@@ -0,0 +1,174 @@
+from concurrent.futures import ProcessPoolExecutor
+import mmap
+import multiprocessing
+import os
+import re
+from stat import S_ISREG
+import sys
+import threading
+
+from .find import Walker
+from .util import is_binary, logger
+
+# Number of files searched per task
+GREP_CHUNK_SIZE = 32
+
+# Max number of matches reported per file
+GREP_FILE_LIMIT = 1000
+
+# Max length of a reported line
+GREP_LINE_LIMIT = 200
+
+# Number of bytes at the start of a file checked for binary data. (Same as
+# the size of a file preview.)
+BINARY_CHECK_SIZE = 10**5
+
+_pool = None
+
+
+def get_pool():
+    """Return the process pool for searching files (created on first use)."""
+    global _pool # pylint:disable=global-statement
+    if _pool is None:
+        kwargs = {}
+        if sys.version_info >= (3, 7):
+            # Don't fork the plugin host with all its threads
+            kwargs['mp_context'] = multiprocessing.get_context('forkserver')
+        _pool = ProcessPoolExecutor(os.cpu_count(), **kwargs)
+    return _pool
+
+
+def compile_query(query):
+    """Compile `query` for searching bytes.
+
+    The search is case-insensitive unless the query contains uppercase
+    letters.
+    """
+    flags = 0 if query != query.lower() else re.IGNORECASE
+    return re.compile(re.escape(query.encode('utf-8')), flags)
+
+
+def grep_file(path, regex):
+    """Return `(line number, text)` of each line in `path` matching `regex`.
+
+    Binary files and files that aren't regular are skipped. (A FIFO that
+    replaced a file would block reading, so it's opened without blocking.)
+    """
+    results = []
+    with open(os.open(path, os.O_RDONLY | os.O_NONBLOCK), 'rb') as f:
+        stat_res = os.fstat(f.fileno())
+        if not S_ISREG(stat_res.st_mode) or not stat_res.st_size:
+            return results
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if is_binary(mm[:BINARY_CHECK_SIZE]):
+                return results
+            linenum = 1
+            # Offset up to which newlines have been counted
+            counted = 0
+            pos = 0
+            while len(results) < GREP_FILE_LIMIT:
+                m = regex.search(mm, pos)
+                if m is None:
+                    break
+                start = mm.rfind(b'\n', 0, m.start()) + 1
+                end = mm.find(b'\n', m.start())
+                if end < 0:
+                    end = len(mm)
+                linenum += mm[counted:start].count(b'\n')
+                counted = start
+                text = mm[start:min(end, start + GREP_LINE_LIMIT)]
+                results.append((linenum, text.decode('utf-8', 'replace')))
+                pos = end + 1
+    return results
+
+
+def grep_files(paths, pattern, flags):
+    """Search `paths` for a compiled regex given by `pattern` and `flags`.
+
+    This runs in a worker process. Returns a list of `(path, line number,
+    text)`.
+    """
+    regex = re.compile(pattern, flags)
+    results = []
+    for path in paths:
+        try:
+            matches = grep_file(path, regex)
+        except (OSError, ValueError):
+            continue
+        results.extend((path, linenum, text) for linenum, text in matches)
+    return results
+
+
+class Grep:
+    """Parallel search for `query` in all files below `root`.
+
+    Regular files are found by a `Walker` (`options` are passed on to it)
+    and searched in chunks on a process pool, or on `executor` if given.
+    Results are delivered by calling `on_results(batch)` from a background
+    thread, followed by `on_done()`.
+    """
+
+    def __init__(self, root, query, executor=None, **options):
+        self.root = str(root)
+        self._regex = compile_query(query)
+        self._executor = executor
+        options['type'] = 'file'
+        self._walker = Walker(self.root, **options)
+        self._lock = threading.Lock()
+        self._futures = set()
+        self._walk_done = False
+        self._finished = False
+        self._cancelled = False
+        self._on_results = None
+        self._on_done = None
+
+    def start(self, on_results, on_done=None):
+        self._on_results = on_results
+        self._on_done = on_done
+        self._walker.start(self._submit, self._walked)
+
+    def cancel(self):
+        self._cancelled = True
+        self._walker.cancel()
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+
+    def _submit(self, batch):
+        paths = [os.path.join(self.root, rel) for rel, _ in batch]
+        pool = self._executor or get_pool()
+        for i in range(0, len(paths), GREP_CHUNK_SIZE):
+            if self._cancelled:
+                return
+            future = pool.submit(
+                grep_files, paths[i:i + GREP_CHUNK_SIZE], self._regex.pattern,
+                self._regex.flags)
+            with self._lock:
+                self._futures.add(future)
+            future.add_done_callback(self._chunk_done)
+
+    def _walked(self):
+        with self._lock:
+            self._walk_done = True
+        self._check_done()
+
+    def _chunk_done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+        if not (self._cancelled or future.cancelled()):
+            error = future.exception()
+            if error is not None:
+                logger.error(('grep:error', error))
+            elif future.result():
+                self._on_results(future.result())
+        self._check_done()
+
+    def _check_done(self):
+        with self._lock:
+            done = self._walk_done and not self._futures and \
+                not self._finished
+            if done:
+                self._finished = True
+        if done and not self._cancelled and self._on_done is not None:
+            self._on_done()
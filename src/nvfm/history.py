@@ -1,4 +1,27 @@
 # -*- coding: future_fstrings -*-
+import json
+import os
+from pathlib import Path
+import threading
+import time
+
+import appdirs
+
+from .util import logger
+
+# Max number of entries in the back/forward history
+HISTORY_LIMIT = 1000
+
+# Entries are aged once the sum of their ranks exceeds this (like zoxide)
+FRECENCY_MAX_AGE = 10000
+
+# Seconds before changes of the frecency store are written to disk
+FRECENCY_FLUSH_DELAY = 5
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
 
 class History:
     """Location history.
@@ -7,7 +30,8 @@ class History:
     navigated to. Navigating and adding to the history works the same as in a
     web browser.
     """
-    def __init__(self):
+    def __init__(self, limit=HISTORY_LIMIT):
+        self._limit = limit
         self._entries = []
         # Pointer to the currently viewed history entry
         self._pointer = -1
@@ -32,9 +56,10 @@ class History:
         if self._entries and self._entries[self._pointer] == item:
             return
         # Truncate history, if we're not at the last entry
-        if self._pointer < len(self._entries) - 1:
-            self._entries = self._entries[:self._pointer + 1]
+        del self._entries[self._pointer + 1:]
         self._entries.append(item)
+        if len(self._entries) > self._limit:
+            del self._entries[0]
         self._pointer = len(self._entries) - 1
 
     def go(self, step):
@@ -48,3 +73,140 @@ class History:
             raise IndexError('History entry index out of range.')
         self._pointer = new_p
         return self._entries[new_p]
+
+
+def default_frecency_path():
+    return Path(appdirs.user_data_dir('nvfm')) / 'frecency.json'
+
+
+def frecency_score(rank, last_access, now):
+    """Weigh `rank` by the time since the last access (like zoxide)."""
+    age = now - last_access
+    if age < HOUR:
+        return rank * 4
+    if age < DAY:
+        return rank * 2
+    if age < WEEK:
+        return rank / 2
+    return rank / 4
+
+
+def matches_keywords(path_lower, keywords):
+    """Return whether all `keywords` appear in `path_lower` in order, and the
+    last one in its last component."""
+    pos = 0
+    for keyword in keywords:
+        i = path_lower.find(keyword, pos)
+        if i < 0:
+            return False
+        pos = i + len(keyword)
+    return keywords[-1] in path_lower.rsplit('/', 1)[-1]
+
+
+class Frecency:
+    """Persistent store of visited directories, ranked by frecency.
+
+    Each visit increases the rank of a directory. Once the sum of all ranks
+    exceeds `FRECENCY_MAX_AGE`, all ranks are scaled down and entries below a
+    rank of 1 are dropped, which keeps the store bounded. Changes are written
+    in the background after `FRECENCY_FLUSH_DELAY` (and at exit).
+    """
+
+    def __init__(self, path=None, flush_delay=FRECENCY_FLUSH_DELAY):
+        self._path = Path(path) if path is not None else \
+            default_frecency_path()
+        self._flush_delay = flush_delay
+        # Maps paths to [rank, last access, lowercase path]
+        self._entries = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        try:
+            with open(str(self._path)) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.debug(('frecency:load_failed', e))
+            return
+        with self._lock:
+            self._entries = {p: [rank, last, p.lower()]
+                             for p, rank, last in data.get('entries', [])}
+            self._total = sum(e[0] for e in self._entries.values())
+
+    def save(self):
+        with self._lock:
+            self._timer = None
+            data = {'entries': [(p, e[0], e[1])
+                                for p, e in self._entries.items()]}
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._path.with_suffix('.tmp')
+        with open(str(tmp), 'w') as f:
+            json.dump(data, f)
+        os.replace(str(tmp), str(self._path))
+
+    def flush(self):
+        """Save pending changes now."""
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    def add(self, path, now=None):
+        path = str(path)
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                self._entries[path] = [1, now, path.lower()]
+            else:
+                entry[0] += 1
+                entry[1] = now
+            self._total += 1
+            if self._total > FRECENCY_MAX_AGE:
+                self._age()
+            if self._timer is None:
+                self._timer = threading.Timer(self._flush_delay, self._save)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _age(self):
+        factor = .9 * FRECENCY_MAX_AGE / self._total
+        for path, entry in list(self._entries.items()):
+            entry[0] *= factor
+            if entry[0] < 1:
+                del self._entries[path]
+        self._total = sum(e[0] for e in self._entries.values())
+
+    def _save(self):
+        try:
+            self.save()
+        except OSError as e:
+            logger.error(('frecency:save_failed', e))
+
+    def query(self, query='', limit=None, now=None):
+        """Return the paths matching the keywords in `query`, best first.
+
+        Matching is case-insensitive. All keywords have to appear in order
+        and the last one in the last path component.
+        """
+        now = time.time() if now is None else now
+        keywords = query.lower().split()
+        with self._lock:
+            scored = [
+                (frecency_score(rank, last, now), path)
+                for path, (rank, last, lower) in self._entries.items()
+                if not keywords or matches_keywords(lower, keywords)
+            ]
+        scored.sort(reverse=True)
+        return [path for _, path in scored[:limit]]
+
+    def remove(self, path):
+        with self._lock:
+            entry = self._entries.pop(str(path), None)
+            if entry is not None:
+                self._total -= entry[0]
@@ -0,0 +1,230 @@
+import os
+import re
+
+from . import fs
+
+# Files with gitignore-style rules that are honored in every directory
+IGNORE_FILES = ('.gitignore', '.ignore', '.fdignore')
+
+
+def translate(pattern):
+    """Translate a gitignore glob (without "!" and trailing "/") to a regex.
+
+    The regex matches paths relative to the directory of the ignore file.
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    i, n = 0, len(pattern)
+    res = ''
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            res += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            res += '.*'
+            i += 2
+            continue
+        i += 1
+        if c == '*':
+            res += '[^/]*'
+        elif c == '?':
+            res += '[^/]'
+        elif c == '[':
+            j = pattern.find(']', i + 1 if pattern[i:i + 1] in '!]' else i)
+            if j < 0:
+                res += '\\['
+                continue
+            chars = pattern[i:j].replace('\\', '\\\\')
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            res += '[%s]' % chars
+            i = j + 1
+        elif c == '\\' and i < n:
+            res += re.escape(pattern[i])
+            i += 1
+        else:
+            res += re.escape(c)
+    if not anchored:
+        res = '(?:.*/)?' + res
+    return res + r'\Z'
+
+
+class IgnoreRules:
+    """Compiled gitignore-style rules of one ignore file.
+
+    Paths passed to `match()` must be relative to `base`.
+    """
+
+    def __init__(self, base, lines):
+        self.base = base
+        rules = [r for r in map(self._parse, lines) if r is not None]
+        # List of (compiled regex, negated, dir_only)
+        self._rules = [(re.compile(r, re.S), negated, dir_only)
+                       for r, negated, dir_only in rules]
+        # Without negations, one combined regex per kind suffices
+        self._combined = None
+        if not any(negated for _, negated, _ in rules):
+            self._combined = tuple(
+                self._combine(r for r, _, dir_only in rules
+                              if dir_only == kind)
+                for kind in (False, True))
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    @staticmethod
+    def _parse(line):
+        line = line.rstrip('\n')
+        if not line.endswith('\\ '):
+            line = line.rstrip(' ')
+        if not line or line.startswith('#'):
+            return None
+        negated = line.startswith('!')
+        if negated or line.startswith('\\!') or line.startswith('\\#'):
+            line = line[1:]
+        dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        if not line:
+            return None
+        return (translate(line), negated, dir_only)
+
+    @staticmethod
+    def _combine(regexes):
+        regexes = list(regexes)
+        if not regexes:
+            return None
+        return re.compile('|'.join('(?:%s)' % r for r in regexes), re.S)
+
+    def match(self, rel_path, is_dir):
+        """Return `True` if the path is ignored, `False` if it's explicitly
+        not ignored and `None` if no rule matches."""
+        if self._combined is not None:
+            for regex in self._combined[:2 if is_dir else 1]:
+                if regex is not None and regex.match(rel_path):
+                    return True
+            return None
+        for regex, negated, dir_only in reversed(self._rules):
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negated
+        return None
+
+    @classmethod
+    def from_dir(cls, path, names=IGNORE_FILES):
+        """Read all ignore files in directory `path`.
+
+        Return `None` if there are no rules.
+        """
+        lines = []
+        for name in names:
+            try:
+                with open(os.path.join(path, name), errors='replace') as f:
+                    lines.extend(f)
+            except OSError:
+                pass
+        rules = cls(path, lines)
+        return rules if rules else None
+
+
+def is_ignored(rules, path, is_dir):
+    """Check `path` against a sequence of `IgnoreRules` (outermost first)."""
+    for r in reversed(rules):
+        verdict = r.match(os.path.relpath(path, r.base), is_dir)
+        if verdict is not None:
+            return verdict
+    return False
+
+
+def parent_rules(path):
+    """Return the rules of the parents of `path` up to the repository root."""
+    rules = []
+    path = os.path.abspath(path)
+    while True:
+        if os.path.exists(os.path.join(path, '.git')):
+            break
+        parent = os.path.dirname(path)
+        if parent == path:
+            # Not in a repository, so parent rules don't apply
+            return ()
+        path = parent
+        r = IgnoreRules.from_dir(path)
+        if r is not None:
+            rules.insert(0, r)
+    return tuple(rules)
+
+
+class IgnoreCache:
+    """Ignore rules of directories, for filtering directory listings.
+
+    The rules of each directory are compiled once and reused until one of
+    its ignore files changes (judged by their mtimes).
+    """
+
+    def __init__(self, names=IGNORE_FILES):
+        self._names = names
+        # Maps directories to (mtimes of ignore files, rules or `None`)
+        self._dirs = {}
+
+    def _dir_rules(self, path):
+        key = []
+        for name in self._names:
+            try:
+                key.append(fs.stat(os.path.join(path, name)).st_mtime_ns)
+            except OSError:
+                key.append(None)
+        key = tuple(key)
+        cached = self._dirs.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        rules = None
+        if any(k is not None for k in key):
+            rules = IgnoreRules.from_dir(path, self._names)
+        self._dirs[path] = (key, rules)
+        return rules
+
+    def rules(self, path):
+        """Return the rules that apply to the items in directory `path`.
+
+        These are the rules of `path` and, inside a repository, those of its
+        parents up to the repository root (outermost first).
+        """
+        path = os.path.abspath(str(path))
+        dirs = [path]
+        root = path
+        while not os.path.exists(os.path.join(root, '.git')):
+            parent = os.path.dirname(root)
+            if parent == root:
+                # Not in a repository, so only the directory's own rules apply
+                dirs = [path]
+                break
+            root = parent
+            dirs.append(root)
+        rules = (self._dir_rules(d) for d in reversed(dirs))
+        return tuple(r for r in rules if r is not None)
+
+    def keep_func(self, path, show_hidden, show_ignored):
+        """Return a function that tells whether to list a directory entry of
+        `path`, or `None` if all entries are listed.
+
+        The function only looks at the name and type of entries, so it can
+        run before entries are stat'ed.
+        """
+        if show_hidden and show_ignored:
+            return None
+        rules = () if show_ignored else self.rules(path)
+
+        def keep(entry):
+            if not show_hidden and entry.name.startswith('.'):
+                return False
+            if rules:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_ignored(rules, entry.path, is_dir):
+                    return False
+            return True
+        return keep
@@ -0,0 +1,349 @@
+from array import array
+from bisect import bisect_right
+import hashlib
+import heapq
+import os
+from pathlib import Path
+import pickle
+import re
+import threading
+
+import appdirs
+
+from .ignore import IGNORE_FILES, IgnoreRules, is_ignored, parent_rules
+from .util import logger
+
+# Bump when the on-disk format changes
+INDEX_VERSION = 1
+
+
+def default_index_path(root):
+    digest = hashlib.sha1(str(root).encode('utf-8', 'surrogateescape'))
+    return Path(appdirs.user_cache_dir('nvfm')) / 'index' / \
+        (digest.hexdigest() + '.pickle')
+
+
+def trigrams(s):
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def is_hidden(rel_path):
+    return rel_path.startswith('.') or '/.' in rel_path
+
+
+class FileIndex:
+    """Persistent filename index of a directory tree.
+
+    Paths are stored relative to `root` (directories end with "/") together
+    with a trigram index over their lowercase form, so substring queries
+    only need to check a few candidates. Updates are incremental: only
+    directories whose mtime changed are rescanned. Hidden files are indexed,
+    ignored files (as in .gitignore) are not.
+    """
+
+    def __init__(self, root, path=None):
+        self.root = str(root)
+        self._path = Path(path) if path is not None else \
+            default_index_path(self.root)
+        # Relative paths by id (`None` if the path was removed)
+        self._paths = []
+        self._ids = {}
+        # Maps relative directories to (mtime_ns, {name: is_dir})
+        self._dirs = {}
+        # Maps trigrams to arrays of path ids
+        self._postings = {}
+        self._removed = 0
+        # Lowercase paths joined by newlines (for fuzzy search)
+        self._blob = None
+        self._offsets = None
+        self._lock = threading.Lock()
+        self._update_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load(self):
+        """Load the index from disk. Return whether it was found."""
+        try:
+            with open(str(self._path), 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.debug(('index:load_failed', self.root, e))
+            return False
+        if data.get('version') != INDEX_VERSION or \
+                data.get('root') != self.root:
+            return False
+        with self._lock:
+            self._paths = data['paths']
+            self._dirs = data['dirs']
+            self._postings = data['postings']
+            self._ids = {p: i for i, p in enumerate(self._paths)
+                         if p is not None}
+            self._removed = len(self._paths) - len(self._ids)
+            self._blob = None
+        return True
+
+    def save(self):
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            data = {
+                'version': INDEX_VERSION,
+                'root': self.root,
+                'paths': self._paths,
+                'dirs': self._dirs,
+                'postings': self._postings,
+            }
+            tmp = self._path.with_suffix('.tmp')
+            with open(str(tmp), 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(str(tmp), str(self._path))
+
+    def update(self):
+        """Bring the index up to date. Return whether anything changed."""
+        with self._update_lock:
+            changed = self._update()
+            if self._removed > len(self._ids):
+                self._compact()
+        return changed
+
+    def _update(self):
+        changed = False
+        seen = set()
+        stack = [('', parent_rules(self.root))]
+        while stack:
+            rel_dir, rules = stack.pop()
+            abs_dir = os.path.join(self.root, rel_dir)
+            try:
+                mtime = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(rel_dir)
+            record = self._dirs.get(rel_dir)
+            if record is not None and record[0] == mtime:
+                listing = record[1]
+            else:
+                listing = None
+            ignore_names = [n for n in IGNORE_FILES
+                            if listing is None or n in listing]
+            new_rules = IgnoreRules.from_dir(abs_dir, ignore_names)
+            if new_rules is not None:
+                rules = rules + (new_rules,)
+            if listing is None:
+                listing = self._scan(abs_dir, rules)
+                self._apply(rel_dir, record[1] if record else {}, listing)
+                self._dirs[rel_dir] = (mtime, listing)
+                changed = True
+            for name, is_dir in listing.items():
+                if is_dir:
+                    stack.append((self._join(rel_dir, name), rules))
+        # Forget directories that have disappeared
+        for rel_dir in set(self._dirs) - seen:
+            _, listing = self._dirs.pop(rel_dir)
+            self._apply(rel_dir, listing, {})
+            changed = True
+        return changed
+
+    @staticmethod
+    def _join(rel_dir, name):
+        return rel_dir + '/' + name if rel_dir else name
+
+    @staticmethod
+    def _scan(abs_dir, rules):
+        listing = {}
+        try:
+            entries = list(os.scandir(abs_dir))
+        except OSError:
+            return listing
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            if rules and is_ignored(rules, entry.path, is_dir):
+                continue
+            listing[entry.name] = is_dir
+        return listing
+
+    def _apply(self, rel_dir, old, new):
+        """Update the paths of `rel_dir` from listing `old` to `new`."""
+        with self._lock:
+            for name, is_dir in old.items():
+                if new.get(name) != is_dir:
+                    self._remove(self._join(rel_dir, name) +
+                                 ('/' if is_dir else ''))
+            for name, is_dir in new.items():
+                if old.get(name) != is_dir:
+                    self._add(self._join(rel_dir, name) +
+                              ('/' if is_dir else ''))
+            self._blob = None
+
+    def _add(self, rel_path):
+        id_ = len(self._paths)
+        self._paths.append(rel_path)
+        self._ids[rel_path] = id_
+        for t in trigrams(rel_path.lower()):
+            try:
+                self._postings[t].append(id_)
+            except KeyError:
+                self._postings[t] = array('I', [id_])
+
+    def _remove(self, rel_path):
+        id_ = self._ids.pop(rel_path, None)
+        if id_ is not None:
+            self._paths[id_] = None
+            self._removed += 1
+
+    def _compact(self):
+        """Drop removed paths and rebuild the trigram index."""
+        with self._lock:
+            paths = [p for p in self._paths if p is not None]
+            self._paths, self._ids, self._postings = [], {}, {}
+            self._removed = 0
+            self._blob = None
+            for p in paths:
+                self._add(p)
+
+    def _candidates(self, query):
+        """Return ids of paths that may contain `query` (lowercase)."""
+        if len(query) < 3:
+            return range(len(self._paths))
+        postings = []
+        for t in trigrams(query):
+            ids = self._postings.get(t)
+            if ids is None:
+                return ()
+            postings.append(ids)
+        postings.sort(key=len)
+        ids = set(postings[0])
+        for other in postings[1:]:
+            ids.intersection_update(other)
+            if not ids:
+                break
+        return sorted(ids)
+
+    def _fuzzy_ids(self, query):
+        if self._blob is None:
+            # Lowercasing can change the length (e.g. of "İ"), so the offsets
+            # are those of the lowercase paths
+            lowered = [(p or '').lower() for p in self._paths]
+            self._offsets = array('L')
+            offset = 0
+            for p in lowered:
+                self._offsets.append(offset)
+                offset += len(p) + 1
+            self._blob = '\n'.join(lowered)
+        pattern = re.compile('[^\n]*?'.join(map(re.escape, query)))
+        last = None
+        for m in pattern.finditer(self._blob):
+            id_ = bisect_right(self._offsets, m.start()) - 1
+            if id_ != last:
+                last = id_
+                yield id_
+
+    def search(self, query, prefix='', fuzzy=False, dirs_only=False,
+               hidden=True, limit=None):
+        """Return the paths matching `query`, shortest first.
+
+        Paths are returned relative to `root` + `prefix`. Matching is
+        case-insensitive. With `fuzzy`, the characters of `query` only have
+        to appear in order.
+        """
+        query = query.lower()
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        if fuzzy and query:
+            matches = re.compile('.*?'.join(map(re.escape, query))).search
+        else:
+            matches = lambda rel: query in rel
+        results = []
+        with self._lock:
+            if fuzzy and query:
+                ids = list(self._fuzzy_ids(query))
+            else:
+                ids = self._candidates(query)
+            paths = self._paths
+            for id_ in ids:
+                p = paths[id_]
+                if p is None or not p.startswith(prefix):
+                    continue
+                rel = p[len(prefix):]
+                if not rel or dirs_only and not rel.endswith('/'):
+                    continue
+                if not hidden and is_hidden(rel):
+                    continue
+                if not matches(rel.lower()):
+                    continue
+                results.append(rel)
+                if not query and len(results) == limit:
+                    # Without a query, there's nothing to rank
+                    break
+        if not query:
+            return results
+        if limit is None:
+            return sorted(results, key=len)
+        return heapq.nsmallest(limit, results, key=len)
+
+
+class Indexes:
+    """The file indexes of the roots configured in the "index_roots" option.
+
+    Indexes are loaded and updated by the worker. `get()` only returns
+    indexes that are ready to be searched.
+    """
+
+    def __init__(self, worker, options):
+        self._worker = worker
+        self._options = options
+        self._indexes = {}
+        self._ready = set()
+        self._pending = set()
+
+    def find_root(self, path):
+        path = Path(str(path))
+        for root in self._options['index_roots'].value:
+            root = Path(root)
+            if path == root or root in path.parents:
+                return str(root)
+        return None
+
+    def get(self, path):
+        """Return `(index, prefix)` for `path` or `None`.
+
+        If `path` is in a configured root whose index isn't ready yet, it's
+        loaded or built in the background.
+        """
+        root = self.find_root(path)
+        if root is None:
+            return None
+        if root not in self._ready:
+            self.update(root)
+            return None
+        prefix = os.path.relpath(str(path), root)
+        return self._indexes[root], '' if prefix == '.' else prefix
+
+    def update(self, root, callback=None):
+        """Load (if needed) and update the index of `root` in the
+        background."""
+        if root in self._pending:
+            return
+        self._pending.add(root)
+        index = self._indexes.setdefault(root, FileIndex(root))
+        def run():
+            if root not in self._ready:
+                index.load()
+            if index.update():
+                index.save()
+            return root
+        def done(root):
+            self._pending.discard(root)
+            self._ready.add(root)
+            if callback is not None:
+                callback(index)
+        def failed(error): # pylint:disable=unused-argument
+            # Try again the next time the index is needed
+            self._pending.discard(root)
+        self._worker.submit(run, callback=done, errback=failed)
+
+    def update_all(self):
+        for root in self._options['index_roots'].value:
+            self.update(str(Path(root)))
@@ -0,0 +1,491 @@
+# -*- coding: future_fstrings -*-
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import errno
+import os
+import queue
+import re
+import shutil
+import stat
+from stat import S_ISDIR
+import threading
+import time
+from urllib.parse import quote
+
+from .copy import copy_file, copy_metadata, plan_copy
+from .engine import format_size
+from .util import logger
+
+# Seconds between progress updates
+PROGRESS_INTERVAL = .2
+
+# Number of files copied in parallel
+COPY_THREADS = 8
+
+# Max number of errors kept per job
+ERROR_LIMIT = 100
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """A bulk file operation on `paths` that runs in the background.
+
+    Subclasses implement `process(path)` for a single path and call `tick()`
+    for each unit of work. Errors are collected instead of aborting the job.
+    """
+
+    name = None
+
+    def __init__(self, paths):
+        self.paths = [str(p) for p in paths]
+        # Units of work done (e.g. files removed)
+        self.done = 0
+        # List of `(path, OSError)`
+        self.errors = []
+        self.num_errors = 0
+        self.finished = False
+        self._cancelled = threading.Event()
+        self._on_progress = None
+        self._last_progress = 0
+        self._start_time = None
+
+    def __repr__(self):
+        return '%s(%d paths)' % (self.__class__.__name__, len(self.paths))
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def affected_dirs(self):
+        """Return the directories whose listings change by this job."""
+        return {os.path.dirname(p) for p in self.paths}
+
+    @property
+    def removed(self):
+        """Return the paths that no longer exist after this job."""
+        return []
+
+    def run(self, on_progress=None):
+        self._on_progress = on_progress
+        self._start_time = time.monotonic()
+        try:
+            for path in self.paths:
+                try:
+                    self.process(path)
+                except OSError as e:
+                    self.error(path, e)
+        except JobCancelled:
+            pass
+        self.finished = True
+
+    def process(self, path):
+        raise NotImplementedError()
+
+    def tick(self, n=1):
+        """Record progress and stop if the job was cancelled."""
+        if self.cancelled:
+            raise JobCancelled()
+        self.done += n
+        self.report_progress()
+
+    def report_progress(self):
+        """Notify about progress (at most every `PROGRESS_INTERVAL`)."""
+        now = time.monotonic()
+        if self._on_progress is not None and \
+                now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self._on_progress(self)
+
+    @property
+    def elapsed(self):
+        if self._start_time is None:
+            return 0
+        return time.monotonic() - self._start_time
+
+    def error(self, path, error):
+        self.num_errors += 1
+        if len(self.errors) < ERROR_LIMIT:
+            self.errors.append((path, error))
+
+    def status(self):
+        """Return a short description of the progress."""
+        s = f'{self.name}: {self.done}'
+        if self.num_errors:
+            s += f' ({self.num_errors} errors)'
+        if self.cancelled:
+            s += ' (cancelled)'
+        return s
+
+    def summary(self):
+        """Return a message to show when the job is done, or `None`."""
+        return None
+
+
+class DeleteJob(Job):
+    """Remove files and directory trees (without following symlinks)."""
+
+    name = 'delete'
+
+    @property
+    def removed(self):
+        return self.paths
+
+    def process(self, path):
+        if not S_ISDIR(os.lstat(path).st_mode):
+            os.unlink(path)
+            self.tick()
+            return
+        # Iterative post-order traversal, so deep trees are fine
+        stack = [(path, False)]
+        while stack:
+            dir_path, scanned = stack.pop()
+            if scanned:
+                self._remove(os.rmdir, dir_path)
+                continue
+            stack.append((dir_path, True))
+            try:
+                entries = list(os.scandir(dir_path))
+            except OSError as e:
+                self.error(dir_path, e)
+                continue
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    stack.append((entry.path, False))
+                else:
+                    self._remove(os.unlink, entry.path)
+
+    def _remove(self, func, path):
+        try:
+            func(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.error(path, e)
+        self.tick()
+
+
+class MoveJob(Job):
+    """Move paths into directory `dest`. Existing files aren't replaced."""
+
+    name = 'move'
+
+    def __init__(self, paths, dest):
+        super().__init__(paths)
+        self.dest = str(dest)
+
+    @property
+    def affected_dirs(self):
+        return super().affected_dirs | {self.dest}
+
+    @property
+    def removed(self):
+        return self.paths
+
+    def process(self, path):
+        target = os.path.join(self.dest, os.path.basename(path))
+        if os.path.lexists(target):
+            raise FileExistsError(errno.EEXIST, 'Target exists', target)
+        try:
+            os.rename(path, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Different file systems: copy and delete
+            shutil.move(path, target)
+        self.tick()
+
+
+class CopyJob(Job):
+    """Copy paths into directory `dest`. Existing files aren't replaced.
+
+    Files are copied in parallel by a pool of threads (see `copy_file()`).
+    Directories get their metadata after their contents are copied, so
+    their times are preserved.
+    """
+
+    name = 'copy'
+
+    def __init__(self, paths, dest, threads=COPY_THREADS):
+        super().__init__(paths)
+        self.dest = str(dest)
+        # Number of bytes copied
+        self.bytes = 0
+        self._threads = threads
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def affected_dirs(self):
+        return {self.dest}
+
+    def run(self, on_progress=None):
+        with ThreadPoolExecutor(self._threads) as self._executor:
+            super().run(on_progress)
+
+    def process(self, path):
+        target = os.path.join(self.dest, os.path.basename(path))
+        if os.path.lexists(target):
+            raise FileExistsError(errno.EEXIST, 'Target exists', target)
+        if (self.dest + '/').startswith(path.rstrip('/') + '/'):
+            raise OSError(errno.EINVAL, 'Cannot copy a directory into itself',
+                          path)
+        dirs, links, files, skipped = plan_copy(path, target)
+        for src in skipped:
+            self.error(src, OSError(errno.EINVAL, 'Special file skipped'))
+        for _, dst in dirs:
+            os.mkdir(dst)
+        for src, dst in links:
+            try:
+                os.symlink(os.readlink(src), dst)
+                copy_metadata(src, dst)
+            except OSError as e:
+                self.error(src, e)
+            self.tick()
+        futures = {self._executor.submit(self._copy_file, src, dst): src
+                   for src, dst in files}
+        try:
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except OSError as e:
+                    self.error(futures[future], e)
+                self.tick()
+        except JobCancelled:
+            for future in futures:
+                future.cancel()
+            raise
+        for src, dst in reversed(dirs):
+            try:
+                copy_metadata(src, dst)
+            except OSError as e:
+                self.error(src, e)
+
+    def _copy_file(self, src, dst):
+        copy_file(src, dst, self._add_bytes)
+        copy_metadata(src, dst)
+
+    def _add_bytes(self, n):
+        if self.cancelled:
+            raise JobCancelled()
+        with self._lock:
+            self.bytes += n
+        self.report_progress()
+
+    def _throughput(self):
+        elapsed = self.elapsed
+        rate = self.bytes / elapsed if elapsed else 0
+        return f'{format_size(self.bytes)} ({format_size(int(rate))}/s)'
+
+    def status(self):
+        return super().status() + ' files, ' + self._throughput()
+
+    def summary(self):
+        return f'copy: {self.done} files, {self._throughput()} in ' \
+            f'{self.elapsed:.1f}s'
+
+
+_SYMBOLIC_MODE_RE = re.compile(r'([ugoa]*)([-+=])([rwxXst]*)$')
+
+_PERMS = {
+    'r': (stat.S_IRUSR, stat.S_IRGRP, stat.S_IROTH),
+    'w': (stat.S_IWUSR, stat.S_IWGRP, stat.S_IWOTH),
+    'x': (stat.S_IXUSR, stat.S_IXGRP, stat.S_IXOTH),
+}
+
+
+def parse_mode(spec, mode):
+    """Apply chmod mode `spec` (octal or symbolic like "u+x,go-w") to `mode`
+    and return the new permission bits."""
+    if re.match(r'[0-7]{1,4}$', spec):
+        return int(spec, 8)
+    perms = stat.S_IMODE(mode)
+    for clause in spec.split(','):
+        m = _SYMBOLIC_MODE_RE.match(clause)
+        if m is None:
+            raise ValueError('Invalid mode: %r' % spec)
+        who, op, what = m.groups()
+        who = who.replace('a', 'ugo') or 'ugo'
+        bits = 0
+        for char in what:
+            if char == 'X':
+                if not S_ISDIR(mode) and not mode & 0o111:
+                    continue
+                char = 'x'
+            if char in _PERMS:
+                for i, w in enumerate('ugo'):
+                    if w in who:
+                        bits |= _PERMS[char][i]
+            elif char == 's':
+                bits |= (stat.S_ISUID if 'u' in who else 0) | \
+                    (stat.S_ISGID if 'g' in who else 0)
+            elif char == 't':
+                bits |= stat.S_ISVTX
+        if op == '+':
+            perms |= bits
+        elif op == '-':
+            perms &= ~bits
+        else:
+            mask = 0
+            for i, w in enumerate('ugo'):
+                if w in who:
+                    mask |= _PERMS['r'][i] | _PERMS['w'][i] | _PERMS['x'][i]
+            perms = perms & ~mask | bits
+    return perms
+
+
+class ChmodJob(Job):
+    """Change the permissions of paths (not recursively)."""
+
+    name = 'chmod'
+
+    def __init__(self, paths, spec):
+        # Fail early on invalid modes
+        parse_mode(spec, 0)
+        super().__init__(paths)
+        self.spec = spec
+
+    def process(self, path):
+        mode = os.stat(path).st_mode
+        os.chmod(path, parse_mode(self.spec, mode))
+        self.tick()
+
+
+def home_trash():
+    data_home = os.environ.get('XDG_DATA_HOME') or \
+        os.path.expanduser('~/.local/share')
+    return os.path.join(data_home, 'Trash')
+
+
+def mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+class TrashJob(Job):
+    """Move paths to the trash, following the freedesktop.org trash spec.
+
+    Files on another file system than the home trash go to the
+    "$topdir/.Trash-$uid" directory of their mount.
+    """
+
+    name = 'trash'
+
+    @property
+    def removed(self):
+        return self.paths
+
+    def process(self, path):
+        trash = home_trash()
+        os.makedirs(trash, exist_ok=True)
+        top_dir = None
+        if os.lstat(path).st_dev != os.stat(trash).st_dev:
+            top_dir = mount_point(os.path.dirname(path))
+            trash = os.path.join(top_dir, '.Trash-%d' % os.getuid())
+        files_dir = os.path.join(trash, 'files')
+        info_dir = os.path.join(trash, 'info')
+        os.makedirs(files_dir, mode=0o700, exist_ok=True)
+        os.makedirs(info_dir, mode=0o700, exist_ok=True)
+        name, info_file = self._create_info(info_dir, path, top_dir)
+        try:
+            os.rename(path, os.path.join(files_dir, name))
+        except OSError:
+            os.unlink(info_file)
+            raise
+        self.tick()
+
+    @staticmethod
+    def _create_info(info_dir, path, top_dir):
+        """Reserve a name in the trash by creating its .trashinfo file."""
+        orig_path = os.path.abspath(path)
+        if top_dir is not None:
+            orig_path = os.path.relpath(orig_path, top_dir)
+        info = '[Trash Info]\nPath=%s\nDeletionDate=%s\n' % (
+            quote(orig_path), time.strftime('%Y-%m-%dT%H:%M:%S'))
+        base = os.path.basename(path)
+        for i in range(1000):
+            name = base if not i else '%s.%d' % (base, i)
+            info_file = os.path.join(info_dir, name + '.trashinfo')
+            try:
+                fd = os.open(info_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o600)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(info)
+            return name, info_file
+        raise FileExistsError(errno.EEXIST, 'No free name in trash', path)
+
+
+class JobQueue:
+    """Runs jobs one after another on a background thread.
+
+    `on_progress(job)` and `on_done(job)` are called from the nvim event loop.
+    """
+
+    def __init__(self, vim, on_progress, on_done):
+        self._vim = vim
+        self._on_progress = on_progress
+        self._on_done = on_done
+        self._queue = queue.Queue()
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def jobs(self):
+        """Return the jobs that are queued or running."""
+        with self._lock:
+            return list(self._jobs)
+
+    def add(self, job):
+        with self._lock:
+            self._jobs.append(job)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        self._on_progress(job)
+
+    def cancel_all(self):
+        for job in self.jobs:
+            job.cancel()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if not job.cancelled:
+                logger.debug(('job:start', job))
+                try:
+                    job.run(self._progress)
+                except Exception as e: # pylint:disable=broad-except
+                    logger.error(('job:error', job, e))
+                    job.error(None, e)
+            with self._lock:
+                self._jobs.remove(job)
+            self._vim.async_call(self._on_done, job)
+
+    def _progress(self, job):
+        self._vim.async_call(self._on_progress, job)
+
+    def status(self):
+        """Return the statusline text for the running and queued jobs."""
+        jobs = self.jobs
+        if not jobs:
+            return ''
+        s = jobs[0].status()
+        if len(jobs) > 1:
+            s += ' (+%d queued)' % (len(jobs) - 1)
+        return s
@@ -0,0 +1,136 @@
+"""Opening files without leaving nvfm.
+
+The `open_rules` option maps file names and MIME types to commands. The
+first name rule that matches wins, then the first MIME rule. Files without a
+rule are opened in the editor, see the `opener` option.
+"""
+from collections import OrderedDict
+import fnmatch
+import os
+import re
+import shlex
+from stat import S_ISREG
+import subprocess
+
+import pynvim
+
+from .columns import compute
+
+# Number of cached rule lookups
+CACHE_SIZE = 5000
+
+# The command to open files in the editor
+EDIT = 'edit'
+
+
+class Opener:
+    """Looks up the command to open files with.
+
+    The rules are compiled when the option changes, and lookups are cached by
+    the file's name, device, inode and mtime, so MIME types are detected only
+    once per file.
+    """
+
+    def __init__(self, options, size=CACHE_SIZE):
+        self._options = options
+        self._size = size
+        # The option value that the rules were compiled from
+        self._rules_value = None
+        # (regex, command) of name patterns
+        self._name_rules = []
+        # (pattern, command) of MIME type patterns
+        self._mime_rules = []
+        self._commands = OrderedDict()
+
+    def _compile(self):
+        value = self._options['open_rules'].value
+        if value is self._rules_value:
+            return
+        self._rules_value = value
+        self._name_rules, self._mime_rules = [], []
+        for pattern, command in value:
+            if '/' in pattern:
+                self._mime_rules.append((pattern, command))
+            else:
+                regex = re.compile(fnmatch.translate(pattern.lower()))
+                self._name_rules.append((regex, command))
+        self._commands.clear()
+
+    def command(self, path, stat_res):
+        """Return the command to open `path` (with `stat_res`) with, or
+        `EDIT`."""
+        self._compile()
+        path_str = str(path)
+        key = (os.path.basename(path_str), stat_res.st_dev, stat_res.st_ino,
+               stat_res.st_mtime)
+        try:
+            command = self._commands[key]
+        except KeyError:
+            command = self._commands[key] = self._match(path_str, stat_res)
+            while len(self._commands) > self._size:
+                self._commands.popitem(last=False)
+        else:
+            self._commands.move_to_end(key)
+        return command
+
+    def _match(self, path_str, stat_res):
+        name = os.path.basename(path_str).lower()
+        for regex, command in self._name_rules:
+            if regex.match(name):
+                return command
+        if self._mime_rules and S_ISREG(stat_res.st_mode):
+            mime = compute('mime', path_str, stat_res)
+            for pattern, command in self._mime_rules:
+                if fnmatch.fnmatchcase(mime, pattern):
+                    return command
+        return EDIT
+
+
+def command_args(command, path_str):
+    """Return the arguments of `command` for opening `path_str`."""
+    args = shlex.split(command)
+    if '{}' in args:
+        return [path_str if a == '{}' else a for a in args]
+    return args + [path_str]
+
+
+def spawn(command, path_str):
+    """Run `command` on `path_str`, detached from nvim."""
+    subprocess.Popen(
+        command_args(command, path_str), cwd=os.path.dirname(path_str),
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def editor_args(path_str, line=None):
+    """Return the arguments to run $EDITOR on `path_str`."""
+    args = shlex.split(os.environ.get('EDITOR') or 'vi')
+    if line is not None:
+        args.append('+%d' % line)
+    return args + [path_str]
+
+
+def open_in_server(address, path_str, line=None):
+    """Edit `path_str` in a new tab of the nvim listening on `address`.
+
+    This blocks, so it's meant to run on a worker. Returns the error, or
+    `None` on success.
+    """
+    try:
+        host, _, port = address.rpartition(':')
+        if host and port.isdigit() and not os.path.exists(address):
+            nvim = pynvim.attach('tcp', address=host, port=int(port))
+        else:
+            nvim = pynvim.attach('socket', path=address)
+    except (OSError, EOFError) as e:
+        return e
+    try:
+        cmd = 'tabedit '
+        if line is not None:
+            cmd += '+%d ' % line
+        nvim.command(cmd + nvim.funcs.fnameescape(path_str))
+    except (OSError, EOFError, pynvim.NvimError) as e:
+        return e
+    finally:
+        nvim.close()
+    return None
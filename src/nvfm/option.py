@@ -1,6 +1,8 @@
 from datetime import datetime
 from functools import partial
+import os
 
+from .columns import providers
 from .config import sort_funcs
 
 
@@ -86,7 +88,10 @@ class ColumnsOption(Option):
             'nlink': '{nlink}',
             'user': ' {uid:>5.5s}',
             'group': ' {gid:>5.5s}',
+            'git': ' {git:1}',
         }
+        formatters.update({name: provider.template
+                           for name, provider in providers.items()})
         self.template = ''.join([formatters[c] for c in self.value])
 
 
@@ -134,3 +139,123 @@ class TimeFormat(Option):
     @staticmethod
     def format_strftime(time, format):
         return datetime.fromtimestamp(time).strftime(format)
+
+
+class PersistentCacheOption(Option):
+    """Keep directory listings in an on-disk cache across sessions."""
+
+    key = 'persistent_cache'
+    default = False
+
+    @staticmethod
+    def convert(val):
+        return bool(val)
+
+
+class CacheDaemonOption(Option):
+    """Get directory listings from a cache daemon shared by all instances.
+
+    The daemon is started on demand. Listings are requested without waiting,
+    so directories are listed as usual until the daemon's listing arrived, or
+    if it can't be reached.
+    """
+
+    key = 'cache_daemon'
+    default = False
+
+    @staticmethod
+    def convert(val):
+        return bool(val)
+
+
+class IndexRootsOption(Option):
+    """Directories whose trees are kept in a persistent filename index."""
+
+    key = 'index_roots'
+    default = []
+
+    @staticmethod
+    def convert(val):
+        return [os.path.abspath(os.path.expanduser(p)) for p in val]
+
+
+class ShowHiddenOption(Option):
+    """Show dotfiles in directory listings."""
+
+    key = 'show_hidden'
+    default = True
+
+    @staticmethod
+    def convert(val):
+        return bool(val)
+
+
+class ShowIgnoredOption(Option):
+    """Show files that are ignored by .gitignore/.ignore/.fdignore rules."""
+
+    key = 'show_ignored'
+    default = True
+
+    @staticmethod
+    def convert(val):
+        return bool(val)
+
+
+class ProgressiveThresholdOption(Option):
+    """Number of entries above which listings show names first and fill in
+    the other columns progressively."""
+
+    key = 'progressive_threshold'
+    default = 5000
+
+    @staticmethod
+    def convert(val):
+        return int(val)
+
+
+class OpenerOption(Option):
+    """How files are opened in the editor.
+
+    "suspend" suspends nvim and runs $EDITOR from the shell wrapper,
+    "terminal" runs $EDITOR in a terminal buffer in a tab, and "server" opens
+    the file in the nvim at `editor_server`. Files aren't edited in this nvim
+    itself, because the mappings of nvfm are global.
+    """
+
+    key = 'opener'
+    default = 'suspend'
+    choices = ('suspend', 'terminal', 'server')
+
+    @classmethod
+    def convert(cls, val):
+        if val not in cls.choices:
+            raise ValueError('Invalid value for option "opener"')
+        return val
+
+
+class OpenRulesOption(Option):
+    """Commands to open files with, as a list of `[pattern, command]`.
+
+    Patterns containing "/" match MIME types (like "image/*"), others match
+    file names (like "*.pdf"). The path is appended to the command, or
+    replaces "{}" in it. The command "edit" opens the file in the editor.
+    """
+
+    key = 'open_rules'
+    default = []
+
+    @staticmethod
+    def convert(val):
+        return [(str(pattern), str(command)) for pattern, command in val]
+
+
+class EditorServerOption(Option):
+    """Address of the nvim that files are opened in with the "server"
+    opener (a socket path or host:port)."""
+
+    key = 'editor_server'
+    default = ''
+
+    @staticmethod
+    def convert(val):
+        return os.path.expanduser(val)
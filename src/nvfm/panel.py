@@ -3,7 +3,19 @@ from pathlib import Path
 
 from .event import EventEmitter, Global
 from .util import logger
-from .view import DirectoryView, EmptyView
+from .view import DirectoryView, EmptyView, FileView, load_view
+from .worker import MAX_WORKERS
+
+# Seconds to wait for a preview before showing a placeholder
+PREVIEW_WAIT = .05
+
+# Seconds after which a preview that's still loading is given up
+PREVIEW_TIME_BUDGET = 3
+
+# Max number of previews loading at once (one per preview thread). Loads
+# that hang, e.g. on an unreachable mount, can't be interrupted, so requests
+# wait for a free thread instead of queuing up behind them.
+PREVIEW_LOADS = MAX_WORKERS
 
 
 class Panel(EventEmitter):
@@ -86,16 +98,131 @@ class LeftPanel(Panel):
 
 
 class RightPanel(Panel):
+    """Shows a preview of the item focused in the main panel.
+
+    Previews that aren't cached yet are loaded on a worker thread, so a slow
+    file system can't block the UI. The current view stays until the preview
+    arrives, or a placeholder is shown after `PREVIEW_WAIT`. Only the latest
+    request is applied, and only the latest one waits if all preview threads
+    are busy. Previews are scheduled to run after the request that moved the
+    focus, so they don't delay the next keypress.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Whether previewed files are followed as they grow
+        self.following = False
+        # Increased with each request, to tell stale results apart
+        self._generation = 0
+        self._pending = None
+        self._timer = None
+        # Number of previews being loaded
+        self._running = 0
+        # `(generation, item, line)` of the request waiting for a thread
+        self._queued = None
+
+    def toggle_follow(self):
+        self.following = not self.following
+        view = self.view
+        if not isinstance(view, FileView):
+            return
+        if self.following:
+            view.follow()
+        else:
+            view.unfollow()
+            self.reload_view()
+
+    def schedule_preview(self, item, line=None):
+        """Preview `item` once the current request has returned.
+
+        Only the latest of several scheduled previews is shown.
+        """
+        self._s.deferred.schedule('preview', self.preview, item, line)
+
+    def preview(self, item, line=None):
+        """Show `item`, with the cursor on `line` if given."""
+        self._generation += 1
+        generation = self._generation
+        self._cancel_pending()
+        view = self._s.views.get(item)
+        if view is not None and view.dirty < 2:
+            self._show(view, line)
+            return
+        self._timer = self._s.preview_worker.call_later(
+            PREVIEW_WAIT, self._show_loading, generation)
+        if self._running >= PREVIEW_LOADS:
+            self._queued = (generation, item, line)
+            return
+        self._load(generation, item, line)
+
+    def _load(self, generation, item, line):
+        def loaded(res):
+            self._load_finished()
+            self._loaded(generation, item, res, line)
+        self._running += 1
+        self._pending = self._s.preview_worker.submit(
+            load_view, self._s, item, callback=loaded,
+            errback=lambda error: self._load_finished())
+
+    def _load_finished(self):
+        self._running -= 1
+        queued, self._queued = self._queued, None
+        if queued is not None and queued[0] == self._generation:
+            self._load(*queued)
+
+    def _cancel_pending(self):
+        if self._pending is not None:
+            if self._pending.cancel():
+                # It never started
+                self._running -= 1
+            self._pending = None
+        self._queued = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _show_loading(self, generation):
+        if generation != self._generation:
+            return
+        self.view = self._s.views.message('(loading...)')
+        self._timer = self._s.preview_worker.call_later(
+            PREVIEW_TIME_BUDGET - PREVIEW_WAIT, self._timed_out, generation)
+
+    def _loaded(self, generation, item, loaded, line):
+        if generation != self._generation:
+            # The focus has moved on
+            return
+        self._generation += 1
+        self._cancel_pending()
+        self._show(self._s.views.add_loaded(item, loaded), line)
+
+    def _timed_out(self, generation):
+        if generation != self._generation:
+            return
+        logger.debug(('preview:timed_out', self))
+        self._generation += 1
+        self._cancel_pending()
+        self.view = self._s.views.message('(preview timed out)', 'NvfmError')
+
+    def _show(self, view, line):
+        self.view = view
+        if self.following and isinstance(view, FileView):
+            view.follow()
+        if line is not None:
+            # Show the line of a search result
+            view.cursor = [min(line, len(view.buf)), 0]
+            self.update_vim_cursor()
 
     @MainPanel.on('focus_changed')
     def _main_focus_changed(self, view):
-        self.view = self._s.views[view.focused_item]
+        self.schedule_preview(view.focused_item,
+                              getattr(view, 'focused_line', None))
 
     @MainPanel.on('view_loaded')
     def _main_view_loaded(self, view):
         """A view was loaded in the main panel. Preview its focused item."""
         if isinstance(view, DirectoryView):
             if view.empty:
-                self.view = self._s.views[None]
+                self.schedule_preview(None)
             else:
-                self.view = self._s.views[view.focused_item]
+                self.schedule_preview(view.focused_item)
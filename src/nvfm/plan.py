@@ -0,0 +1,45 @@
+"""Planning which syscalls a directory listing needs.
+
+A listing with only names and the git column doesn't need to stat entries,
+because the type of entries is known from `os.scandir()`. The fewer columns
+are shown, the cheaper the listing.
+"""
+from collections import namedtuple
+
+from .columns import providers
+
+# Columns whose values come from the stat of entries
+STAT_COLUMNS = frozenset(['mode', 'size', 'atime', 'ctime', 'mtime', 'ino',
+                          'nlink', 'user', 'group'])
+
+
+class ListingPlan(namedtuple('ListingPlan',
+                             'column_stat sort_stat count_children')):
+    """The syscalls needed to sort and format a listing.
+
+    `column_stat` and `sort_stat` tell whether the columns or the sort
+    function need the stat of entries. If neither does, entries aren't
+    stat'ed, and link targets and single-child directories aren't resolved.
+    `count_children` tells whether subdirectories are listed to show their
+    number of items.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_options(cls, options):
+        columns = options['columns'].value
+        sort = options['sort'].value
+        return cls(
+            column_stat=any(c in STAT_COLUMNS or c in providers
+                            for c in columns),
+            sort_stat=getattr(sort, 'needs_stat', True),
+            count_children='size' in columns,
+        )
+
+    @property
+    def stat(self):
+        return self.column_stat or self.sort_stat
+
+
+# The plan of a listing that shows everything
+FULL_PLAN = ListingPlan(True, True, True)
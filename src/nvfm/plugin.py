@@ -1,4 +1,5 @@
 # -*- coding: future_fstrings -*-
+import atexit
 import getpass
 import os
 from pathlib import Path
@@ -7,14 +8,30 @@ from stat import S_ISDIR
 
 import pynvim
 
+from . import symlink
+from .base_view import BufferPool
+from .cache import DirCache
 from .color import ColorManager
+from .columns import ColumnCache
 from .config import filter_funcs
+from .daemon import DaemonClient
 from .event import Event, EventManager, Global
-from .history import History
+from .find_view import CompareView, FindView, GrepView, ResultsView
+from .flat_view import FlatView
+from .git import GitStatus
+from .history import Frecency, History
+from .ignore import IgnoreCache
+from .index import Indexes
+from .jobs import (ChmodJob, CopyJob, DeleteJob, JobQueue, MoveJob,
+                   TrashJob)
+from .opener import (EDIT, Opener, editor_args, open_in_server,
+                     spawn)
 from .option import Options
 from .panel import LeftPanel, MainPanel, RightPanel
+from .tree_view import TreeView
 from .util import logger, stat_path
 from .view import DirectoryView, Views
+from .worker import Deferred, Worker
 
 HOST = platform.node()
 USER = getpass.getuser()
@@ -23,6 +40,7 @@ USER = getpass.getuser()
 class Session:
 
     def __init__(self, vim):
+        self._vim = vim
         wins = vim.windows
         self.events = EventManager()
         self.left_panel = LeftPanel(self, wins[0])
@@ -30,10 +48,38 @@ class Session:
         self.right_panel = RightPanel(self, wins[2])
         self.panels = [self.left_panel, self.main_panel, self.right_panel]
         self.wins = {p.win.handle: p.win for p in self.panels}
+        self.buffers = BufferPool(vim)
         self.views = Views(self, vim)
         self.options = Options()
         self.history = History()
+        self.frecency = Frecency()
+        self.frecency.load()
+        atexit.register(self.frecency.flush)
         self.colors = ColorManager(vim)
+        self.worker = Worker(vim)
+        # Separate threads for previews, so they can't hold up other work
+        self.preview_worker = Worker(vim)
+        # Updates that nvim doesn't need to wait for (tabline, preview, ...)
+        self.deferred = Deferred(vim)
+        self.dir_cache = DirCache()
+        self.daemon = DaemonClient(
+            lambda path: vim.async_call(self._daemon_invalidated, path))
+        self.git = GitStatus(self.worker, self._git_status_updated)
+        self.columns = ColumnCache(self.worker, self._columns_updated)
+        self.indexes = Indexes(self.worker, self.options)
+        self.ignore = IgnoreCache()
+        # Paths (as strings) of marked items
+        self.marks = set()
+        self.jobs = JobQueue(vim, self._job_progress, self._job_done)
+        # The last job that had errors
+        self.failed_job = None
+        # Paths to paste (as strings)
+        self.clipboard = []
+        # The tree view of the main panel (there's at most one)
+        self.tree = None
+        self.opener = Opener(self.options)
+        # Whether this is a persistent instance that UIs attach to
+        self.server = os.environ.get('NVFM_SERVER') == '1'
         try:
             self.cmd_path = Path(os.environ['NVFM_TMP']) / 'cmd'
         except KeyError:
@@ -43,6 +89,89 @@ class Session:
     def cwd(self):
         return self.main_panel.view.path
 
+    def selection(self):
+        """Return the marked paths, or the focused item if none are marked."""
+        if self.marks:
+            return sorted(self.marks)
+        focused_item = self.main_panel.view.focused_item
+        return [str(focused_item)] if focused_item is not None else []
+
+    def clear_marks(self):
+        self.marks.clear()
+        for panel in self.panels:
+            if isinstance(panel.view, DirectoryView):
+                panel.view.draw_marks()
+
+    def _job_progress(self, job): # pylint:disable=unused-argument
+        self._vim.vars['statusline3'] = self.jobs.status()
+        self._vim.command('redrawstatus!')
+
+    def _job_done(self, job):
+        logger.debug(('job:done', job, job.num_errors))
+        self._job_progress(job)
+        if job.errors:
+            self.failed_job = job
+            path, error = job.errors[0]
+            self._vim.vars['nvfm_msg'] = \
+                f'{job.name}: {job.num_errors} errors ({path}: {error})'
+            self._vim.command('echohl ErrorMsg | echomsg g:nvfm_msg | '
+                              'echohl None')
+        elif job.summary() is not None:
+            self._vim.vars['nvfm_msg'] = job.summary()
+            self._vim.command('echomsg g:nvfm_msg')
+        self.refresh_paths(job.affected_dirs, job.removed)
+
+    def refresh_paths(self, dirs, removed):
+        """Reload the views of directories `dirs` and drop the views of
+        `removed` paths (and their descendants)."""
+        removed = [Path(p) for p in removed]
+        self.marks.difference_update(map(str, removed))
+        displayed = {p.view for p in self.panels}
+        for key, view in list(self.views.items()):
+            if key is None:
+                continue
+            gone = any(key == r or r in key.parents for r in removed)
+            if gone and view not in displayed:
+                del self.views[key]
+            elif gone:
+                view.dirty = 2
+        for path in dirs:
+            for view in self.views.showing(Path(path)):
+                view.dirty = 2
+        self.git.invalidate()
+        symlink.invalidate()
+        for panel in self.panels:
+            if getattr(panel.view, 'dirty', 0):
+                panel.reload_view()
+        main_view = self.main_panel.view
+        if isinstance(main_view, DirectoryView):
+            self.right_panel.schedule_preview(main_view.focused_item)
+
+    def _daemon_invalidated(self, path):
+        """The cache daemon reports that directory `path` changed."""
+        views = self.views.showing(Path(path))
+        for view in views:
+            view.dirty = 2
+        for panel in self.panels:
+            if panel.view in views:
+                panel.reload_view()
+
+    def _git_status_updated(self, root):
+        """Redraw views in repository `root` after its status arrived."""
+        for view in self.views.all_views():
+            if isinstance(view, DirectoryView) and \
+                    GitStatus.contains(root, view.path):
+                view.redraw()
+
+    def _columns_updated(self, dirs):
+        """Redraw views of directories `dirs` after column values arrived."""
+        for path in dirs:
+            for view in self.views.showing(Path(path)):
+                if isinstance(view, DirectoryView):
+                    # Values arrive in batches, draw them together
+                    self.deferred.schedule(('columns', id(view)),
+                                           view.redraw_columns)
+
 
 @pynvim.plugin
 class Plugin:
@@ -74,13 +203,17 @@ class Plugin:
             if target is None:
                 return
         elif what == '..':
-            # '..' in paths isn't collapsed automatically
-            target = main_view.path.parent
+            if isinstance(main_view, ResultsView):
+                # Leave the search results
+                target = main_view.path
+            else:
+                # '..' in paths isn't collapsed automatically
+                target = main_view.path.parent
         else:
             target = main_view.path / what
         stat_res, stat_error = stat_path(target, lstat=False)
         if (stat_error is not None) or not S_ISDIR(stat_res.st_mode):
-            self.launch(target)
+            self.launch(target, getattr(main_view, 'focused_line', None))
             return
         if resolve_symlinks:
             target = target.resolve()
@@ -95,6 +228,198 @@ class Plugin:
         # TODO Escape
         self._vim.command('cd ' + str(path))
 
+    @pynvim.function('NvfmFindStart', sync=True)
+    def func_nvfm_find_start(self, args):
+        """Start a recursive search in the current directory.
+
+        args[0] is an optional dict of walker options ("hidden", "ignore",
+        "type") and "substring" (match substrings instead of fuzzy). If the
+        current directory is in an indexed root, results come from the index.
+        """
+        options = dict(args[0]) if args else {}
+        index = None
+        if options.get('ignore', True):
+            # The index doesn't contain ignored files
+            index = self._s.indexes.get(self._s.cwd)
+        view = FindView(self._s, self._vim, self._s.cwd, index=index,
+                        **options)
+        self._s.main_panel.view = view
+        view.start()
+
+    @pynvim.function('NvfmFollow', sync=True)
+    def func_nvfm_follow(self, args): # pylint:disable=unused-argument
+        """Toggle following the end of files in the right panel."""
+        self._s.right_panel.toggle_follow()
+
+    @pynvim.function('NvfmTree', sync=True)
+    def func_nvfm_tree(self, args): # pylint:disable=unused-argument
+        """Switch the main panel between the tree and the regular listing."""
+        s = self._s
+        view = s.main_panel.view
+        if isinstance(view, TreeView):
+            listing = s.views[view.path]
+            focused_item = view.focused_item
+            if focused_item is not None and focused_item.parent == view.path:
+                listing.focused_item = focused_item
+            s.main_panel.view = listing
+            return
+        if not isinstance(view, DirectoryView):
+            return
+        if s.tree is None or s.tree.path != view.path:
+            if s.tree is not None:
+                s.views.remove_derived(s.tree)
+            s.tree = TreeView(s, self._vim, view.path)
+            s.tree.focus = view.focus
+            s.views.add_derived(s.tree)
+        s.main_panel.view = s.tree
+
+    @pynvim.function('NvfmFlat', sync=True)
+    def func_nvfm_flat(self, args):
+        """List everything below the current directory as one flat list.
+
+        args[0] is the number of levels (all levels if it's `None`). If the
+        flat list is shown already, return to the regular listing.
+        """
+        s = self._s
+        view = s.main_panel.view
+        if isinstance(view, FlatView):
+            s.main_panel.view = s.views[view.path]
+            return
+        if not isinstance(view, DirectoryView):
+            return
+        depth = args[0] if args else None
+        flat = FlatView(s, self._vim, view.path, depth=depth)
+        s.views.add_derived(flat)
+        s.main_panel.view = flat
+
+    @pynvim.function('NvfmExpand', sync=True)
+    def func_nvfm_expand(self, args): # pylint:disable=unused-argument
+        view = self._s.main_panel.view
+        if isinstance(view, TreeView):
+            view.toggle_expand()
+            self._s.right_panel.schedule_preview(view.focused_item)
+
+    @pynvim.function('NvfmGrep', sync=True)
+    def func_nvfm_grep(self, args):
+        """Search the contents of all files below the current directory.
+
+        args[0] is the search string, args[1] an optional dict of walker
+        options ("hidden", "ignore").
+        """
+        query = args[0]
+        options = dict(args[1]) if len(args) > 1 else {}
+        view = GrepView(self._s, self._vim, self._s.cwd, query=query,
+                        **options)
+        self._s.main_panel.view = view
+        view.start()
+
+    @pynvim.function('NvfmCompare', sync=True)
+    def func_nvfm_compare(self, args):
+        """Compare the current directory with directory args[0].
+
+        The comparison is shown in the main panel, the other directory in the
+        left panel. args[1] is an optional dict of options ("hidden").
+        """
+        other = self._s.cwd / Path(os.path.expanduser(args[0]))
+        options = dict(args[1]) if len(args) > 1 else {}
+        if not other.is_dir():
+            self._echo_error(f'Not a directory: {other}')
+            return
+        view = CompareView(self._s, self._vim, self._s.cwd, other=other,
+                           **options)
+        self._s.main_panel.view = view
+        self._s.left_panel.view = self._s.views[other]
+        view.start()
+
+    @pynvim.function('NvfmCancel', sync=True)
+    def func_nvfm_cancel(self, args): # pylint:disable=unused-argument
+        """Cancel the search in the main panel."""
+        main_view = self._s.main_panel.view
+        if isinstance(main_view, ResultsView):
+            main_view.cancel()
+
+    @pynvim.function('NvfmIndex', sync=True)
+    def func_nvfm_index(self, args): # pylint:disable=unused-argument
+        """Update the filename indexes of all configured roots."""
+        self._s.indexes.update_all()
+
+    @pynvim.function('NvfmMark', sync=True)
+    def func_nvfm_mark(self, args): # pylint:disable=unused-argument
+        """Toggle the mark of the focused item."""
+        main_view = self._s.main_panel.view
+        if isinstance(main_view, DirectoryView):
+            main_view.toggle_mark()
+
+    @pynvim.function('NvfmUnmarkAll', sync=True)
+    def func_nvfm_unmark_all(self, args): # pylint:disable=unused-argument
+        self._s.clear_marks()
+
+    @pynvim.function('NvfmJob', sync=True)
+    def func_nvfm_job(self, args):
+        """Run a bulk operation on the marked items (or the focused item).
+
+        args[0] is one of "delete", "trash", "move" (into the current
+        directory), "chmod" (args[1] is the mode) and "paste" (copies the
+        items of `NvfmCopy()` into the current directory).
+        """
+        kind = args[0]
+        paths = self._s.selection()
+        if kind == 'paste':
+            if not self._s.clipboard:
+                self._vim.err_write('Nothing to paste\n')
+                return
+            self._s.jobs.add(CopyJob(self._s.clipboard, self._s.cwd))
+            return
+        if kind == 'move':
+            if not self._s.marks:
+                self._vim.err_write('No marked items to move\n')
+                return
+            job = MoveJob(paths, self._s.cwd)
+        elif not paths:
+            return
+        elif kind == 'delete':
+            job = DeleteJob(paths)
+        elif kind == 'trash':
+            job = TrashJob(paths)
+        elif kind == 'chmod':
+            try:
+                job = ChmodJob(paths, args[1])
+            except ValueError as e:
+                self._vim.err_write(str(e) + '\n')
+                return
+        else:
+            raise ValueError('Unknown job: %r' % kind)
+        self._s.jobs.add(job)
+        self._s.clear_marks()
+
+    @pynvim.function('NvfmCopy', sync=True)
+    def func_nvfm_copy(self, args): # pylint:disable=unused-argument
+        """Remember the marked items (or the focused item) for pasting."""
+        self._s.clipboard = self._s.selection()
+        self._s.clear_marks()
+        self._vim.vars['nvfm_msg'] = \
+            '%d items to paste' % len(self._s.clipboard)
+        self._vim.command('echo g:nvfm_msg')
+
+    @pynvim.function('NvfmJobCancel', sync=True)
+    def func_nvfm_job_cancel(self, args): # pylint:disable=unused-argument
+        """Cancel all running and queued jobs."""
+        self._s.jobs.cancel_all()
+
+    @pynvim.function('NvfmJobErrors', sync=True)
+    def func_nvfm_job_errors(self, args): # pylint:disable=unused-argument
+        """Show the errors of the last job that failed."""
+        job = self._s.failed_job
+        if job is None:
+            return
+        for path, error in job.errors:
+            self._vim.vars['nvfm_msg'] = f'{job.name}: {path}: {error}'
+            self._vim.command('echomsg g:nvfm_msg')
+        if job.num_errors > len(job.errors):
+            self._vim.vars['nvfm_msg'] = \
+                f'({job.num_errors - len(job.errors)} more errors)'
+            self._vim.command('echomsg g:nvfm_msg')
+
     @pynvim.function('NvfmHistory', sync=True)
     def func_nvfm_history(self, args):
         step = args[0]
@@ -104,11 +429,44 @@ class Plugin:
             return
         self.go_to(path)
 
+    @pynvim.function('NvfmJump', sync=True)
+    def func_nvfm_jump(self, args):
+        """Go to the best ranked visited directory matching args[0].
+
+        args[0] are keywords, which have to appear in the path in order (the
+        last one in the directory name).
+        """
+        for path in self._s.frecency.query(args[0]):
+            if not os.path.isdir(path):
+                # Forget directories that are gone
+                self._s.frecency.remove(path)
+                continue
+            if Path(path) != self._s.cwd:
+                self.go_to(Path(path))
+                return
+        self._vim.err_write('No matching directory\n')
+
     @pynvim.function('NvfmSet', sync=True)
     def func_nvfm_set(self, args):
         key, val = args
         self._s.options[key] = val
 
+    @pynvim.function('NvfmToggle', sync=True)
+    def func_nvfm_toggle(self, args):
+        """Toggle a boolean option and redraw.
+
+        Views aren't reloaded, so toggling "show_hidden" or "show_ignored"
+        selects items from the last scan instead of listing directories again.
+        """
+        key = args[0]
+        self._s.options[key] = not self._s.options[key].value
+        self._s.views.mark_all_dirty(1)
+        for panel in self._s.panels:
+            panel.reload_view()
+        main_view = self._s.main_panel.view
+        if isinstance(main_view, DirectoryView):
+            self._s.right_panel.schedule_preview(main_view.focused_item)
+
     @pynvim.function('NvfmRefresh', sync=True)
     def func_nvfm_refresh(self, args): # pylint:disable=unused-argument
         """Refresh all views.
@@ -116,9 +474,41 @@ class Plugin:
         This marks all views as dirty and reloads the visible ones.
         """
         self._s.views.mark_all_dirty()
+        self._s.git.invalidate()
+        symlink.invalidate()
         for panel in self._s.panels:
             panel.reload_view()
 
+    @pynvim.function('NvfmAttach', sync=True)
+    def func_nvfm_attach(self, args):
+        """Show directory args[0] in a UI that attaches to the server.
+
+        Views may be stale after the server idled, so they're refreshed, but
+        the other caches, the history and the frecency stay warm. UIs would
+        share the grid and the session, so only one may be attached. Returns
+        1 if the UI may attach, or 0 if another one is attached.
+        """
+        if self._vim.api.list_uis():
+            return 0
+        self.func_nvfm_refresh([])
+        self.func_nvfm_enter([args[0]])
+        return 1
+
+    @pynvim.function('NvfmQuit', sync=True)
+    def func_nvfm_quit(self, args): # pylint:disable=unused-argument
+        """Quit, or detach the UI if this is a server.
+
+        `NvfmAttach()` allows only one UI, so the UIs are the one that quits.
+        """
+        if not self._s.server:
+            self._vim.command('qall!')
+            return
+        self._s.frecency.flush()
+        for ui in self._vim.api.list_uis():
+            if ui.get('chan'):
+                # Closing the channel makes the remote UI exit
+                self._vim.funcs.chanclose(ui['chan'])
+
     @pynvim.function('NvfmFilter', sync=True)
     def func_nvfm_filter(self, args):
         query = args[0]
@@ -137,8 +527,11 @@ class Plugin:
     # If sync=True, the syntax highlighting is not applied
     @pynvim.autocmd('CursorMoved', sync=True, eval='win_getid()')
     def cursor_moved(self, win_id):
-        # pylint:disable=unidiomatic-typecheck
-        if type(self._s.main_panel.view) is not DirectoryView:
+        if win_id not in self._s.wins:
+            # E.g. a file opened in a tab
+            return
+        main_view = self._s.main_panel.view
+        if not isinstance(main_view, (DirectoryView, ResultsView)):
             # TODO Refactor
             return
         # TODO Refactor
@@ -147,9 +540,8 @@ class Plugin:
         # TODO Error when moving around .dotfiles/LS_COLORS
         self._s.events.publish(
             Event('cursor_moved', Global), self._s.wins[win_id])
-        # TODO Do tabline/statusline update elsewhere, e.g. on focus_changed
-        self._update_tabline()
-        self._update_status_main()
+        self._s.deferred.schedule('tabline', self._update_tabline)
+        self._s.deferred.schedule('status_main', self._update_status_main)
 
     @pynvim.autocmd('BufWinEnter', sync=True, eval='win_getid()')
     def buf_win_enter(self, win_id):
@@ -157,7 +549,7 @@ class Plugin:
         # main panel (e.g. when FZF is launched), some window properties get
         # reset. So we restore them here.
         # TODO Add test
-        if self._s is None:
+        if self._s is None or win_id not in self._s.wins:
             return
         if self._s.wins[win_id] != self._s.main_panel.win:
             return
@@ -168,11 +560,63 @@ class Plugin:
     @MainPanel.on('view_loaded')
     def add_history(self, view):
         self._s.history.add(view.path)
+        if isinstance(view, DirectoryView):
+            self._s.frecency.add(view.path)
+
+    def launch(self, target, line=None):
+        """Open file `target` (at `line`) with the command of its rule, or
+        in the editor as the `opener` option tells."""
+        path_str = str(target)
+        stat_res, _ = stat_path(target, lstat=False)
+        command = EDIT
+        if stat_res is not None:
+            command = self._s.opener.command(path_str, stat_res)
+        if command != EDIT:
+            try:
+                spawn(command, path_str)
+            except (OSError, ValueError) as e:
+                self._echo_error(f'{command}: {e}')
+            return
+        opener = self._s.options['opener'].value
+        if opener == 'suspend' and self._s.server:
+            # There's no shell wrapper to take over
+            opener = 'terminal'
+        if opener == 'terminal':
+            self._edit_in_terminal(path_str, line)
+        elif opener == 'server':
+            address = self._s.options['editor_server'].value
+            if not address:
+                self._echo_error('editor_server is not set')
+                self._edit_in_terminal(path_str, line)
+                return
+            self._s.worker.submit(
+                open_in_server, address, path_str, line,
+                callback=lambda error: self._server_opened(
+                    error, path_str, line))
+        else:
+            self._suspend_to_editor(target, line)
+
+    def _edit_in_terminal(self, path_str, line=None):
+        self._vim.call('NvfmTermOpen', editor_args(path_str, line))
+
+    def _server_opened(self, error, path_str, line):
+        if error is None:
+            return
+        self._echo_error(f'editor_server: {error}')
+        # Edit it here instead
+        self._edit_in_terminal(path_str, line)
+
+    def _echo_error(self, msg):
+        self._vim.vars['nvfm_msg'] = msg
+        self._vim.command('echohl ErrorMsg | echomsg g:nvfm_msg | '
+                          'echohl None')
 
-    def launch(self, target):
-        # TODO Proper application launcher implementation
+    def _suspend_to_editor(self, target, line=None):
         with open(self._s.cmd_path, 'w') as f:
-            f.write('$EDITOR ' + str(target))
+            cmd = '$EDITOR '
+            if line is not None:
+                cmd += '+%d ' % line
+            f.write(cmd + str(target))
         # Suspend vim, so the bash wrapper can take over and launch the editor
         self._vim.command('suspend!')
 
@@ -205,3 +649,5 @@ class Plugin:
         self._vim.vars['statusline1'] = \
             f'{view.focus}/{len(view.items)} ' \
             f'sort: {self._s.options["sort"].name}'
+        # Variables in the statusline aren't watched for changes
+        self._vim.command('redrawstatus')
@@ -5,12 +5,31 @@
 call remote#host#RegisterPlugin('python3', resolve(expand('<sfile>:p:h') . '/../../'), [
       \ {'sync': v:true, 'name': 'BufWinEnter', 'type': 'autocmd', 'opts': {'pattern': '*', 'eval': 'win_getid()'}},
       \ {'sync': v:true, 'name': 'CursorMoved', 'type': 'autocmd', 'opts': {'pattern': '*', 'eval': 'win_getid()'}},
+      \ {'sync': v:true, 'name': 'NvfmAttach', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmCancel', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmCompare', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmCopy', 'type': 'function', 'opts': {}},
       \ {'sync': v:true, 'name': 'NvfmEnter', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmExpand', 'type': 'function', 'opts': {}},
       \ {'sync': v:true, 'name': 'NvfmFilter', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmFindStart', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmFlat', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmFollow', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmGrep', 'type': 'function', 'opts': {}},
       \ {'sync': v:true, 'name': 'NvfmHistory', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmIndex', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmJob', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmJobCancel', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmJobErrors', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmJump', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmMark', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmQuit', 'type': 'function', 'opts': {}},
       \ {'sync': v:true, 'name': 'NvfmRefresh', 'type': 'function', 'opts': {}},
       \ {'sync': v:true, 'name': 'NvfmSet', 'type': 'function', 'opts': {}},
       \ {'sync': v:true, 'name': 'NvfmStartup', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmToggle', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmTree', 'type': 'function', 'opts': {}},
+      \ {'sync': v:true, 'name': 'NvfmUnmarkAll', 'type': 'function', 'opts': {}},
      \ ])
 
 
@@ -23,11 +23,6 @@ function Foldtext()
     return '(+' . (v:foldend - v:foldstart + 1) . ') '
 endfunction
 
-" Reset any FZF configuration via environment vars
-let $FZF_DEFAULT_COMMAND=''
-let $FZF_DEFAULT_OPTS=''
-
-
 hi CursorLine ctermbg=236 cterm=none
 hi Cursor          ctermfg=red  ctermbg=red
 " hi Normal       ctermfg=231 ctermbg=233 guifg=#ffffff guibg=#121212
@@ -49,6 +44,20 @@ hi StatusLineNC    ctermfg=white ctermbg=236 cterm=none
 hi FileMeta ctermfg=243
 hi NvfmMessage ctermfg=246
 
+hi NvfmGitModified ctermfg=214
+hi NvfmGitStaged ctermfg=114
+hi NvfmGitUntracked ctermfg=110
+hi NvfmGitIgnored ctermfg=240
+
+hi NvfmMarked ctermfg=black ctermbg=178
+hi NvfmOrphan ctermfg=red cterm=bold
+
+hi NvfmCompareLeft ctermfg=110
+hi NvfmCompareRight ctermfg=176
+hi NvfmCompareDifferent ctermfg=203
+hi NvfmCompareTouched ctermfg=214
+hi NvfmCompareIdentical ctermfg=240
+
 
 noremap <silent>a <nop>
 noremap <silent>A <nop>
@@ -65,10 +74,9 @@ noremap <silent>R <nop>
 noremap <silent>s <nop>
 noremap <silent>S <nop>
 noremap <silent>u <nop>
-noremap <silent>U <nop>
 
-noremap <silent>q :qall!<CR>
-noremap <silent>Q :qall!<CR>
+noremap <silent>q :call NvfmQuit()<CR>
+noremap <silent>Q :call NvfmQuit()<CR>
 noremap <silent> <S-j> 4j
 noremap <silent> <S-k> 4k
 
@@ -83,8 +91,32 @@ noremap <silent>gr :call NvfmEnter('/')<CR>
 nnoremap <silent>r :call NvfmRefresh()<CR>
 nnoremap <silent>e :call ViewFile()<CR>
 
+" Follow the end of growing files (like tail -f)
+noremap <silent>tf :call NvfmFollow()<CR>
+" Tree mode, <Tab> expands and collapses directories
+noremap <silent>tt :call NvfmTree()<CR>
+noremap <silent><Tab> :call NvfmExpand()<CR>
+" Flat list of everything below (3 levels, or all levels)
+noremap <silent>tl :call NvfmFlat(3)<CR>
+noremap <silent>tL :call NvfmFlat(v:null)<CR>
+
+" Marking and bulk operations (on the marked items or the focused item)
+noremap <silent><space> :call NvfmMark()<CR>j
+noremap <silent>U :call NvfmUnmarkAll()<CR>
+noremap <silent>dD :call NvfmJobConfirm('delete', 'Delete')<CR>
+noremap <silent>dT :call NvfmJob('trash')<CR>
+noremap <silent>yy :call NvfmCopy()<CR>
+" Paste (copy) or move the items into the current directory
+noremap <silent>pp :call NvfmJob('paste')<CR>
+noremap <silent>pm :call NvfmJob('move')<CR>
+noremap <silent>cm :call NvfmChmodInput()<CR>
+noremap <silent><C-x> :call NvfmJobCancel()<CR>
+noremap <silent>dE :call NvfmJobErrors()<CR>
+
 noremap <silent>b :call NvfmHistory(-1)<CR>
 noremap <silent>B :call NvfmHistory(1)<CR>
+" Jump to a frequently visited directory
+noremap <silent>gj :call NvfmJumpInput()<CR>
 
 noremap <silent>sa :call NvfmSet('sort', 'alpha') \| call NvfmRefresh()<CR>
 noremap <silent>sA :call NvfmSet('sort', 'alpha_reverse') \| call NvfmRefresh()<CR>
@@ -93,6 +125,10 @@ noremap <silent>sT :call NvfmSet('sort', 'last_modified_reverse') \| call NvfmRe
 noremap <silent>ss :call NvfmSet('sort', 'size') \| call NvfmRefresh()<CR>
 noremap <silent>sS :call NvfmSet('sort', 'size_reverse') \| call NvfmRefresh()<CR>
 
+" Toggle hidden and (git)ignored files
+noremap <silent>zh :call NvfmToggle('show_hidden')<CR>
+noremap <silent>zi :call NvfmToggle('show_ignored')<CR>
+
 noremap <silent>Fa :call NvfmSet('time_format', 'ago') \| call NvfmRefresh()<CR>
 noremap <silent>Ft :call NvfmSet('time_format', '%Y-%m-%d %H:%m') \| call NvfmRefresh()<CR>
 noremap <silent>Fl :call NvfmSet('time_format', '%c') \| call NvfmRefresh()<CR>
@@ -103,24 +139,70 @@ noremap <silent><ESC> :call NvfmFilter(v:null)<CR>
 
 noremap <silent>ff :call NvfmFind()<CR>
 noremap <silent><C-f> :call NvfmFind()<CR>
-noremap <silent>fF :call NvfmFind('--hidden --no-ignore')<CR>
-noremap <silent>fd :call NvfmFind('--type directory')<CR>
-noremap <silent><C-g> :call NvfmFind('--type directory')<CR>
-noremap <silent>fD :call NvfmFind('--type directory --hidden --no-ignore')<CR>
+noremap <silent>fF :call NvfmFind({'hidden': v:true, 'ignore': v:false})<CR>
+noremap <silent>fd :call NvfmFind({'type': 'directory'})<CR>
+noremap <silent><C-g> :call NvfmFind({'type': 'directory'})<CR>
+noremap <silent>fD :call NvfmFind({'type': 'directory', 'hidden': v:true, 'ignore': v:false})<CR>
+" Search everything under here (instant in indexed roots)
+noremap <silent>g/ :call NvfmFind({'substring': v:true})<CR>
+noremap <silent>fg :call NvfmGrepInput()<CR>
+noremap <silent>fG :call NvfmGrepInput({'hidden': v:true, 'ignore': v:false})<CR>
+noremap <silent><C-c> :call NvfmCancel()<CR>
+" Compare the tree here with another directory
+noremap <silent>dc :call NvfmCompareInput()<CR>
 
 function NvfmFind(...)
-    if !executable('fzf')
-      throw 'No "fzf" executable found. You need to install fzf (https://github.com/junegunn/fzf/) to use this feature.'
+    call NvfmFindStart(get(a:, 1, {}))
+    let g:nvfm_filtering = 1
+    let l:input = input('find> ', '')
+    let g:nvfm_filtering = 0
+    if len(l:input)
+        " Enter the best match
+        call NvfmEnter()
+    else
+        call NvfmFilter(v:null)
     endif
-    if !executable('fd')
-      throw 'No "fd" executable found. You need to install fd (https://github.com/sharkdp/fd) to use this feature.'
+endfunction
+
+function NvfmGrepInput(...)
+    let l:query = input('grep> ', '')
+    if len(l:query)
+        call NvfmGrep(l:query, get(a:, 1, {}))
+    endif
+endfunction
+
+function NvfmJobConfirm(kind, verb)
+    if input(a:verb . ' selection? (y/N) ') ==# 'y'
+        call NvfmJob(a:kind)
+    endif
+    echo ''
+endfunction
+
+function NvfmChmodInput()
+    let l:mode = input('chmod> ', '')
+    if len(l:mode)
+        call NvfmJob('chmod', l:mode)
+    endif
+endfunction
+
+function NvfmCompareInput()
+    let l:other = input('compare with> ', '', 'dir')
+    if len(l:other)
+        call NvfmCompare(l:other)
+    endif
+endfunction
+
+function NvfmJumpInput()
+    let l:query = input('jump> ', '')
+    if len(l:query)
+        call NvfmJump(l:query)
     endif
-    let fd_args = get(a:, 1, '')
-    call fzf#run({'options': '--bind ctrl-l:accept --ansi --color fg:231,bg:-1,hl:197,hl+:197,pointer:197,info:246,bg+:236', 'window': 'enew', 'sink': function('NvfmEnter'), 'source': 'fd --follow --color always ' . fd_args})
 endfunction
 
 function NvfmFilterInput()
+    let g:nvfm_filtering = 1
     let l:input = input('find> ', '')
+    let g:nvfm_filtering = 0
     if len(l:input)
         echo "\rfind: " . l:input
     else
@@ -128,6 +210,14 @@ function NvfmFilterInput()
     endif
 endfunction
 
+function NvfmTermOpen(cmd)
+    tabnew
+    let l:buf = bufnr('%')
+    " Close the tab when the editor exits
+    call termopen(a:cmd, {'on_exit': {... -> execute('bwipeout! ' . buf)}})
+    startinsert
+endfunction
+
 function Startup()
     vsplit
     vsplit
@@ -141,7 +231,8 @@ endfunction
 
 au VimEnter * call Startup()
 au VimResized * wincmd =
-au CmdlineChanged @ call NvfmFilter(getcmdline())
+" Filter while typing, but only at filter prompts
+au CmdlineChanged @ if get(g:, 'nvfm_filtering') | call NvfmFilter(getcmdline()) | endif
 
 let g:statusline1 = 'a'
 let g:statusline2 = 'b'
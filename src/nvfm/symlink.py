@@ -0,0 +1,86 @@
+from collections import OrderedDict, namedtuple
+import errno
+import threading
+
+from . import fs
+
+# Number of cached links
+CACHE_SIZE = 10000
+
+
+class Link(namedtuple('Link', 'target stat error')):
+    """A resolved symlink.
+
+    `target` is the content of the link (or `None` if it couldn't be read),
+    `stat` the stat result of the final target. If the target can't be
+    stat'ed, `stat` is `None` and `error` is the `OSError`.
+    """
+    __slots__ = ()
+
+    @property
+    def orphan(self):
+        """Whether the link dangles (or is part of a loop)."""
+        return self.stat is None and self.error is not None and \
+            self.error.errno in (errno.ENOENT, errno.ENOTDIR, errno.ELOOP)
+
+    @property
+    def loop(self):
+        return self.error is not None and self.error.errno == errno.ELOOP
+
+
+def _resolve(path_str):
+    try:
+        target = fs.readlink(path_str)
+    except OSError as e:
+        return Link(None, None, e)
+    try:
+        # The kernel follows chains and fails with ELOOP on loops
+        return Link(target, fs.stat(path_str), None)
+    except OSError as e:
+        return Link(target, None, e)
+
+
+class SymlinkResolver:
+    """Cache of resolved symlinks.
+
+    Links are cached by the device, inode and mtime of the link itself, so a
+    link is read only once however often it's drawn. Changed targets are
+    picked up after `invalidate()`.
+    """
+
+    def __init__(self, size=CACHE_SIZE):
+        self._size = size
+        self._links = OrderedDict()
+        # Links are also resolved on worker threads
+        self._lock = threading.Lock()
+
+    def resolve(self, path_str, lstat_res):
+        """Return the `Link` of symlink `path_str` with lstat `lstat_res`."""
+        key = (lstat_res.st_dev, lstat_res.st_ino, lstat_res.st_mtime)
+        with self._lock:
+            link = self._links.get(key)
+            if link is not None:
+                self._links.move_to_end(key)
+                return link
+        link = _resolve(path_str)
+        with self._lock:
+            self._links[key] = link
+            while len(self._links) > self._size:
+                self._links.popitem(last=False)
+        return link
+
+    def invalidate(self):
+        with self._lock:
+            self._links.clear()
+
+
+_resolver = SymlinkResolver()
+
+
+def resolve(path, lstat_res):
+    """Resolve symlink `path` using the shared cache."""
+    return _resolver.resolve(str(path), lstat_res)
+
+
+def invalidate():
+    _resolver.invalidate()
@@ -0,0 +1,85 @@
+import os
+import threading
+
+from .util import logger
+
+# Seconds between checks for new data
+TAIL_INTERVAL = .25
+
+
+class Tail:
+    """Follow a growing file, like `tail -F`.
+
+    The file is kept open and polled with `fstat()` for new data, which is
+    read and passed to `on_data(bytes)`. Initially, and whenever the file is
+    truncated or replaced (e.g. by log rotation), it's (re)opened and
+    `on_reset(bytes)` is called with its last `initial_size` bytes.
+    Callbacks are called from a background thread.
+    """
+
+    def __init__(self, path, on_data, on_reset, initial_size,
+                 interval=TAIL_INTERVAL):
+        self.path = str(path)
+        self._on_data = on_data
+        self._on_reset = on_reset
+        self._initial_size = initial_size
+        self._interval = interval
+        self._file = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set():
+                self._poll()
+                self._stopped.wait(self._interval)
+        except OSError as e:
+            logger.error(('tail:error', self.path, e))
+        finally:
+            if self._file is not None:
+                self._file.close()
+
+    def _poll(self):
+        if self._file is None:
+            self._open()
+            return
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            # The file is gone for now (e.g. during rotation)
+            return
+        fst = os.fstat(self._file.fileno())
+        if (st.st_dev, st.st_ino) != (fst.st_dev, fst.st_ino):
+            # The file was replaced
+            self._file.close()
+            self._open()
+            return
+        pos = self._file.tell()
+        if fst.st_size < pos:
+            # The file was truncated
+            self._file.close()
+            self._open()
+        elif fst.st_size > pos:
+            data = self._file.read(fst.st_size - pos)
+            if data and not self._stopped.is_set():
+                self._on_data(data)
+
+    def _open(self):
+        try:
+            self._file = open(self.path, 'rb')
+        except OSError:
+            self._file = None
+            return
+        size = os.fstat(self._file.fileno()).st_size
+        start = max(0, size - self._initial_size)
+        self._file.seek(start)
+        data = self._file.read(size - start)
+        if start:
+            # Skip the first line because it's most likely incomplete
+            data = data[data.find(b'\n') + 1:]
+        self._on_reset(data)
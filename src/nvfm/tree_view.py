@@ -0,0 +1,207 @@
+from pathlib import Path
+
+from .columns import providers
+from .directory_view import DirectoryView
+from .engine import format_entries
+from .plan import ListingPlan
+
+# Indentation per level of the tree
+INDENT = '  '
+
+
+class TreeView(DirectoryView):
+    """A directory listing in which subdirectories can be expanded inline.
+
+    The root and expanded directories are listed through their views in
+    `Views`, so each directory is scanned only once and shares its listing
+    with the regular views. The tree is registered as a derived view, so it's
+    reloaded along with them. `items` is the flattened tree of visible rows.
+
+    Only the rows around the focus are formatted. The rest of the buffer has
+    cheap lines with just the indented names, which are replaced when the
+    focus gets near them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Paths (as strings) of expanded directories
+        self.expanded = set()
+        # Depth of each row in `items`
+        self._depths = []
+        # The flattened rows, to notice when `items` was replaced by a listing
+        self._tree_items = None
+        # The items of the root directory
+        self._root_items = None
+        # (start, stop, window height) of the formatted rows
+        self._rendered = None
+
+    def init(self):
+        self._load_root()
+
+    def _update_projection(self):
+        if self._projection != self._projection_key(self._s):
+            self._load_root()
+
+    def _load_root(self):
+        """Take the items of the root from its view."""
+        root = self._s.views[self.path]
+        items = root.current_items()
+        # pylint:disable=protected-access
+        self._error = root._error
+        self._projection = root._projection
+        self._num_children = dict(root._num_children)
+        self.items = items if items is not None else []
+
+    def shows(self, path):
+        """Return whether the listing of directory `path` is in the tree."""
+        return path == self.path or str(path) in self.expanded
+
+    def redraw_columns(self):
+        self.render_visible()
+
+    @property
+    def _tree_ns(self):
+        return self._vim.request('nvim_create_namespace', 'nvfm_tree')
+
+    @property
+    def focused_item(self):
+        return DirectoryView.focused_item.fget(self)
+
+    @focused_item.setter
+    def focused_item(self, item):
+        if item is None:
+            return
+        # Names aren't unique in a tree
+        self.focus = [i.path for i in self.items].index(str(item)) + 1
+
+    @property
+    def cursor(self):
+        return DirectoryView.cursor.fget(self)
+
+    @cursor.setter
+    def cursor(self, pos):
+        DirectoryView.cursor.fset(self, pos)
+        if self._rendered is None:
+            return
+        start, stop, height = self._rendered
+        row = (self.focus or 1) - 1
+        if row - height < start and start > 0 or \
+                row + height >= stop and stop < len(self.items):
+            # Unformatted rows may come into view
+            self._rendered = None
+            self._s.deferred.schedule(('tree', id(self)), self.render_visible)
+
+    def toggle_expand(self):
+        """Expand or collapse the focused directory."""
+        if self.focused_item is None or self.focus is None:
+            return
+        entry = self.items[self.focus - 1]
+        if not entry.is_dir(follow_symlinks=False):
+            return
+        if entry.path in self.expanded:
+            self.expanded.remove(entry.path)
+        else:
+            self.expanded.add(entry.path)
+        self._build_rows()
+        self.redraw()
+
+    def _build_rows(self):
+        """Flatten the root and the expanded directories into `items`."""
+        # The focus is a row of the last tree, or of the root before the
+        # first one was built
+        rows = self._tree_items if self._tree_items is not None \
+            else self.items
+        focused_item = None
+        if self.focus is not None and rows:
+            focused_item = rows[min(self.focus, len(rows)) - 1].path
+        if self.items is not self._tree_items:
+            # The root was (re)loaded
+            self._root_items = self.items
+        items, depths = [], []
+        stack = [(entry, 0) for entry in reversed(self._root_items)]
+        while stack:
+            entry, depth = stack.pop()
+            items.append(entry)
+            depths.append(depth)
+            if entry.path not in self.expanded:
+                continue
+            view = self._s.views[Path(entry.path)]
+            children = getattr(view, 'current_items', lambda: None)()
+            if not children:
+                continue
+            # pylint:disable=protected-access
+            self._num_children.update(view._num_children)
+            stack.extend((child, depth + 1) for child in reversed(children))
+        self.items = self._tree_items = items
+        self._depths = depths
+        if focused_item is not None:
+            try:
+                self.focused_item = focused_item
+            except ValueError:
+                # A collapsed directory contained the focus
+                self.focus = min(self.focus, len(items)) or None
+
+    def _draw(self):
+        if self._error is None and self.items is not self._tree_items:
+            self._build_rows()
+        super()._draw()
+
+    def _render_items(self):
+        """Fill the buffer with plain rows, then format the visible ones."""
+        lines = []
+        for entry, depth in zip(self.items, self._depths):
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            lines.append(INDENT * depth + entry.name + ('/' if is_dir else ''))
+        self.buf.request('nvim_buf_clear_namespace', self._tree_ns, 0, -1)
+        self.buf[:] = lines
+        self.render_visible()
+
+    def render_visible(self):
+        """Format the rows around the focus, the only ones that can be
+        visible."""
+        if not self.items or self.panel is None:
+            return
+        height = self.panel.win.height
+        row = (self.focus or 1) - 1
+        start = max(0, row - 2 * height)
+        stop = min(len(self.items), row + 2 * height + 1)
+        entries = self.items[start:stop]
+        prefixes = {e.path: INDENT * d
+                    for e, d in zip(entries, self._depths[start:stop])}
+        repo_status = None
+        columns = self._s.options['columns'].value
+        if 'git' in columns:
+            repo_status = self._s.git.get(self.path)
+        names = [c for c in columns if c in providers]
+        formatted = format_entries(
+            entries,
+            self._s.colors,
+            self._s.options['columns'].template,
+            self._s.options['time_format'].value,
+            num_children=self._num_children,
+            repo_status=repo_status,
+            get_fields=self._column_fields(names) if names else None,
+            prefixes=prefixes,
+            plan=ListingPlan.from_options(self._s.options),
+        )
+        # Moving the focus is handled by `_rendered`
+        self._columns_range = None
+        lines = []
+        ns = self._tree_ns
+        self.buf.request('nvim_buf_clear_namespace', ns, start, stop)
+        hls = []
+        for linenum, (_, line, line_hls, _) in enumerate(formatted, start):
+            lines.append(line)
+            for hl in line_hls or ():
+                hls.append((linenum, *hl))
+        self.buf.request('nvim_buf_set_lines', start, stop, True, lines)
+        for linenum, hl_group, hl_start, hl_stop in hls:
+            self.buf.add_highlight(hl_group, linenum, hl_start, hl_stop,
+                                   src_id=ns)
+        self.draw_marks()
+        if names:
+            self._s.columns.submit()
+        self._rendered = (start, stop, height)
@@ -12,11 +12,23 @@ def hexdump(bytes, columns=16):
     data = text.stdout
     return data
 
+def is_binary(data):
+    """Guess whether `data` (the head of a file) is binary.
+
+    Data that isn't valid utf-8 counts as binary. A multi-byte character
+    truncated at the end of `data` is tolerated.
+    """
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        return e.reason != 'unexpected end of data' or e.start < len(data) - 3
+    return False
+
 def stat_path(path, lstat=True):
+    from .fs import stat
     error, stat_res = None, None
-    f = path.lstat if lstat else path.stat
     try:
-        stat_res = f()
+        stat_res = stat(path, follow_symlinks=not lstat)
     except OSError as e:
         error = e
     return (stat_res, error)
@@ -1,11 +1,14 @@
 # -*- coding: future_fstrings -*-
+import codecs
 import os
 from pathlib import Path
 from stat import S_ISBLK, S_ISCHR, S_ISDIR, S_ISFIFO, S_ISREG, S_ISSOCK
 
+from . import fs
 from .base_view import View
 from .directory_view import DirectoryView
-from .util import hexdump, stat_path
+from .tail import Tail
+from .util import hexdump, is_binary, stat_path
 
 # Files above this size will be truncated before preview
 PREVIEW_SIZE_LIMIT = 10**5
@@ -13,6 +16,9 @@ PREVIEW_SIZE_LIMIT = 10**5
 # Max number of bytes in a hexdump preview
 HEXDUMP_LIMIT = 16 * 256
 
+# Max number of lines kept in the buffer of a followed file
+FOLLOW_LINE_LIMIT = 10000
+
 
 class Views:
 
@@ -20,49 +26,123 @@ class Views:
         self._s = session
         self._vim = vim
         self._views = {}
+        # Message views by (message, hl_group), shared by all items
+        self._messages = {}
+        # Views that show the listings of other views (e.g. a tree)
+        self._derived = []
 
     def __getitem__(self, key):
         try:
             return self._views[key]
         except KeyError:
             pass
-        view = make_view(self._s, self._vim, key)
+        view = self._make(key, *probe(key))
         view.protocol_init()
         self._views[key] = view
         return view
 
+    def _make(self, key, cls, kwargs):
+        kwargs = dict(kwargs)
+        if kwargs.pop('shared', False):
+            return self.message(**kwargs)
+        return cls(self._s, self._vim, key, **kwargs)
+
+    def message(self, message, hl_group=None):
+        """Return the message view showing `message`.
+
+        Views of identical messages are shared, so showing a message doesn't
+        allocate a buffer after the first time. Only use it for messages that
+        don't depend on an item, the number of shared views isn't bounded.
+        """
+        view = self._messages.get((message, hl_group))
+        if view is None:
+            view = MessageView(self._s, self._vim, None, message=message,
+                               hl_group=hl_group)
+            view.protocol_init()
+            self._messages[(message, hl_group)] = view
+        return view
+
+    def add_loaded(self, key, loaded):
+        """Return the view of `key`, using the result of `load_view()`."""
+        cls, kwargs, preloaded = loaded
+        view = self._views.get(key)
+        if view is None:
+            view = self._make(key, cls, kwargs)
+            self._views[key] = view
+        if type(view) is cls: # pylint:disable=unidiomatic-typecheck
+            view.preloaded = preloaded
+        view.protocol_init()
+        return view
+
     def __setitem__(self, key, val):
         self._views[key] = val
 
     def __delitem__(self, key):
-        self._views[key].remove()
-        del self._views[key]
+        view = self._views.pop(key)
+        if view not in self._messages.values():
+            view.remove()
 
     def __getattr__(self, key):
         return getattr(self._views, key)
 
-    def mark_all_dirty(self):
-        for view in self._views.values():
-            view.dirty = 2
+    def add_derived(self, view):
+        """Register `view`, which shows the listings of directories without
+        being the view of a path, so it's invalidated along with them.
+
+        Derived views implement `shows(path)`.
+        """
+        self._derived.append(view)
+
+    def remove_derived(self, view):
+        if view in self._derived:
+            self._derived.remove(view)
+            view.remove()
+
+    def all_views(self):
+        """Return the views of paths and the derived views."""
+        return list(self._views.values()) + self._derived
 
+    def showing(self, path):
+        """Return the views that show the listing of directory `path`: its
+        own view and the derived views that contain it."""
+        views = [v for v in self._derived if v.shows(path)]
+        view = self._views.get(path)
+        if view is not None:
+            views.insert(0, view)
+        return views
 
-def make_view(session, vim, item):
-    """Create and return a View() instance that displays `item`."""
-    args = (session, vim, item)
+    def mark_all_dirty(self, dirty=2):
+        for view in self.all_views():
+            view.dirty = max(view.dirty, dirty)
+
+
+def probe(item):
+    """Return the view class and its keyword arguments for `item`."""
     if item is None:
-        # TODO Use the same view always
-        return MessageView(*args, message='(nothing to show)')
+        return MessageView, {'message': '(nothing to show)', 'shared': True}
     stat_res, stat_error = stat_path(item, lstat=False)
     if stat_error is not None:
-        return MessageView(
-            *args, message=str(stat_error), hl_group='NvfmError')
+        # Errors contain the path, so their views are released with the item
+        return MessageView, {'message': str(stat_error),
+                             'hl_group': 'NvfmError'}
     mode = stat_res.st_mode
     if S_ISDIR(mode):
-        return DirectoryView(*args)
+        return DirectoryView, {}
     # TODO Check the stat() of the link
     if S_ISREG(mode):
-        return FileView(*args)
-    return MessageView(*args, message='(%s)' % filetype_str(mode))
+        return FileView, {}
+    return MessageView, {'message': '(%s)' % filetype_str(mode),
+                         'shared': True}
+
+
+def load_view(session, item):
+    """Do the blocking work of displaying `item` (for a worker thread).
+
+    Returns the view class, its keyword arguments and the result of its
+    `load()`, to be passed to `Views.add_loaded()`.
+    """
+    cls, kwargs = probe(item)
+    return cls, kwargs, cls.load(session, item)
 
 
 def filetype_str(mode):
@@ -101,20 +181,120 @@ class MessageView(View):
 
 class FileView(View):
 
-    def draw(self):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tail = None
+        # Incomplete last line of a followed file (`None` if it's complete)
+        self._partial = None
+        self._num_lines = 0
+        self._decoder = None
+        # Result of `load()` for the next draw
+        self._content = None
+
+    @classmethod
+    def load(cls, session, path):
+        """Read the start of the file.
+
+        Returns `(data, need_hexdump, size)` or the `OSError` that occurred.
+        """
         try:
-            self._draw()
+            size = fs.stat(path).st_size
+            data, need_hexdump = fs.call(path, cls._read_file, path)
         except OSError as e:
-            self.draw_message(str(e), 'Error')
+            return e
+        return data, need_hexdump, size
 
-    def _draw(self):
+    def init(self):
+        self._content = self._get_loaded()
+
+    def draw(self):
+        if self.following:
+            # Start over from the current end of the file
+            self.unfollow()
+            self.follow()
+            return
+        content, self._content = self._content, None
+        if content is None:
+            content = self.load(self._s, self.path)
+        if isinstance(content, OSError):
+            self.draw_message(str(content), 'Error')
+        else:
+            self._draw(*content)
+
+    def unload(self):
+        self.unfollow()
+
+    @property
+    def following(self):
+        return self._tail is not None
+
+    def follow(self):
+        """Show the end of the file and append new data as it's written."""
+        if self._tail is not None:
+            return
+        try:
+            if self._read_file(self.path)[1]:
+                # Don't follow binary files
+                return
+        except OSError:
+            return
+        vim = self._vim
+        tail = self._tail = Tail(
+            self.path,
+            lambda data: vim.async_call(self._tail_data, tail, data),
+            lambda data: vim.async_call(self._tail_reset, tail, data),
+            initial_size=PREVIEW_SIZE_LIMIT,
+        )
+        tail.start()
+
+    def unfollow(self):
+        if self._tail is None:
+            return
+        self._tail.stop()
+        self._tail = None
+        # Show the file from the start again when it's drawn next time
+        self.dirty = max(self.dirty, 1)
+
+    def _tail_reset(self, tail, data):
+        if tail is not self._tail:
+            return
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self.buf.request('nvim_buf_clear_namespace', -1, 0, -1)
+        self.buf[:] = ['']
+        self._partial = ''
+        self._num_lines = 1
+        self._append(self._decoder.decode(data))
+
+    def _tail_data(self, tail, data):
+        if tail is not self._tail:
+            return
+        self._append(self._decoder.decode(data))
+
+    def _append(self, text):
+        """Append `text` to the buffer, only touching the lines at its end."""
+        if not text:
+            return
+        parts = ((self._partial or '') + text).split('\n')
+        partial = parts.pop() or None
+        if partial is not None:
+            parts.append(partial)
+        end = self._num_lines
+        start = end - 1 if self._partial is not None else end
+        self.buf.request('nvim_buf_set_lines', start, end, True, parts)
+        self._num_lines = start + len(parts)
+        self._partial = partial
+        if self._num_lines > 2 * FOLLOW_LINE_LIMIT:
+            # Drop old lines
+            drop = self._num_lines - FOLLOW_LINE_LIMIT
+            self.buf.request('nvim_buf_set_lines', 0, drop, True, [])
+            self._num_lines -= drop
+        panel = self.panel
+        if panel is not None and self._num_lines:
+            panel.win.cursor = [self._num_lines, 0]
+
+    def _draw(self, data, need_hexdump, size):
         # TODO Better heuristics to detect binary files
         buf = self.buf
-        path = self.path
-        st = path.stat()
-        size = st.st_size
-
-        data, need_hexdump = self._read_file(path)
         if not data:
             self.draw_message('(file empty)', 'NvfmMessage')
             return
@@ -123,7 +303,7 @@ class FileView(View):
             columns = 16
             data = hexdump(data[:HEXDUMP_LIMIT], columns=columns)
             buf.request('nvim_buf_set_option', 'filetype', 'xxd')
-        lines = data.decode('utf-8').splitlines()
+        lines = data.decode('utf-8', 'replace').splitlines()
         if size > PREVIEW_SIZE_LIMIT:
             # TODO Better indicator for truncated file view
             lines += ['...']
@@ -131,10 +311,8 @@ class FileView(View):
         self._detect_filetype()
 
     def _detect_filetype(self):
-        for panel in self._s.panels:
-            if panel.view is self:
-                break
-        else:
+        panel = self.panel
+        if panel is None:
             return
         win_save = self._vim.current.window
         self._vim.current.window = panel.win
@@ -145,12 +323,5 @@ class FileView(View):
     def _read_file(path):
         with open(str(path), 'rb') as f:
             data = f.read(PREVIEW_SIZE_LIMIT)
-            try:
-                data.decode('utf-8')
-            except UnicodeDecodeError:
-                # This is not valid utf-8, so do a hexdump
-                need_hexdump = True
-            else:
-                need_hexdump = False
-                # No hexdump, so read up to preview size limit
-        return data, need_hexdump
+        # If this is not valid utf-8, do a hexdump
+        return data, is_binary(data)
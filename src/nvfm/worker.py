@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from .util import logger
+
+# Number of threads for background work
+MAX_WORKERS = 4
+
+
+class Worker:
+    """Run blocking functions on a thread pool.
+
+    The results are handed back to the nvim event loop, where it's safe to
+    make API requests again.
+    """
+
+    def __init__(self, vim, max_workers=MAX_WORKERS):
+        self._vim = vim
+        self._executor = ThreadPoolExecutor(max_workers)
+
+    def submit(self, func, *args, callback=None, errback=None):
+        """Run `func(*args)` in the background and return a future.
+
+        If `callback` is given, it's called with the result of `func` from
+        the nvim event loop. Exceptions are logged and swallowed, after
+        passing them to `errback` if it's given.
+        """
+        future = self._executor.submit(func, *args)
+        if callback is not None or errback is not None:
+            future.add_done_callback(
+                lambda f: self._vim.async_call(self._done, f, callback,
+                                               errback))
+        return future
+
+    def call_later(self, delay, func, *args):
+        """Call `func(*args)` from the nvim event loop after `delay` seconds.
+
+        Returns a timer that can be cancelled.
+        """
+        timer = threading.Timer(delay, self._vim.async_call, (func,) + args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    @staticmethod
+    def _done(future, callback, errback=None):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            logger.error(('worker:error', error))
+            if errback is not None:
+                errback(error)
+            return
+        if callback is not None:
+            callback(future.result())
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class Deferred:
+    """Schedule non-critical updates on the nvim event loop.
+
+    Work is run via `async_call`, i.e. after the current (synchronous)
+    request has returned, so it doesn't add to the latency of keypresses.
+    Work is coalesced by key: if work is scheduled again before it ran, only
+    the latest arguments are used and the superseded call is dropped.
+    """
+
+    def __init__(self, vim):
+        self._vim = vim
+        self._pending = {}
+
+    def schedule(self, key, func, *args):
+        scheduled = key in self._pending
+        self._pending[key] = (func, args)
+        if not scheduled:
+            self._vim.async_call(self._run, key)
+
+    def cancel(self, key):
+        self._pending.pop(key, None)
+
+    def _run(self, key):
+        try:
+            func, args = self._pending.pop(key)
+        except KeyError:
+            # Cancelled
+            return
+        try:
+            func(*args)
+        except Exception as e: # pylint:disable=broad-except
+            logger.error(('deferred:error', key, e))
@@ -1,14 +1,48 @@
 import os
 from pathlib import Path
+import queue
 import re
+import threading
+from types import SimpleNamespace
 
 import pynvim
 import pytest
 
-from nvfm.directory_view import format_line
+from nvfm import directory_view, flat_view, opener
+from nvfm.base_view import BufferPool
+from nvfm.cache import (STAT_FIELDS, CachedEntry, DirCache, comparable_row,
+                        make_row, scan_rows)
+from nvfm.cli import colorize, main as cli_main
+from nvfm.color import ColorManager
+from nvfm.compare import Comparison
+from nvfm.columns import ColumnCache, image_size, mime_type, providers
+from nvfm.copy import copy_file
+from nvfm.daemon import CacheServer, DaemonClient, socket_path
+from nvfm.directory_view import format_entries, format_line
+from nvfm.entries import EntryTable
+from nvfm.find import Matcher, walk
+from nvfm.flat_view import FlatEntry, FlatView
+from nvfm.fs import (Mount, Mounts, MountUnavailable, SafeFS, is_remote,
+                     parse_mountinfo)
+from nvfm.git import GitStatus, parse_status
+from nvfm.grep import Grep, compile_query, grep_file
+from nvfm.ignore import IgnoreCache, IgnoreRules
+from nvfm.index import FileIndex, Indexes
+from nvfm.jobs import (ChmodJob, CopyJob, DeleteJob, MoveJob, TrashJob,
+                       parse_mode)
+from nvfm.history import Frecency
+from nvfm.opener import EDIT, Opener, command_args, editor_args
+from nvfm.option import Options
+from nvfm.panel import PREVIEW_LOADS, RightPanel
+from nvfm.plan import ListingPlan
 from nvfm.plugin import History, Plugin
-from nvfm.util import stat_path
-from nvfm.view import DirectoryView
+from nvfm.symlink import SymlinkResolver
+from nvfm.tail import Tail
+from nvfm.tree_view import TreeView
+from nvfm.util import is_binary, stat_path
+from nvfm.view import (DirectoryView, FileView, MessageView, Views,
+                       load_view)
+from nvfm.worker import Deferred
 
 from .test_helpers import make_tree
 
@@ -119,6 +153,114 @@ def test_format_line_num_files(tree):
     assert line.startswith('6 ')
 
 
+def test_git_status():
+    output = (b' M src/a.py\0A  src/sub/b.py\0R  new\0old\0'
+              b'?? tmp/\0!! build/\0')
+    status = parse_status('/repo', output)
+    assert status.get('/repo/src/a.py') == 'modified'
+    assert status.get('/repo/src/sub/b.py') == 'staged'
+    assert status.get('/repo/src/sub') == 'staged'
+    assert status.get('/repo/src') == 'modified'
+    assert status.get('/repo/new') == 'staged'
+    assert status.get('/repo/old') is None
+    assert status.get('/repo/tmp/x/y') == 'untracked'
+    assert status.get('/repo/build/out.o') == 'ignored'
+    assert status.get('/repo/README') is None
+
+
+def test_git_status_failure(tmp_path):
+    (tmp_path / '.git').mkdir()
+    submitted = []
+
+    class Worker:
+        def submit(self, func, *args, callback, errback):
+            submitted.append(errback)
+
+    git = GitStatus(Worker(), None)
+    assert git.get(tmp_path) is None
+    submitted[0](OSError('git not found'))
+    # Failed statuses aren't retried until the repository changes
+    assert git.get(tmp_path) is None
+    assert len(submitted) == 1
+    (tmp_path / '.git/index').write_text('')
+    assert git.get(tmp_path) is None
+    assert len(submitted) == 2
+
+
+def test_format_line_git_column(tree):
+    path = tree / 'bb'
+    stat_res, stat_error = stat_path(path)
+    line, hls = format_line(str(path), stat_res, None, '{size:>4} {git:1}',
+                            lambda x: '', fields={'git': '*'},
+                            field_hls={'git': 'NvfmGitModified'})
+    assert line.startswith(' 19B * bb')
+    assert ('NvfmGitModified', 5, 6) in hls
+
+
+def test_cli_listing(tree, capsys):
+    assert cli_main(['--sort', 'size', '--columns', 'size', '--color',
+                     'never', str(tree)]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 5
+    assert '      3 ee/' in lines
+    assert cli_main(['--columns', 'bogus', str(tree)]) == 2
+
+
+def test_colorize():
+    line = 'meta name'
+    hls = [('color01_34', 5, 9), ('FileMeta', 0, 4)]
+    assert colorize(line, hls, ColorManager()) == \
+        '\x1b[38;5;243mmeta\x1b[0m \x1b[01;34mname\x1b[0m'
+
+
+def test_dir_cache(tree, tmpdir):
+    cache = DirCache(str(tmpdir.join('cache.sqlite')))
+    dir_stat, rows = scan_rows(tree)
+    assert cache.get(tree, dir_stat) is None
+    cache.put(tree, dir_stat, rows)
+    entries = {e.name: e for e in cache.get(tree, dir_stat)}
+    assert sorted(entries) == ['aa1', 'bb', 'cc', 'dd', 'ee']
+    assert entries['aa1'].is_dir()
+    assert entries['aa1'].num_children == 1
+    assert entries['bb'].stat().st_size == len('bb_line_1\nbb_line_2')
+    (tree / 'new').mkdir()
+    # The directory's mtime changed, so the listing is stale
+    assert cache.get(tree) is None
+
+
+def test_dir_cache_threads(tmp_path):
+    (tmp_path / 'file').write_text('')
+    dir_stat, rows = scan_rows(tmp_path)
+    read = list(rows[0])
+    read[1 + STAT_FIELDS.index('st_atime')] += 1
+    # Reading a file doesn't change the listing
+    assert comparable_row(tuple(read)) == comparable_row(rows[0])
+    cache = DirCache(str(tmp_path / 'cache.sqlite'))
+    errors = []
+
+    def use():
+        try:
+            for _ in range(50):
+                cache.put(tmp_path, dir_stat, rows)
+                cache.get_rows(tmp_path, dir_stat)
+        except Exception as e: # pylint:disable=broad-except
+            errors.append(e)
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_dir_cache_prune(tree, tmpdir):
+    cache = DirCache(str(tmpdir.join('cache.sqlite')), size_limit=6)
+    for path in (tree, tree / 'ee/gg'):
+        cache.put(path, *scan_rows(path))
+    assert cache.get(tree) is None
+    assert len(cache.get(tree / 'ee/gg')) == 6
+
+
 def test_history():
     history = History()
     history.add('foo')
@@ -146,6 +288,32 @@ def test_history():
     history.add('ham')
     assert history.go(0) == 'ham'
     assert history.all == ['foo', 'baz', 'ham']
+    history = History(limit=2)
+    for item in ('foo', 'bar', 'baz'):
+        history.add(item)
+    assert history.all == ['bar', 'baz']
+    assert history.go(-1) == 'bar'
+
+
+def test_frecency(tmpdir):
+    path = str(tmpdir / 'frecency.json')
+    frecency = Frecency(path, flush_delay=60)
+    now = 1000000
+    for _ in range(3):
+        frecency.add('/home/user/src/nvfm', now=now - 2 * 86400)
+    frecency.add('/home/user/Music', now=now)
+    frecency.add('/srv/nvfm-data', now=now - 2 * 3600)
+    assert frecency.query('', now=now) == [
+        '/home/user/Music', '/srv/nvfm-data', '/home/user/src/nvfm']
+    assert frecency.query('nvfm', now=now) == [
+        '/srv/nvfm-data', '/home/user/src/nvfm']
+    # The last keyword has to match the last component
+    assert frecency.query('src nv', now=now) == ['/home/user/src/nvfm']
+    assert frecency.query('nvfm src', now=now) == []
+    frecency.flush()
+    loaded = Frecency(path)
+    loaded.load()
+    assert loaded.query('mus', now=now) == ['/home/user/Music']
 
 
 def test_navigate_history(tree, vim_ctx):
@@ -286,45 +454,980 @@ def test_time_format_option(tree, vim_ctx):
         assert re.match(r'.*\snow\s.*', mid.buffer[0])
 
 
-def test_fzf(tree, vim_ctx):
+def test_find(tree, vim_ctx):
     import time
     os.environ['NVFM_START_PATH'] = str(tree)
     with vim_ctx() as vim:
         left, mid, right = vim.windows
-        assert vim.call('exists', ':FZF')
-        vim.feedkeys('ff') # start FZF fuzzy search
-        assert 'ee/gg/aa' in '\n'.join(mid.buffer[:])
-        vim.feedkeys('bbxq') # enter search term
-        # block until search term is processed
+        vim.call('NvfmFindStart', {})
+        # block until the walker has delivered its results
         t = time.time()
         while time.time() < t + 1:
-            if 'bbxq' in mid.buffer[-1]:
+            if 'ee/gg/bbXXbb/qqq/' in mid.buffer[:]:
                 break
             time.sleep(.01)
         else:
-            raise AssertionError('timeout: feedkeys')
-        vim.call('nvim_input', 'bbxq<CR>') # confirm search term
-        # block until terminal window is closed
-        t = time.time()
-        while time.time() < t + 1:
-            try:
-                if not mid.buffer[-1].startswith('>'):
-                    break
-            except pynvim.NvimError:
-                pass
-            time.sleep(.01)
-        else:
-            raise AssertionError('timeout: leaving terminal')
-        # allow cwd change to take some time
-        while time.time() < t + 1:
-            try:
-                assert vim.call('getcwd').endswith('ee/gg/bbXXbb/qqq')
-            except AssertionError:
-                pass
-            except pynvim.NvimError:
-                pass
-            else:
-                break
+            raise AssertionError('timeout: find results')
+        assert 'ee/gg/aa/' in mid.buffer[:]
+        vim.call('NvfmFilter', 'bbxq')
+        assert mid.buffer[:] == ['ee/gg/bbXXbb/qqq/']
+        vim.call('NvfmEnter')
+        assert vim.call('getcwd').endswith('ee/gg/bbXXbb/qqq')
+
+
+def test_walk(tree):
+    (tree / '.hidden').mkdir()
+    (tree / '.gitignore').write_text('ff/\n/dd\n*.log\n!keep.log\n')
+    (tree / 'ee/x.log').write_text('')
+    (tree / 'ee/keep.log').write_text('')
+    results = dict(walk(tree))
+    assert results['ee/gg/bbXXbb/qqq'] is True
+    assert results['bb'] is False
+    assert 'ee/keep.log' in results
+    for ignored in ('.hidden', 'dd', 'ee/ff', 'ee/ff/ii', 'ee/x.log'):
+        assert ignored not in results
+    results = dict(walk(tree, hidden=True, ignore=False, type='d'))
+    assert '.hidden' in results
+    assert 'ee/ff/ii' in results
+    assert 'bb' not in results
+    results = dict(walk(tree, max_depth=1))
+    assert sorted(results) == ['aa1', 'bb', 'cc', 'ee']
+
+
+def test_ignore_rules():
+    rules = IgnoreRules('/base', ['# comment', 'build/', '/top', 'a/**/z',
+                                  '*.py[co]', 'doc/*.txt'])
+    assert rules.match('x/build', True)
+    assert rules.match('x/build', False) is None
+    assert rules.match('top', False)
+    assert rules.match('x/top', False) is None
+    assert rules.match('a/z', False)
+    assert rules.match('a/b/c/z', False)
+    assert rules.match('m/n.pyc', False)
+    assert rules.match('doc/x.txt', False)
+    assert rules.match('doc/sub/x.txt', False) is None
+
+
+def test_file_index(tree, tmpdir):
+    index_path = str(tmpdir.join('index.pickle'))
+    index = FileIndex(tree, index_path)
+    assert index.update()
+    assert not index.update()
+    assert index.search('bbxx') == ['ee/gg/bbXXbb/', 'ee/gg/bbXXbb/qqq/']
+    assert index.search('qq', prefix='ee/gg') == ['bbXXbb/qqq/']
+    assert index.search('egbq', fuzzy=True) == ['ee/gg/bbXXbb/qqq/']
+    assert index.search('aa', dirs_only=True, limit=2) == ['aa1/', 'aa1/aa2/']
+    index.save()
+    (tree / 'ee/gg/bbXXbb/qqq').rmdir()
+    (tree / 'ee/gg/bbXXbb/new').write_text('')
+    index = FileIndex(tree, index_path)
+    assert index.load()
+    assert index.update()
+    assert index.search('bbxx') == ['ee/gg/bbXXbb/', 'ee/gg/bbXXbb/new']
+
+
+def test_file_index_lowercase_offsets(tmp_path):
+    names = ['a1', 'b2', 'c3', 'd4']
+    index = FileIndex(tmp_path, str(tmp_path / 'index.pickle'))
+    for name in ['\u0130' * 8] + names:
+        index._add(name)
+    # "İ" is two characters in lowercase, which mustn't shift other paths
+    for name in names:
+        assert index.search(name, fuzzy=True) == [name]
+
+
+def test_indexes_failure():
+    submitted = []
+
+    class Worker:
+        def submit(self, func, *args, callback, errback):
+            submitted.append(errback)
+
+    options = Options()
+    options['index_roots'] = ['/nonexistent']
+    indexes = Indexes(Worker(), options)
+    assert indexes.get('/nonexistent') is None
+    submitted[0](OSError())
+    # Failed updates can be retried
+    indexes.update('/nonexistent')
+    assert len(submitted) == 2
+
+
+def test_is_binary():
+    assert not is_binary(b'foo\nbar')
+    assert not is_binary('\u00e4'.encode('utf-8')[:1])
+    assert is_binary(b'\xff\xfe\x00foo')
+
+
+def test_grep_file(tree):
+    path = tree / 'ee/gg/gx'
+    path.write_text('foo\nxBarx\n\nbar bar\nbaz')
+    assert grep_file(str(path), compile_query('bar')) == \
+        [(2, 'xBarx'), (4, 'bar bar')]
+    assert grep_file(str(path), compile_query('Bar')) == [(2, 'xBarx')]
+    (tree / 'binary').write_bytes(b'bar\xff\xfe\x00')
+    assert grep_file(str(tree / 'binary'), compile_query('bar')) == []
+
+
+def test_grep(tree):
+    from concurrent.futures import ThreadPoolExecutor
+    import threading
+    (tree / 'ee/gg/cc').write_text('no\nneedle\n')
+    (tree / 'aa1/aa2/aa3').write_text('needle')
+    # Reading a FIFO would block
+    os.mkfifo(str(tree / 'ee/fifo'))
+    results = []
+    done = threading.Event()
+    with ThreadPoolExecutor(1) as executor:
+        Grep(tree, 'needle', executor=executor).start(results.extend,
+                                                      done.set)
+        assert done.wait(10)
+    assert grep_file(str(tree / 'ee/fifo'), compile_query('needle')) == []
+    os.remove(str(tree / 'ee/fifo'))
+    assert sorted(results) == [
+        (str(tree / 'aa1/aa2/aa3'), 1, 'needle'),
+        (str(tree / 'ee/gg/cc'), 2, 'needle'),
+    ]
+
+
+def test_matcher():
+    candidates = ['foo/bar', 'fxo', 'baz', 'Foo/baR']
+    matcher = Matcher()
+    assert matcher.update('fo', candidates) == [0, 3, 1]
+    assert matcher.update('foo', candidates) == [0, 3]
+    assert matcher.update('FoR', candidates) == [3]
+    candidates.append('Fo/qux/R')
+    assert matcher.extend(candidates, 4) == [4]
+
+
+def test_tail(tree):
+    import queue
+    path = tree / 'log'
+    path.write_bytes(b'line 1\nline 2\nline 3\n')
+    events = queue.Queue()
+    tail = Tail(path, lambda d: events.put(('data', d)),
+                lambda d: events.put(('reset', d)), initial_size=10,
+                interval=.01)
+    content = [None]
+
+    def wait_for(expected):
+        # The tail may see a write in several steps (e.g. a truncation, then
+        # the new data), so follow its events until they add up
+        while content[0] != expected:
+            kind, data = events.get(timeout=5)
+            content[0] = data if kind == 'reset' else content[0] + data
+
+    tail.start()
+    try:
+        # The partial first line is skipped
+        wait_for(b'line 3\n')
+        with path.open('ab') as f:
+            f.write(b'line 4')
+        wait_for(b'line 3\nline 4')
+        path.write_bytes(b'new\n')
+        wait_for(b'new\n')
+    finally:
+        tail.stop()
+
+
+def test_load_view(tree):
+    cls, kwargs, loaded = load_view(None, tree / 'bb')
+    assert cls is FileView and not kwargs
+    data, need_hexdump, size = loaded
+    assert data.startswith(b'bb_line_1\nbb_line_2')
+    assert not need_hexdump and size == len(data)
+    cls, kwargs, loaded = load_view(None, tree / 'missing')
+    assert cls is MessageView and kwargs['hl_group'] == 'NvfmError'
+    assert loaded is None
+    # Error messages contain the path, so they aren't shared
+    assert not kwargs.get('shared')
+    assert load_view(None, None)[1]['shared']
+
+
+def test_parse_mountinfo():
+    mounts = parse_mountinfo(
+        '22 1 0:21 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n'
+        '40 22 0:35 / /mnt/my\\040share rw - nfs4 srv:/export rw,vers=4.2\n'
+        '41 22 0:36 / /home/u/remote rw - fuse.sshfs u@host: rw\n'
+        'garbage\n')
+    assert mounts == [
+        Mount('/', 'ext4', '/dev/sda1'),
+        Mount('/mnt/my share', 'nfs4', 'srv:/export'),
+        Mount('/home/u/remote', 'fuse.sshfs', 'u@host:'),
+    ]
+    assert [is_remote(m) for m in mounts] == [False, True, True]
+
+
+def test_mounts_find(tmp_path):
+    mounts = Mounts(path=str(tmp_path / 'missing'))
+    root = Mount('/', 'ext4', 'sda')
+    mnt = Mount('/mnt/a', 'nfs', 'srv:/')
+    nested = Mount('/mnt/a/b', 'ext4', 'sdb')
+    mounts.set_mounts([root, mnt, nested])
+    assert mounts.find('/') == root
+    assert mounts.find('/mnt') == root
+    assert mounts.find('/mnt/ab') == root
+    assert mounts.find('/mnt/a') == mnt
+    assert mounts.find('/mnt/a/') == mnt
+    assert mounts.find('/mnt/a/x/y') == mnt
+    assert mounts.find('/mnt/a/x/../b/c') == nested
+    assert mounts.find('/mnt/a/b') == nested
+    assert mounts.find('/mnt/a/b/c') == nested
+    # Cached directories are forgotten when the table changes
+    mounts.set_mounts([root])
+    assert mounts.find('/mnt/a/x/y') == root
+    mounts.set_mounts([])
+    assert mounts.find('/usr') is None
+
+
+def test_safe_fs(tree):
+    import threading
+    mounts = Mounts(path=str(tree / 'missing'))
+    mounts.set_mounts([Mount('/', 'ext4', 'sda'),
+                       Mount(str(tree), 'nfs', 'srv:/')])
+    assert mounts.find('/usr') == Mount('/', 'ext4', 'sda')
+    assert mounts.find(tree / 'bb').point == str(tree)
+    safe_fs = SafeFS(mounts, timeout=.05)
+    assert safe_fs.call(tree / 'bb', lambda: 42) == 42
+    hang = threading.Event()
+    with pytest.raises(MountUnavailable):
+        safe_fs.call(tree / 'bb', hang.wait)
+    # The breaker is open, so calls fail without being made
+    with pytest.raises(MountUnavailable) as excinfo:
+        safe_fs.call(tree / 'aa1', lambda: 42)
+    assert str(excinfo.value) == '(unavailable)'
+    # Local paths aren't affected
+    assert safe_fs.call('/usr', lambda: 42) == 42
+    hang.set()
+
+
+def test_delete_job(tree):
+    job = DeleteJob([tree / 'aa1', tree / 'bb', tree / 'missing'])
+    job.run()
+    assert not (tree / 'aa1').exists() and not (tree / 'bb').exists()
+    assert job.done == 4
+    assert [p for p, _ in job.errors] == [str(tree / 'missing')]
+
+
+def test_move_job(tree):
+    (tree / 'dest').mkdir()
+    (tree / 'dest/bb').write_text('')
+    job = MoveJob([tree / 'aa1', tree / 'bb'], tree / 'dest')
+    job.run()
+    assert (tree / 'dest/aa1/aa2/aa3').exists()
+    assert (tree / 'bb').exists()
+    assert len(job.errors) == 1
+    assert job.affected_dirs == {str(tree), str(tree / 'dest')}
+
+
+def test_chmod_job(tree):
+    assert parse_mode('640', 0o100755) == 0o640
+    assert parse_mode('u+x,go-w', 0o100666) == 0o744
+    assert parse_mode('a=r', 0o100777) == 0o444
+    assert parse_mode('+X', 0o40600) == 0o711
+    with pytest.raises(ValueError):
+        ChmodJob([tree / 'bb'], 'u+q')
+    ChmodJob([tree / 'bb'], '600').run()
+    assert (tree / 'bb').stat().st_mode & 0o777 == 0o600
+
+
+def test_trash_job(tree, monkeypatch):
+    monkeypatch.setenv('XDG_DATA_HOME', str(tree / 'data'))
+    (tree / 'data').mkdir()
+    TrashJob([tree / 'bb']).run()
+    (tree / 'bb').write_text('again')
+    TrashJob([tree / 'bb']).run()
+    trash = tree / 'data/Trash'
+    assert sorted(p.name for p in (trash / 'files').iterdir()) == \
+        ['bb', 'bb.1']
+    info = (trash / 'info/bb.1.trashinfo').read_text()
+    assert 'Path=%s\n' % (tree / 'bb') in info
+    assert (trash / 'files/bb.1').read_text() == 'again'
+
+
+def test_copy_file(tree):
+    src = tree / 'sparse'
+    with src.open('wb') as f:
+        f.write(b'head')
+        f.seek(2**24)
+        f.write(b'tail')
+        f.truncate(2**25)
+    copied = []
+    assert copy_file(str(src), str(tree / 'copy'), copied.append) == 2**25
+    data = (tree / 'copy').read_bytes()
+    assert data == src.read_bytes()
+    st = (tree / 'copy').stat()
+    assert st.st_size == 2**25 and st.st_blocks * 512 < 2**24
+    with pytest.raises(FileExistsError):
+        copy_file(str(src), str(tree / 'copy'))
+
+
+def test_copy_job(tree):
+    (tree / 'dest').mkdir()
+    os.symlink('aa2', str(tree / 'aa1/link'))
+    os.utime(str(tree / 'aa1/aa2'), (0, 1000))
+    job = CopyJob([tree / 'aa1', tree / 'bb'], tree / 'dest')
+    job.run()
+    assert not job.errors
+    assert (tree / 'dest/bb').read_text() == (tree / 'bb').read_text()
+    assert (tree / 'dest/aa1/aa2/aa3').exists()
+    assert os.readlink(str(tree / 'dest/aa1/link')) == 'aa2'
+    assert (tree / 'dest/aa1/aa2').stat().st_mtime == 1000
+    assert job.bytes == (tree / 'bb').stat().st_size
+    job = CopyJob([tree / 'bb', tree], tree / 'dest')
+    job.run()
+    assert len(job.errors) == 2
+
+
+def test_cache_daemon(tree, tmpdir):
+    import queue
+    import threading
+    import time
+    sock_path = str(tmpdir / 'cache.sock')
+    server = CacheServer(sock_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    invalidated = queue.Queue()
+    client = DaemonClient(invalidated.put, sock_path, autostart=False)
+    for _ in range(50):
+        rows = client.get_rows(tree / 'aa1')
+        if rows is not None:
+            break
+        # Wait for the server to be up
+        client._failed_at = None
+        time.sleep(.05)
+    assert [(row[0], row[-1]) for row in rows] == [('aa2', 1)]
+    assert client.get_rows(tree / 'aa1') == rows
+    # A change in a subdirectory changes the child count
+    (tree / 'aa1/aa2/new').write_text('')
+    assert invalidated.get(timeout=5) == str(tree / 'aa1')
+    assert client.get_rows(tree / 'aa1')[0][-1] == 2
+    assert client.get_rows(tree / 'missing') is None
+    client.close()
+    server.close()
+
+
+def test_cache_daemon_cached_rows(tmp_path):
+    import threading
+    import time
+
+    def wait_for(func):
+        deadline = time.monotonic() + 5
+        while not func():
+            assert time.monotonic() < deadline
             time.sleep(.01)
-        else:
-            raise AssertionError('cwd not changed')
+
+    for name in ['a', 'b']:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'file').write_text('')
+    sock_path = str(tmp_path / 'cache.sock')
+    server = CacheServer(sock_path, snapshot_limit=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    invalidated = []
+    client = DaemonClient(invalidated.append, sock_path, autostart=False)
+    wait_for(lambda: os.path.exists(sock_path))
+    # The first call doesn't wait for the daemon
+    assert client.cached_rows(tmp_path / 'a') is None
+    wait_for(lambda: client.cached_rows(tmp_path / 'a') is not None)
+    assert [row[0] for row in client.cached_rows(tmp_path / 'a')] == ['file']
+    # Rows are dropped when the directory changes
+    (tmp_path / 'a/new').write_text('')
+    wait_for(lambda: invalidated == [str(tmp_path / 'a')])
+    wait_for(lambda: client.cached_rows(tmp_path / 'a') is not None)
+    assert len(client.cached_rows(tmp_path / 'a')) == 2
+    # ...and when the daemon stops watching it
+    assert client.get_rows(tmp_path / 'b') is not None
+    wait_for(lambda: str(tmp_path / 'a') not in client._rows)
+    assert invalidated == [str(tmp_path / 'a')]
+    client.close()
+    server.close()
+
+
+def test_daemon_socket_path(tmp_path, monkeypatch):
+    import tempfile
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    runtime_dir = tmp_path / ('nvfm-%d' % os.getuid())
+    assert socket_path() == str(runtime_dir / 'nvfm-cache.sock')
+    # Directories that others can write to are refused
+    runtime_dir.chmod(0o777)
+    assert socket_path() is None
+    runtime_dir.rmdir()
+    (tmp_path / 'elsewhere').mkdir(mode=0o700)
+    runtime_dir.symlink_to(tmp_path / 'elsewhere')
+    assert socket_path() is None
+    client = DaemonClient(None, socket_path())
+    assert client.get_rows(tmp_path) is None
+
+
+def test_preview_loads():
+    from concurrent.futures import Future
+    submitted = []
+
+    class Worker:
+        def submit(self, func, session, item, callback, errback):
+            future = Future()
+            # Running loads can't be cancelled
+            future.set_running_or_notify_cancel()
+            submitted.append((item, callback, errback))
+            return future
+
+        def call_later(self, *args):
+            return SimpleNamespace(cancel=lambda: None)
+
+    session = SimpleNamespace(
+        preview_worker=Worker(),
+        views=SimpleNamespace(get=lambda item: None,
+                              add_loaded=lambda item, loaded: loaded),
+        events=SimpleNamespace(manage=lambda *args, **kwargs: None))
+    panel = RightPanel(session, None)
+    shown = []
+    panel._show = lambda view, line: shown.append(view)
+    # Previews return right away, even if all threads are busy
+    for item in range(PREVIEW_LOADS + 2):
+        panel.preview(item)
+    assert [i for i, _, _ in submitted] == list(range(PREVIEW_LOADS))
+    submitted[0][2](OSError())
+    # Only the latest request gets the free thread
+    assert submitted[-1][0] == PREVIEW_LOADS + 1
+    submitted[1][1]('stale')
+    submitted[-1][1]('latest')
+    assert shown == ['latest']
+
+
+def test_deferred():
+    calls = []
+
+    class Vim:
+        def async_call(self, func, *args):
+            calls.append((func, args))
+
+    done = []
+    deferred = Deferred(Vim())
+    deferred.schedule('preview', done.append, 'a')
+    deferred.schedule('preview', done.append, 'b')
+    deferred.schedule('tabline', done.append, 't')
+    deferred.schedule('status', done.append, 's')
+    deferred.cancel('status')
+    # Superseded calls are coalesced
+    assert len(calls) == 3
+    for func, args in calls:
+        func(*args)
+    assert done == ['b', 't']
+
+
+def test_buffer_pool():
+    created = []
+    wiped = []
+
+    class Buffer:
+        name = ''
+
+        def __init__(self, number):
+            self.number = number
+            self.requests = []
+
+        def request(self, *args):
+            self.requests.append(args)
+
+    class Vim:
+        def request(self, name, *args):
+            buf = Buffer(len(created) + 1)
+            created.append(buf)
+            return buf
+
+        def command(self, cmd):
+            wiped.append(cmd)
+
+    pool = BufferPool(Vim(), size=1)
+    buf1, buf2 = pool.acquire(), pool.acquire()
+    assert len(created) == 2
+    pool.release(buf1)
+    # Renaming would leave a buffer with the old name behind
+    assert buf1.name == ''
+    assert ('nvim_buf_set_lines', 0, -1, False, []) in buf1.requests
+    # The pool is full
+    pool.release(buf2)
+    assert wiped == ['bwipeout! 2']
+    assert pool.acquire() is buf1
+    assert len(created) == 2
+
+
+def test_column_providers(tree, capsys):
+    png = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + \
+        (640).to_bytes(4, 'big') + (480).to_bytes(4, 'big')
+    assert mime_type(png) == 'image/png'
+    assert image_size(png) == (640, 480)
+    assert image_size(b'GIF89a\x10\x00\x20\x00') == (16, 32)
+    assert image_size(b'GIF89a\x01') is None
+    assert image_size(png[:20]) is None
+    assert mime_type(b'hello') == 'text/plain'
+    assert mime_type(b'\x00\xff\xfe') == 'application/octet-stream'
+    assert cli_main(['--sort', 'size', '--columns', 'lines,mime',
+                     '--color', 'never', str(tree)]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert any(l.startswith('      1 text/plain') and l.endswith(' bb')
+               for l in lines)
+
+
+def test_column_cache(tree, monkeypatch):
+    submitted = []
+    updated = []
+
+    class Worker:
+        def submit(self, func, *args, callback):
+            submitted.append((func, args, callback))
+
+    cache = ColumnCache(Worker(), updated.append)
+    path = str(tree / 'bb')
+    stat_res = os.stat(path)
+    assert cache.get('lines', path, stat_res) is None
+    assert cache.get('lines', path, stat_res) is None
+    assert cache.get('lines', str(tree), os.stat(str(tree))) == ''
+    cache.submit()
+    assert len(submitted) == 1
+    func, args, callback = submitted[0]
+    callback(func(*args))
+    assert updated == [{str(tree)}]
+    assert cache.get('lines', path, stat_res) == '1'
+    (tree / 'bb').write_text('a\nb\nc\n')
+    # The file changed
+    assert cache.get('lines', path, os.stat(path)) is None
+    # Failing providers don't leave values pending
+    monkeypatch.setitem(providers, 'broken', lambda *args: 1 / 0)
+    assert cache.get('broken', path, stat_res) is None
+    cache.submit()
+    func, args, callback = submitted[-1]
+    callback(func(*args))
+    assert cache.get('broken', path, stat_res) == '?'
+
+
+def test_symlink_resolver(tree):
+    os.symlink('bb', str(tree / 'link'))
+    os.symlink('link', str(tree / 'chain'))
+    os.symlink('missing', str(tree / 'orphan'))
+    os.symlink('loop2', str(tree / 'loop1'))
+    os.symlink('loop1', str(tree / 'loop2'))
+    resolver = SymlinkResolver()
+
+    def resolve(name):
+        path = str(tree / name)
+        return resolver.resolve(path, os.lstat(path))
+
+    chain = resolve('chain')
+    assert chain.target == 'link'
+    assert chain.stat.st_ino == (tree / 'bb').stat().st_ino
+    assert not chain.orphan
+    assert resolve('orphan').orphan
+    assert resolve('loop1').loop and resolve('loop1').orphan
+    # Cached until invalidated
+    (tree / 'missing').touch()
+    assert resolve('orphan').orphan
+    resolver.invalidate()
+    assert not resolve('orphan').orphan
+
+
+def test_format_line_orphan(tree, monkeypatch):
+    os.symlink('missing', str(tree / 'orphan'))
+    path = str(tree / 'orphan')
+    stat_res = os.lstat(path)
+    monkeypatch.setenv('LS_COLORS', 'ln=target')
+    hl_group = ColorManager().file_hl_group(Path(path), stat_res)
+    assert hl_group == 'NvfmOrphan'
+    line, hls = format_line(path, stat_res, hl_group, '', lambda x: '')
+    assert line.endswith('orphan -> missing')
+    monkeypatch.setenv('LS_COLORS', 'or=01;31')
+    assert ColorManager().file_hl_group(Path(path), stat_res) == 'color01_31'
+    # Links are resolved for all kinds of entries
+    entry, = [e for e in os.scandir(str(tree)) if e.name == 'orphan']
+    row = make_row(entry)
+    for item in [entry, CachedEntry(str(tree), row),
+                 FlatEntry('orphan', entry)]:
+        assert ColorManager().file_hl_group(item, stat_res) == 'color01_31'
+
+
+def test_directory_view_projection(tree):
+    (tree / '.hidden').touch()
+    (tree / 'build').mkdir()
+    (tree / '.gitignore').write_text('build/\n')
+    session = SimpleNamespace(options=Options(), ignore=IgnoreCache())
+    session.options['sort'] = 'size'
+
+    def names(items):
+        return sorted(i.name for i in items)
+
+    entries, items, *_, projection = DirectoryView.load(session, tree)
+    assert names(items) == names(entries)
+    assert projection == (True, True)
+    session.options['show_hidden'] = False
+    session.options['show_ignored'] = False
+    entries, items, *_ = DirectoryView.load(session, tree)
+    assert names(items) == ['aa1', 'bb', 'cc', 'dd', 'ee']
+    assert '.hidden' in names(entries) and 'build' in names(entries)
+    # Changes of ignore files are picked up
+    (tree / '.gitignore').write_text('bb\n')
+    os.utime(str(tree / '.gitignore'), (0, 0))
+    _, items, *_ = DirectoryView.load(session, tree)
+    assert 'bb' not in names(items) and 'build' in names(items)
+
+
+def test_entry_table(tmp_path):
+    make_tree(tmp_path, '''
+    dir/
+    large=0123456789
+    small=0
+    .hidden=01234
+    ''')
+
+    def keep(entry):
+        return not entry.name.startswith('.')
+
+    path_str = str(tmp_path)
+    table = EntryTable.from_entries(path_str, os.scandir(path_str), keep)
+    assert sorted(table.names()) == ['.hidden', 'dir', 'large', 'small']
+    for entry in table:
+        assert entry.path == os.path.join(path_str, entry.name)
+        lstat_res = os.lstat(entry.path)
+        assert entry.stat(follow_symlinks=False).st_size == lstat_res.st_size
+        assert entry.inode() == lstat_res.st_ino
+        assert entry.is_dir() == os.path.isdir(entry.path)
+    # Rejected entries are stat'ed when needed
+    hidden, = table.filter(lambda e: not keep(e))
+    assert hidden.stat().st_size == 5
+    by_size = table.filter(keep).sorted('st_size')
+    assert by_size.names() == ['small', 'large', 'dir']
+    assert by_size.reversed().names() == by_size.names()[::-1]
+    assert [e.name for e in by_size[1:]] == ['large', 'dir']
+    rows = [make_row(e, e.num_children) for e in table]
+    restored = EntryTable.from_rows(path_str, rows)
+    assert [make_row(e, e.num_children) for e in restored] == rows
+    # Entries that can't be stat'ed raise their error
+    gone = SimpleNamespace(
+        name='gone', inode=lambda: 0, is_symlink=lambda: False,
+        is_dir=lambda follow_symlinks: False,
+        stat=lambda follow_symlinks: os.lstat(os.path.join(path_str, 'gone')))
+    table = EntryTable.from_entries(path_str, [gone])
+    with pytest.raises(OSError):
+        table[0].stat()
+    assert table.sorted('st_size').names() == ['gone']
+
+
+def _unsorted(items):
+    return items
+
+
+_unsorted.needs_stat = False
+
+
+def test_format_entry_table_links(tmp_path, monkeypatch):
+    monkeypatch.setenv('LS_COLORS', 'ln=target')
+    make_tree(tmp_path, '''
+    target=abc
+    ''')
+    (tmp_path / 'good').symlink_to('target')
+    (tmp_path / 'bad').symlink_to('missing')
+    options = Options()
+    options['sort'] = 'size'
+    path_str = str(tmp_path)
+    table = EntryTable.from_entries(path_str, os.scandir(path_str))
+    lines = {entry.name: (line, hls) for entry, line, hls, _ in
+             format_entries(table, ColorManager(),
+                            options['columns'].template,
+                            options['time_format'].value)}
+    assert lines['good'][0].endswith('good -> target')
+    line, hls = lines['bad']
+    assert line.endswith('bad -> missing')
+    assert hls[0][0] == 'NvfmOrphan'
+
+
+def test_listing_plan(tmp_path):
+    make_tree(tmp_path, '''
+    dir/
+        file
+    file=abc
+    ''')
+    options = Options()
+    assert ListingPlan.from_options(options) == (True, False, True)
+    options['columns'] = ['git']
+    options['sort'] = 'size'
+    assert ListingPlan.from_options(options) == (False, True, False)
+    options['sort'] = _unsorted
+    plan = ListingPlan.from_options(options)
+    assert not plan.stat
+    path_str = str(tmp_path)
+    table = EntryTable.from_entries(path_str, os.scandir(path_str),
+                                    stat=False)
+    lines = sorted(line for _, line, _, _ in format_entries(
+        table, ColorManager(), options['columns'].template,
+        options['time_format'].value, plan=plan))
+    assert lines == ['   dir/', '   file']
+    # Nothing was stat'ed
+    assert len(table._unstated) == 2
+
+
+def test_progressive_rendering(tmp_path, monkeypatch):
+    monkeypatch.setattr(directory_view, 'UPGRADE_CHUNK', 4)
+    for i in range(12):
+        (tmp_path / ('f%02d' % i)).write_text('x' * i)
+    scheduled = {}
+
+    class Buffer:
+        def __init__(self):
+            self.lines = []
+
+        def __setitem__(self, key, lines):
+            self.lines[key] = lines
+
+        def request(self, name, *args):
+            if name == 'nvim_buf_set_lines':
+                start, stop, _, lines = args
+                self.lines[start:stop] = lines
+
+        def add_highlight(self, *args, **kwargs):
+            pass
+
+    session = SimpleNamespace(
+        options=Options(), ignore=IgnoreCache(), panels=[], marks=set(),
+        colors=ColorManager(), buffers=SimpleNamespace(acquire=Buffer),
+        events=SimpleNamespace(manage=lambda *args, **kwargs: None),
+        deferred=SimpleNamespace(
+            schedule=lambda key, func: scheduled.update({key: func})))
+    session.options['sort'] = _unsorted
+    session.options['progressive_threshold'] = 5
+    vim = SimpleNamespace(request=lambda *args: 1)
+    view = DirectoryView(session, vim, tmp_path)
+    view.protocol_init()
+    # Only the columns need a stat, so large directories aren't stat'ed
+    assert len(view.items._unstated) == 12
+    view.draw()
+    assert view.buf.lines[1].strip() == view.items[1].name
+    assert view.buf.lines[0].strip() != view.items[0].name
+    while scheduled:
+        scheduled.popitem()[1]()
+    assert not view.items._unstated
+    lines = view.buf.lines
+    session.options['progressive_threshold'] = 100
+    view.draw()
+    assert view.buf.lines == lines
+
+
+def test_tree_view(tree):
+    session = SimpleNamespace(
+        options=Options(), ignore=IgnoreCache(), panels=[],
+        buffers=SimpleNamespace(acquire=lambda: None),
+        events=SimpleNamespace(manage=lambda *args, **kwargs: None))
+    session.options['sort'] = 'size'
+
+    class Views(dict):
+        def __missing__(self, path):
+            view = self[path] = DirectoryView(session, None, path)
+            return view
+
+    session.views = Views()
+    view = TreeView(session, None, tree)
+    view.protocol_init()
+    view.focused_item = tree / 'ee'
+    view.toggle_expand()
+    rows = [(Path(i.path).relative_to(tree), d)
+            for i, d in zip(view.items, view._depths)]
+    assert (Path('ee/gg'), 1) in rows
+    assert len(rows) == 5 + 3
+    assert view.focused_item == tree / 'ee'
+    # The expanded directory was listed through the shared views
+    assert session.views[tree / 'ee'].items
+    view.focused_item = tree / 'ee/gg'
+    view.toggle_expand()
+    assert len(view.items) == 5 + 3 + 6
+    view.focused_item = tree / 'ee'
+    view.toggle_expand()
+    assert len(view.items) == 5
+
+
+def test_tree_view_reload(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub/a').write_text('')
+    session = SimpleNamespace(
+        options=Options(), ignore=IgnoreCache(), panels=[],
+        buffers=SimpleNamespace(acquire=lambda: None),
+        events=SimpleNamespace(manage=lambda *args, **kwargs: None))
+    session.options['sort'] = 'size'
+    session.views = Views(session, None)
+    view = TreeView(session, None, tmp_path)
+    session.views.add_derived(view)
+    view.protocol_init()
+    # The root is listed through its regular view
+    assert view.items is session.views[tmp_path].items
+    view.focused_item = tmp_path / 'sub'
+    view.toggle_expand()
+    assert session.views.showing(tmp_path / 'sub') == \
+        [session.views[tmp_path / 'sub'], view]
+    assert not session.views.showing(tmp_path / 'other')
+    (tmp_path / 'sub/b').write_text('')
+    # Like after a job in the expanded directory
+    for changed in session.views.showing(tmp_path / 'sub'):
+        changed.dirty = 2
+    view.protocol_init()
+    view._build_rows()
+    assert sorted(i.name for i in view.items) == ['a', 'b', 'sub']
+    assert view.focused_item == tmp_path / 'sub'
+    session.views.mark_all_dirty()
+    assert view.dirty == 2
+
+
+def test_flat_view(tree, monkeypatch):
+    monkeypatch.setattr(flat_view, 'FLAT_TOP_K', 3)
+    calls = queue.Queue()
+
+    class Vim:
+        def async_call(self, func, *args):
+            calls.put((func, args))
+
+    session = SimpleNamespace(
+        options=Options(), ignore=IgnoreCache(), panels=[],
+        buffers=SimpleNamespace(acquire=lambda: None),
+        events=SimpleNamespace(manage=lambda *args, **kwargs: None),
+        deferred=SimpleNamespace(schedule=lambda *args: None))
+    session.options['sort'] = 'last_modified'
+    (tree / 'cc/x').touch()
+    for path in tree.glob('**/*'):
+        os.utime(str(path), (0, 0))
+    for i, path in enumerate(['bb', 'ee/gg/cc', 'aa1/aa2/aa3', 'cc/x']):
+        os.utime(str(tree / path), (0, 1000 + i))
+    view = FlatView(session, Vim(), tree, depth=3)
+    view.protocol_init()
+    while True:
+        func, args = calls.get(timeout=5)
+        func(*args)
+        if func == view._finish:
+            break
+    assert [i.name for i in view.items] == ['cc/x', 'aa1/aa2/aa3', 'ee/gg/cc']
+    assert view._prefixes()[str(tree / 'cc/x')] == 'cc/'
+    view.focused_item = tree / 'aa1/aa2/aa3'
+    assert view.focus == 2
+    assert view.shows(tree / 'ee/gg') and not view.shows(tree / 'ee/gg/aa')
+    # Children are counted by the walk, also below the last level
+    counts = {rel: num for rel, _, _, num in walk(tree, entries=True,
+                                                    max_depth=1)}
+    assert counts['ee'] == len(os.listdir(str(tree / 'ee')))
+    assert counts['bb'] is None
+
+
+def test_flat_view_filter(tmp_path):
+    for name in ['xa', 'b', 'xc', 'd']:
+        (tmp_path / name).write_text('')
+    commands = []
+
+    class Buffer(list):
+        def add_highlight(self, *args, **kwargs):
+            pass
+
+    session = SimpleNamespace(
+        options=Options(), ignore=IgnoreCache(), panels=[],
+        colors=ColorManager(), buffers=SimpleNamespace(acquire=Buffer),
+        events=SimpleNamespace(manage=lambda *args, **kwargs: None))
+    view = FlatView(session, SimpleNamespace(command=commands.append),
+                    tmp_path)
+    view._entries, view.items = [], []
+    view.filter(lambda query, item: query in item.name, 'x')
+    entries = sorted(os.scandir(str(tmp_path)), key=lambda e: e.name)
+    view._add_batch(None, [FlatEntry(e.name, e) for e in entries[:1]])
+    view._add_batch(None, [FlatEntry(e.name, e) for e in entries[1:]])
+    # Appended lines that don't match are folded
+    assert [c for c in commands if c.endswith('fold')] == [':2,2fold']
+
+
+def test_opener(tmp_path, monkeypatch):
+    (tmp_path / 'doc.PDF').write_bytes(b'%PDF-1.4')
+    (tmp_path / 'image').write_bytes(b'\x89PNG\r\n\x1a\n')
+    (tmp_path / 'notes.txt').write_text('text')
+    options = Options()
+    options['open_rules'] = [['*.pdf', 'zathura'], ['image/*', 'feh {} -F']]
+    opener_ = Opener(options)
+    computed = []
+
+    def compute(name, path, stat_res):
+        computed.append(path)
+        return mime_type(open(path, 'rb').read())
+    monkeypatch.setattr(opener, 'compute', compute)
+
+    def command(name):
+        path = tmp_path / name
+        return opener_.command(path, os.stat(str(path)))
+
+    assert command('doc.PDF') == 'zathura'
+    assert command('image') == 'feh {} -F'
+    assert command('notes.txt') == EDIT
+    assert command('image') == 'feh {} -F'
+    # Lookups are cached
+    assert len(computed) == 2
+    options['open_rules'] = []
+    assert command('image') == EDIT
+    assert command_args('feh {} -F', '/a b') == ['feh', '/a b', '-F']
+    assert command_args('zathura --fork', '/a') == ['zathura', '--fork', '/a']
+    monkeypatch.setenv('EDITOR', 'vim -p')
+    assert editor_args('/a', 3) == ['vim', '-p', '+3', '/a']
+
+
+def test_quit_detaches_server_uis():
+    calls = []
+    vim = SimpleNamespace(
+        command=lambda cmd: calls.append(cmd),
+        api=SimpleNamespace(list_uis=lambda: [{'chan': 3}, {'chan': 0}]),
+        funcs=SimpleNamespace(chanclose=lambda chan: calls.append(chan)))
+    plugin = Plugin(vim)
+    plugin._s = SimpleNamespace(
+        server=True, frecency=SimpleNamespace(flush=lambda: None))
+    plugin.func_nvfm_quit([])
+    assert calls == [3]
+    plugin._s.server = False
+    plugin.func_nvfm_quit([])
+    assert calls == [3, 'qall!']
+    # Another UI is attached
+    assert plugin.func_nvfm_attach(['/']) == 0
+
+
+def test_comparison(tmp_path):
+    left, right = tmp_path / 'left', tmp_path / 'right'
+    left.mkdir()
+    right.mkdir()
+    make_tree(left, '''
+    same=a
+    touched=b
+    changed=c
+    same_time=e
+    bigger=x
+    only_left
+    sub/
+        inner=i
+    left_dir/
+        child
+    ''')
+    make_tree(right, '''
+    same=a
+    touched=b
+    changed=d
+    same_time=f
+    bigger=xx
+    only_right
+    sub/
+    ''')
+    for name in ['same', 'touched', 'changed', 'same_time', 'bigger']:
+        os.utime(str(left / name), (0, 1000))
+        os.utime(str(right / name),
+                 (0, 1000 if name in ('same', 'same_time') else 2000))
+    results = []
+    done = threading.Event()
+    comparison = Comparison(left, right)
+    comparison.start(results.extend, done.set)
+    assert done.wait(30)
+    assert sorted(results) == [
+        ('bigger', 'different', False),
+        ('changed', 'different', False),
+        ('left_dir', 'left', True),
+        ('only_left', 'left', False),
+        ('only_right', 'right', False),
+        ('same', 'identical', False),
+        # Modified at the same time, but the contents differ
+        ('same_time', 'different', False),
+        ('sub/inner', 'left', False),
+        ('touched', 'touched', False),
+    ]